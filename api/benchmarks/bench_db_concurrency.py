@@ -0,0 +1,70 @@
+# api/benchmarks/bench_db_concurrency.py
+# 同期エンジンのクエリをイベントループ上で実行した場合と、非同期エンジン（asyncpg）の場合で
+# 同時リクエストのスループットを比較する
+# 各リクエストは SELECT pg_sleep(...) でDBの待ち時間を再現する
+# async のレイテンシには、接続プール（DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW）の空き待ちも含まれる
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_db_concurrency.py
+import asyncio
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from sqlalchemy import text
+
+from database import async_engine, engine
+
+CONCURRENCY = 50
+REQUESTS = 500
+QUERY_SECONDS = 0.01
+
+QUERY = text("SELECT pg_sleep(:seconds)")
+
+
+async def sync_request():
+    # async def のエンドポイントから同期セッションを使っていたときと同じく、待ち時間の間イベントループが止まる
+    with engine.connect() as connection:
+        connection.execute(QUERY, {"seconds": QUERY_SECONDS})
+
+
+async def async_request():
+    async with async_engine.connect() as connection:
+        await connection.execute(QUERY, {"seconds": QUERY_SECONDS})
+
+
+async def measure(name, request):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - started)
+
+    # 接続プールを温めてから計測する
+    await asyncio.gather(*(one() for _ in range(CONCURRENCY)))
+    latencies.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<6} {REQUESTS / elapsed:8.0f} req/s  p50 {p50:7.2f} ms  p95 {p95:7.2f} ms")
+
+
+async def run():
+    engine.echo = False
+    async_engine.echo = False
+    print(f"{REQUESTS} requests, concurrency {CONCURRENCY}, {QUERY_SECONDS * 1000:.0f} ms per query")
+    await measure("sync", sync_request)
+    await measure("async", async_request)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
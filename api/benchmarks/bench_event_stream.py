@@ -0,0 +1,208 @@
+# api/benchmarks/bench_event_stream.py
+# /api/events（Server-Sent Events）の待機中の接続のコストと、変更の配信の速さを計測する
+# - APIサーバーを2つ（別々のプロセス＝ワーカー）起動し、共有キャッシュのバックエンド（FakeRedis）でつなぐ
+# - ワーカーAに待機中の接続を --connections 本開き、接続1本あたりのメモリ（ワーカーAのRSSの増分）を出す
+# - ワーカーBでレイアウトを保存し（PATCH /api/layout）、ワーカーAにあるそのユーザーの接続すべてに
+#   layout イベントが届くまでの時間を計測する（ワーカーをまたいだ配信）
+# 外部サービスはローカルの代用（stand_ins.py）を使う。接続数だけファイルディスクリプタが必要（ulimit -n）
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_evt_ で始まるユーザーを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_event_stream.py [--connections 10000] [--rounds 20]
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+import httpx
+
+from load_test import free_port
+from stand_ins import FakeClerkIssuer, FakeRedis, FakeStripe
+
+USERS = 1000
+# 配信を計測するユーザー（このユーザーの接続は CONNECTIONS_PER_MEASURED_USER 本）
+MEASURED_USER = "bench_evt_0"
+CONNECTIONS_PER_MEASURED_USER = 5
+OPEN_BATCH = 500
+
+
+def setup_database() -> None:
+    from sqlmodel import Session, SQLModel
+
+    from database import engine
+    from models import User
+
+    SQLModel.metadata.create_all(engine)
+    cleanup_database()
+    with Session(engine) as session:
+        session.add_all([User(user_id=f"bench_evt_{n}", email=f"bench_evt_{n}@example.com") for n in range(USERS)])
+        session.commit()
+
+
+def cleanup_database() -> None:
+    from sqlalchemy import text
+
+    from database import engine
+
+    with engine.begin() as conn:
+        users = """SELECT id FROM "user" WHERE user_id LIKE 'bench_evt_%'"""
+        conn.execute(text(f"DELETE FROM layoutitem WHERE user_id IN ({users})"))
+        conn.execute(text(f"DELETE FROM userlayout WHERE user_id IN ({users})"))
+        conn.execute(text("""DELETE FROM "user" WHERE user_id LIKE 'bench_evt_%'"""))
+
+
+def rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmRSS not found")
+
+
+def start_worker(env: dict, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        cwd=common.API_DIR, env=env,
+    )
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=10) as client:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {process.returncode}")
+            try:
+                if client.get("/readyz").status_code == 200:
+                    return process
+            except httpx.TransportError:
+                pass
+            time.sleep(0.05)
+
+
+class Stream:
+    """/api/events の1本の接続（HTTP/1.1 の生のソケットで読み、受け取ったイベントを探す）"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.received = asyncio.Event()
+
+    @classmethod
+    async def open(cls, port: int, token: str) -> "Stream":
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"GET /api/events HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n"
+            f"Accept: text/event-stream\r\n\r\n".encode()
+        )
+        head = await reader.readuntil(b"\r\n\r\n")
+        if b" 200 " not in head.split(b"\r\n", 1)[0]:
+            raise RuntimeError(f"unexpected response: {head[:200]!r}")
+        return cls(reader, writer)
+
+    async def watch(self) -> None:
+        while chunk := await self.reader.read(65536):
+            if b"event: layout" in chunk:
+                self.received.set()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+async def open_streams(port: int, tokens: list, connections: int) -> list:
+    # 計測するユーザーの接続を先頭に、残りは他のユーザーに均等に割り当てる
+    owners = [0] * CONNECTIONS_PER_MEASURED_USER
+    owners += [1 + n % (USERS - 1) for n in range(connections - len(owners))]
+    streams = []
+    for start in range(0, len(owners), OPEN_BATCH):
+        batch = owners[start:start + OPEN_BATCH]
+        streams += await asyncio.gather(*(Stream.open(port, tokens[owner]) for owner in batch))
+    return streams
+
+
+async def run(args, issuer: FakeClerkIssuer, port_a: int, port_b: int, pid_a: int):
+    tokens = [issuer.sign(f"bench_evt_{n}") for n in range(USERS)]
+    rss_before = rss_kib(pid_a)
+    started = time.perf_counter()
+    streams = await open_streams(port_a, tokens, args.connections)
+    opened = time.perf_counter() - started
+    watchers = [asyncio.ensure_future(stream.watch()) for stream in streams]
+    # 接続ごとの確保が落ち着くのを待ってから計測する
+    await asyncio.sleep(1)
+    rss_after = rss_kib(pid_a)
+    print(f"{args.connections} idle streams on worker A opened in {opened:.1f} s")
+    print(
+        f"worker A RSS {rss_before / 1024:.1f} MiB -> {rss_after / 1024:.1f} MiB"
+        f"  ({(rss_after - rss_before) / args.connections:.1f} KiB per stream)"
+    )
+
+    measured = streams[:CONNECTIONS_PER_MEASURED_USER]
+    latencies = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port_b}", timeout=10) as client:
+        headers = {"Authorization": f"Bearer {tokens[0]}"}
+        for round_ in range(args.rounds):
+            for stream in measured:
+                stream.received.clear()
+            patch = {"upserts": [{"i": "chart-0", "breakpoint": "lg", "x": round_ % 12, "y": 0, "w": 4, "h": 3,
+                                  "symbol": "TRADU:7203", "label": "Chart"}]}
+            request_started = time.perf_counter()
+            (await client.patch("/api/layout", json=patch, headers=headers)).raise_for_status()
+            # 保存の応答までの時間も含め、worker A の全接続に届くまで
+            await asyncio.wait_for(asyncio.gather(*(stream.received.wait() for stream in measured)), timeout=5)
+            latencies.append(time.perf_counter() - request_started)
+    latencies.sort()
+    print(
+        f"PATCH on worker B -> layout event on {CONNECTIONS_PER_MEASURED_USER} streams on worker A:"
+        f" p50 {statistics.median(latencies) * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms ({args.rounds} rounds)"
+    )
+
+    for watcher in watchers:
+        watcher.cancel()
+    for stream in streams:
+        stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/events の待機中の接続のコストと配信の速さのベンチマーク")
+    parser.add_argument("--connections", type=int, default=10000, help="ワーカーAに開く待機中の接続数")
+    parser.add_argument("--rounds", type=int, default=20, help="配信を計測する回数")
+    args = parser.parse_args()
+
+    issuer = FakeClerkIssuer()
+    stripe = FakeStripe()
+    redis = FakeRedis()
+    env = {
+        **os.environ,
+        "CLERK_JWT_ISSUER": issuer.url,
+        "STRIPE_API_KEY": "sk_test_bench",
+        "STRIPE_API_BASE": stripe.url,
+        "CACHE_URL": redis.url,
+        "CACHE_NAMESPACE": f"bench-evt-{time.time_ns()}",
+        "DATABASE_ECHO": "false",
+        "WEBHOOK_WORKERS": "0",
+        "EVENT_STREAM_MAX_CONNECTIONS": str(args.connections + 100),
+    }
+    os.environ["DATABASE_ECHO"] = "false"
+    setup_database()
+    port_a, port_b = free_port(), free_port()
+    workers = [start_worker(env, port_a), start_worker(env, port_b)]
+    try:
+        asyncio.run(run(args, issuer, port_a, port_b, workers[0].pid))
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        cleanup_database()
+        issuer.close()
+        stripe.close()
+        redis.close()
+
+
+if __name__ == "__main__":
+    main()
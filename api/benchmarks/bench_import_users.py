@@ -0,0 +1,66 @@
+# api/benchmarks/bench_import_users.py
+# ClerkのエクスポートをNDJSONで生成し、import_users.py で取り込む速度（rows/s）と最大メモリ使用量を計測する
+# 2回目は同じファイルを取り込み直し、変更がない場合の速度を見る
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_ で始まるユーザーを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_import_users.py [ユーザー数]
+import json
+import os
+import resource
+import sys
+import tempfile
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+from database import engine
+from import_users import import_users
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+
+def write_export(path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(USERS):
+            user = {
+                "id": f"bench_import_{n}",
+                "primary_email_address_id": f"idn_{n}",
+                "email_addresses": [{"id": f"idn_{n}", "email_address": f"bench_{n}@example.com"}],
+                "first_name": "Bench",
+                "last_name": str(n),
+            }
+            f.write(json.dumps(user) + "\n")
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("""DELETE FROM "user" WHERE user_id LIKE 'bench_import_%'"""))
+
+
+def run():
+    engine.echo = False
+    SQLModel.metadata.create_all(engine)
+    cleanup()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "users.ndjson")
+        write_export(path)
+        print(f"{USERS} users, export {os.path.getsize(path) / 1024 / 1024:.0f} MiB")
+
+        for name in ("initial", "unchanged"):
+            stats = import_users(path)
+            print(
+                f"{name:<10} {stats['read'] / stats['seconds']:8.0f} rows/s"
+                f"  inserted {stats['inserted']}, updated {stats['updated']} in {stats['seconds']:.1f}s"
+            )
+
+    # Linuxでは KiB 単位
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    cleanup()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+# api/benchmarks/bench_layout_storage.py
+# 行ごとの保存（rows）と、ユーザーごとのJSONBドキュメント（document）の読み書きのレイテンシを比較する
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_ で始まるユーザーを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_layout_storage.py
+import asyncio
+import statistics
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from sqlalchemy import delete, select
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import async_engine
+from layout_store import DocumentLayoutStore, RowLayoutStore
+from models import LayoutItem, User, UserLayout
+
+USERS = 20
+CHARTS_PER_USER = 60
+BREAKPOINTS = ("lg", "md", "sm", "xs", "xxs")
+ROUNDS = 100
+
+
+def make_layout(seed: int):
+    return {
+        breakpoint: [
+            {"i": f"chart_{n}", "x": (n * 4) % 12, "y": n // 3 * 4, "w": 4, "h": 4,
+             "symbol": f"TRADU:{1000 + n}", "label": f"銘柄 {n}"}
+            for n in range(CHARTS_PER_USER)
+        ]
+        for breakpoint in BREAKPOINTS
+    }
+
+
+async def cleanup():
+    async with AsyncSession(async_engine) as session:
+        user_ids = select(User.id).where(User.user_id.like("bench_%"))
+        await session.execute(delete(LayoutItem).where(LayoutItem.user_id.in_(user_ids)))
+        await session.execute(delete(UserLayout).where(UserLayout.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.user_id.like("bench_%")))
+        await session.commit()
+
+
+def percentile(timings, q):
+    return sorted(timings)[max(0, int(len(timings) * q) - 1)] * 1000
+
+
+async def measure(name, store, user_ids):
+    async def timed(operation):
+        timings = []
+        for n in range(ROUNDS):
+            user_id = user_ids[n % len(user_ids)]
+            async with AsyncSession(async_engine) as session:
+                user = await session.get(User, user_id)
+                started = time.perf_counter()
+                await operation(session, user, n)
+                await session.commit()
+                timings.append(time.perf_counter() - started)
+        return timings
+
+    async def move_one(session, user, n):
+        item = {"i": "chart_0", "x": n % 12, "y": 0, "w": 4, "h": 4, "symbol": "TRADU:1000", "label": "銘柄 0"}
+        await store.apply_changes(session, user, {("chart_0", "lg"): item}, set())
+
+    async def replace_all(session, user, n):
+        await store.replace(session, user, make_layout(n))
+
+    for operation_name, operation in (
+        ("read", lambda session, user, n: store.read(session, user)),
+        ("patch 1 item", move_one),
+        ("replace all", replace_all),
+    ):
+        timings = await timed(operation)
+        print(
+            f"{name:<9} {operation_name:<13} p50 {statistics.median(timings) * 1000:7.2f} ms"
+            f"  p95 {percentile(timings, 0.95):7.2f} ms"
+        )
+
+
+async def run():
+    async_engine.echo = False
+    async with async_engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    await cleanup()
+
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        users = [User(user_id=f"bench_{n}", email=f"bench_{n}@example.com") for n in range(USERS)]
+        session.add_all(users)
+        await session.commit()
+        user_ids = [user.id for user in users]
+
+    print(f"{USERS} users x {CHARTS_PER_USER} charts x {len(BREAKPOINTS)} breakpoints")
+    for name, store in (("rows", RowLayoutStore()), ("document", DocumentLayoutStore())):
+        for user_id in user_ids:
+            async with AsyncSession(async_engine) as session:
+                await store.replace(session, await session.get(User, user_id), make_layout(user_id))
+                await session.commit()
+        await measure(name, store, user_ids)
+
+    await cleanup()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
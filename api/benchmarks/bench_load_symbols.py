@@ -0,0 +1,58 @@
+# api/benchmarks/bench_load_symbols.py
+# カテゴリごとの銘柄リストを生成し、load_symbols.py の sync_symbols で反映する時間を計測する
+# 初回（全件追加）・変更なし・約1%の変更（ラベル変更・追加・削除）の3パターンを比べる
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_ カテゴリの銘柄を作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_load_symbols.py [銘柄数]
+import sys
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel
+
+from database import engine
+from load_symbols import sync_symbols
+
+SYMBOLS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+CATEGORIES = ["bench_japan", "bench_us", "bench_fx", "bench_index"]
+
+
+def generate(changed: bool = False):
+    symbols = {category: [] for category in CATEGORIES}
+    for n in range(SYMBOLS):
+        # 約1%: 0.5%はラベルを変更し、0.25%は削除して別の銘柄に入れ替える
+        if changed and n % 400 == 0:
+            symbols[CATEGORIES[n % 4]].append((f"Bench Symbol {n} (new)", f"BENCH:N{n}"))
+            continue
+        label = f"Bench Symbol {n}" + (" renamed" if changed and n % 200 == 1 else "")
+        symbols[CATEGORIES[n % 4]].append((label, f"BENCH:{n}"))
+    return symbols
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM symbol WHERE category LIKE 'bench_%'"))
+
+
+def run():
+    engine.echo = False
+    SQLModel.metadata.create_all(engine)
+    cleanup()
+
+    for name, symbols in (("initial", generate()), ("unchanged", generate()), ("changed", generate(changed=True))):
+        with Session(engine) as session:
+            stats = sync_symbols(session, symbols)
+            session.commit()
+        print(
+            f"{name:<10} {stats['seconds'] * 1000:8.0f} ms"
+            f"  inserted {stats['inserted']}, updated {stats['updated']}, deleted {stats['deleted']}"
+            f"  (catalog version: {stats['version'] or 'unchanged'})"
+        )
+
+    cleanup()
+
+
+if __name__ == "__main__":
+    run()
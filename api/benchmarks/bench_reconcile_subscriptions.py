@@ -0,0 +1,117 @@
+# api/benchmarks/bench_reconcile_subscriptions.py
+# Stripeの代用（FakeStripe）に有効なサブスクリプションを用意し、reconcile_subscriptions.py の照合の速度・API呼び出し回数・最大メモリ使用量を計測する
+# ユーザーの一部にずれ（サブスクの欠落・解約済みのサブスクの残り・期間の終了日時・解約予約）を入れ、検出した件数が一致するかを確かめる
+# 2回目はずれを直した後の照合（差分なし）を計測する。Stripeの代用は1秒あたりの呼び出し回数を制限し、429からの再試行も確かめる
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_rec_ で始まるユーザーを作成・削除する。
+# 照合はStripeの顧客IDを持つすべてのユーザーが対象のため、他のユーザーのサブスクの状態も書き換わる）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_reconcile_subscriptions.py [ユーザー数]
+import io
+import logging
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+import migrate
+from database import engine
+from reconcile_subscriptions import format_stats, reconcile_subscriptions
+from stand_ins import FakeStripe
+from stripe_gateway import StripeGateway
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+# ずれを入れる割合（種類ごと）
+DRIFT_EVERY = 20
+RATE_LIMIT = 10
+
+
+def build(period_end: int):
+    """ユーザーの行（COPY用）とStripeのサブスクリプション、種類ごとのずれの件数を作る"""
+    users = io.StringIO()
+    subscriptions = []
+    expected = {"missing": 0, "stale": 0, "end_date": 0, "cancel_at_period_end": 0}
+    end = datetime.fromtimestamp(period_end, tz=timezone.utc).isoformat()
+    for n in range(USERS):
+        subscription_id, kind = f"sub_bench_rec_{n:08d}", n % DRIFT_EVERY
+        db_subscription, db_end, db_cancel = subscription_id, end, "f"
+        if kind == 1:
+            db_subscription, db_end = "", ""
+            expected["missing"] += 1
+        elif kind == 3:
+            db_end = datetime.fromtimestamp(period_end - 86400, tz=timezone.utc).isoformat()
+            expected["end_date"] += 1
+        elif kind == 4:
+            db_cancel = "t"
+            expected["cancel_at_period_end"] += 1
+        if kind == 2:
+            # Stripeでは解約済み（一覧に出てこない）
+            expected["stale"] += 1
+        else:
+            subscriptions.append({
+                "id": subscription_id, "object": "subscription", "customer": f"cus_bench_rec_{n}",
+                "status": "active", "cancel_at_period_end": False, "created": period_end - 30 * 86400,
+                "items": {"object": "list", "data": [{"current_period_end": period_end}]},
+            })
+        users.write(
+            f"bench_rec_{n},bench_rec_{n}@example.com,f,cus_bench_rec_{n},{db_subscription},{db_end},"
+            f"{'active' if db_subscription else ''},{db_cancel}\n"
+        )
+    users.seek(0)
+    return users, subscriptions, expected
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("""DELETE FROM "user" WHERE user_id LIKE 'bench_rec_%'"""))
+
+
+def run():
+    logging.disable(logging.WARNING)
+    engine.echo = False
+    SQLModel.metadata.create_all(engine)
+    migrate.main()
+    cleanup()
+
+    period_end = int(time.time()) + 30 * 86400
+    users, subscriptions, expected = build(period_end)
+    connection = engine.raw_connection()
+    try:
+        connection.cursor().copy_expert(
+            """COPY "user" (user_id, email, is_premium, stripe_customer_id, stripe_subscription_id,
+                            subscription_end_date, subscription_status, subscription_cancel_at_period_end)
+               FROM STDIN WITH (FORMAT csv)""",
+            users,
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+    stripe = FakeStripe(subscriptions=subscriptions, rate_limit=RATE_LIMIT)
+    gateway = StripeGateway("sk_test_bench", api_base=stripe.url)
+    print(f"{USERS} users, {len(subscriptions)} active subscriptions, Stripe rate limit {RATE_LIMIT}/s")
+    print(f"expected drift {expected}")
+
+    for name, requests_per_second in (("drifted", RATE_LIMIT * 4), ("reconciled", RATE_LIMIT)):
+        stripe.calls.clear()
+        stripe.rate_limited = 0
+        stats = reconcile_subscriptions(gateway, requests_per_second=requests_per_second)
+        print(
+            f"{name:<10} {format_stats(stats)}\n"
+            f"           Stripe calls {stripe.total_calls()} (rate limited {stripe.rate_limited}),"
+            f" {USERS / stats['seconds']:.0f} users/s"
+        )
+
+    # Linuxでは KiB 単位
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    stripe.close()
+    cleanup()
+
+
+if __name__ == "__main__":
+    run()
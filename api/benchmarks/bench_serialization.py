@@ -0,0 +1,174 @@
+# api/benchmarks/bench_serialization.py
+# レスポンスのシリアライズにかかる時間と、それがリクエスト全体のレイテンシに占める割合を計測する
+# - 大きなレイアウト: response_model での検証 + 標準のjson（以前の GET /api/layout）と、辞書を orjson で直接エンコードする場合
+#   POST /api/layout の受け取りも、ORMのモデル（LayoutItem）と軽量なモデル（LayoutItemData）で比べる
+# - 銘柄カタログ全体: List[Symbol] での検証 + json、json.dumps（以前のスナップショット）、orjson
+# 最後に GET /api/layout をアプリ経由（ASGI、DBあり）で呼び、シリアライズの割合を出す
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_ser_ で始まるユーザーを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_serialization.py
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+from typing import Dict, List
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from stand_ins import FakeClerkIssuer
+
+issuer = FakeClerkIssuer()
+os.environ["CLERK_JWT_ISSUER"] = issuer.url
+os.environ["DATABASE_ECHO"] = "false"
+
+import httpx
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import delete, select
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import main
+from database import async_engine
+from models import LayoutItem, Symbol, User, UserLayout
+
+BREAKPOINTS = ("lg", "md", "sm", "xs", "xxs")
+CHARTS = (60, 200)
+SYMBOLS = 50_000
+ROUNDS = 50
+
+
+def make_layout(charts: int):
+    return {
+        breakpoint: [
+            {"i": f"chart_{n}", "x": (n * 4) % 12, "y": n // 3 * 4, "w": 4, "h": 4,
+             "symbol": f"TRADU:{1000 + n}", "label": f"銘柄 {n}"}
+            for n in range(charts)
+        ]
+        for breakpoint in BREAKPOINTS
+    }
+
+
+def stdlib_json(content) -> bytes:
+    # starlette の JSONResponse.render と同じ
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def timeit(function, rounds: int = ROUNDS) -> float:
+    function()
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def report(name: str, seconds: float, size: int = 0) -> None:
+    print(f"  {name:<42} {seconds * 1000:9.3f} ms" + (f"  ({size / 1024:.0f} KiB)" if size else ""))
+
+
+def bench_layout_encoding(charts: int):
+    layouts = make_layout(charts)
+    response_model = TypeAdapter(Dict[str, List[main.LayoutItemData]])
+    print(f"layout {charts} charts x {len(BREAKPOINTS)} breakpoints")
+    timings = {
+        "response_model + json (before)": timeit(
+            lambda: stdlib_json(response_model.dump_python(response_model.validate_python(layouts), mode="json"))
+        ),
+        "orjson direct (after)": timeit(lambda: orjson.dumps(layouts)),
+    }
+    size = len(orjson.dumps(layouts))
+    for name, seconds in timings.items():
+        report(name, seconds, size)
+
+    body = orjson.dumps(layouts)
+    orm_body = TypeAdapter(Dict[str, List[LayoutItem]])
+    report("POST body as LayoutItem (before)", timeit(lambda: {
+        breakpoint: [item.model_dump(include={"i", "x", "y", "w", "h", "symbol", "label"}) for item in items]
+        for breakpoint, items in orm_body.validate_json(body).items()
+    }))
+    report("POST body as LayoutItemData (after)", timeit(lambda: {
+        breakpoint: [item.model_dump() for item in items]
+        for breakpoint, items in response_model.validate_json(body).items()
+    }))
+    return timings
+
+
+def bench_symbol_encoding():
+    payload = [
+        {"id": n, "label": f"銘柄 {n}", "value": f"TRADU:{10000 + n}", "category": ("japan", "us", "fx", "index")[n % 4]}
+        for n in range(SYMBOLS)
+    ]
+    response_model = TypeAdapter(List[Symbol])
+    print(f"symbol catalog {SYMBOLS} symbols")
+    size = len(orjson.dumps(payload))
+    report("List[Symbol] response_model + json", timeit(
+        lambda: stdlib_json(response_model.dump_python(response_model.validate_python(payload), mode="json")), rounds=5
+    ), size)
+    report("json.dumps snapshot (before)", timeit(lambda: stdlib_json(payload), rounds=10), size)
+    report("orjson snapshot (after)", timeit(lambda: orjson.dumps(payload), rounds=10), size)
+
+
+async def cleanup():
+    async with AsyncSession(async_engine) as session:
+        user_ids = select(User.id).where(User.user_id.like("bench_ser_%"))
+        await session.execute(delete(LayoutItem).where(LayoutItem.user_id.in_(user_ids)))
+        await session.execute(delete(UserLayout).where(UserLayout.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.user_id.like("bench_ser_%")))
+        await session.commit()
+
+
+async def bench_layout_request(charts: int, encoding: dict):
+    """GET /api/layout のレイテンシを計測し、シリアライズの割合を出す"""
+    user_id = f"bench_ser_{charts}"
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        user = User(user_id=user_id, email=f"{user_id}@example.com")
+        session.add(user)
+        await session.commit()
+        await main.layout_store.replace(session, user, make_layout(charts))
+        await session.commit()
+
+    headers = {"Authorization": f"Bearer {issuer.sign(user_id)}"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.get("/api/layout", headers=headers)).raise_for_status()
+        timings = []
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            (await client.get("/api/layout", headers=headers)).raise_for_status()
+            timings.append(time.perf_counter() - started)
+    latency = statistics.median(timings)
+    before, after = encoding["response_model + json (before)"], encoding["orjson direct (after)"]
+    # 以前のレイテンシは、今のレイテンシのシリアライズ分を以前のシリアライズ時間に置き換えて見積もる
+    estimated_before = latency - after + before
+    print(
+        f"  GET /api/layout {latency * 1000:.2f} ms, serialization {after / latency:.1%}"
+        f"  (before: ~{estimated_before * 1000:.2f} ms, serialization {before / estimated_before:.1%})"
+    )
+
+
+async def run():
+    logging.disable(logging.WARNING)
+    async_engine.echo = False
+    async with async_engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+    await main.jwks_store.refresh()
+    await cleanup()
+
+    encodings = {charts: bench_layout_encoding(charts) for charts in CHARTS}
+    bench_symbol_encoding()
+    print("end to end (ASGI, DB)")
+    for charts in CHARTS:
+        print(f" {charts} charts")
+        await bench_layout_request(charts, encodings[charts])
+
+    await cleanup()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,105 @@
+# api/benchmarks/bench_shared_cache.py
+# 複数のワーカー（それぞれ独立した SharedCache とバックエンドの接続）が、同時に同じキーのキャッシュミスを起こしたときに
+# 上流（Stripe・Clerkの代わりに、一定時間かかる関数）へ何回問い合わせるかを比べる
+# - memory: ワーカーごとのLRU（ワーカーの数だけ問い合わせる）
+# - redis:  共有キャッシュ + ロックによるスタンピード防止（全ワーカーで1回）
+# あわせて、無効化の通知が全ワーカーに届くまでの時間と、キャッシュヒット時の読み込み時間を計測する
+# Redisの代わりに stand_ins.py の FakeRedis を使う（--redis-url で本物のRedisも指定できる）
+#
+# 実行方法
+# python benchmarks/bench_shared_cache.py [--redis-url redis://localhost:6379/15]
+import argparse
+import asyncio
+import statistics
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from shared_cache import MemoryCacheBackend, RedisCacheBackend, SharedCache
+from stand_ins import FakeRedis
+
+WORKERS = 8
+REQUESTS_PER_WORKER = 25
+UPSTREAM_SECONDS = 0.05
+ROUNDS = 500
+
+
+async def stampede(caches, key: str):
+    upstream_calls = 0
+
+    async def loader():
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(UPSTREAM_SECONDS)
+        return {"keys": ["kid-1", "kid-2"]}
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        cache.get_or_load(key, loader, ttl=60) for cache in caches for _ in range(REQUESTS_PER_WORKER)
+    ))
+    return upstream_calls, time.perf_counter() - started
+
+
+async def broadcast_latency(caches, timeout: float = 1.0):
+    """caches[0] から無効化を通知し、届いたワーカーの数と、最後に届くまでの時間を返す"""
+    received = []
+    done = asyncio.Event()
+    for cache in caches:
+        def listener():
+            received.append(time.perf_counter())
+            if len(received) == len(caches):
+                done.set()
+        cache.on_invalidate("bench", listener)
+    started = time.perf_counter()
+    await caches[0].broadcast("bench")
+    try:
+        await asyncio.wait_for(done.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    return len(received), (max(received) - started if received else 0.0)
+
+
+async def hit_latency(cache):
+    await cache.set("hit", {"status": "subscribed", "cancel_at_period_end": False}, ttl=60)
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        await cache.get("hit")
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+async def run(redis_url: str):
+    backends = {
+        "memory": lambda: MemoryCacheBackend(),
+        "redis": lambda: RedisCacheBackend(redis_url),
+    }
+    print(f"{WORKERS} workers x {REQUESTS_PER_WORKER} concurrent requests, upstream {UPSTREAM_SECONDS * 1000:.0f} ms")
+    for name, make_backend in backends.items():
+        namespace = f"bench-{time.time_ns()}"
+        caches = [SharedCache(make_backend(), namespace=namespace) for _ in range(WORKERS)]
+        for cache in caches:
+            await cache.start()
+
+        upstream_calls, elapsed = await stampede(caches, "jwks")
+        # memory の通知は送信元のワーカーにしか届かない
+        delivered, delivery = await broadcast_latency(caches)
+        hit = await hit_latency(caches[0])
+        print(
+            f"{name:<7} upstream calls {upstream_calls:3d}  cold load {elapsed * 1000:7.1f} ms"
+            f"  broadcast {delivered}/{WORKERS} workers in {delivery * 1000:6.2f} ms  hit {hit * 1_000_000:7.1f} us"
+        )
+        for cache in caches:
+            await cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共有キャッシュのスタンピード防止と無効化通知のベンチマーク")
+    parser.add_argument("--redis-url", help="本物のRedisのURL（省略時は FakeRedis）")
+    args = parser.parse_args()
+    redis_url = args.redis_url or FakeRedis().url
+    asyncio.run(run(redis_url))
+
+
+if __name__ == "__main__":
+    main()
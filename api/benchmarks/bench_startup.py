@@ -0,0 +1,126 @@
+# api/benchmarks/bench_startup.py
+# APIサーバーの起動の速さを計測する
+# - main.py の読み込み時間と、main.py が直接読み込むモジュールごとの読み込み時間（python -X importtime）
+#   stripe / svix などの重いSDKが起動時に読み込まれていないかも確認する
+# - uvicorn のプロセスを起動してから /readyz が200を返すまでの時間（time-to-first-ready）と、
+#   準備ができた直後の最初のリクエストのレイテンシ（ウォームアップが効いていれば、2回目以降と変わらない）
+# 外部サービスはローカルの代用（stand_ins.py）を使う
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（テーブルと銘柄カタログは作成済みであること）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_startup.py [--rounds 3]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+import httpx
+
+from load_test import free_port
+from stand_ins import FakeClerkIssuer, FakeStripe
+
+# 起動時に読み込まれていないはずのモジュール（最初に使うときに読み込む）
+LAZY_MODULES = ["stripe", "svix", "pyinstrument", "redis", "reconcile_subscriptions"]
+FIRST_REQUESTS = ["/api/symbols", "/api/symbols/search?q=a", "/api/prices"]
+# /readyz が200を返すまで待つ時間の上限（秒）。DBやJWKSに届かない場合に待ち続けないようにする
+STARTUP_TIMEOUT = 60
+
+
+def measure_imports(env: dict) -> None:
+    """python -X importtime の出力から、main が直接読み込むモジュールの累積時間を出す"""
+    code = (
+        "import sys, main; "
+        f"print('LOADED', ','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=common.API_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # 字下げの深さで、main が直接読み込んだモジュール（深さ1）を見分ける
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == "main":
+            total = int(cumulative) / 1000
+        elif depth == 1:
+            modules.append((int(cumulative) / 1000, name.strip()))
+    print(f"import main {total:8.1f} ms")
+    for milliseconds, name in sorted(modules, reverse=True)[:12]:
+        print(f"  {name:<32} {milliseconds:8.1f} ms")
+    loaded = result.stdout.split("LOADED", 1)[1].strip()
+    print(f"  lazy modules loaded at import: {loaded or 'none'}")
+
+
+def measure_startup(env: dict, port: int) -> dict:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=common.API_DIR, env=env,
+    )
+    try:
+        deadline = started + STARTUP_TIMEOUT
+        last_status = "no response"
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=10) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {process.returncode}")
+                try:
+                    response = client.get("/readyz")
+                    if response.status_code == 200:
+                        break
+                    last_status = f"{response.status_code} {response.text[:500]}"
+                except httpx.TransportError as e:
+                    last_status = f"no response ({e!r})"
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"/readyz did not return 200 within {STARTUP_TIMEOUT} s (last: {last_status})")
+                time.sleep(0.01)
+            timings = {"ready": time.perf_counter() - started}
+            for path in FIRST_REQUESTS:
+                for attempt in ("first", "second"):
+                    request_started = time.perf_counter()
+                    client.get(path).raise_for_status()
+                    timings[f"{path} {attempt}"] = time.perf_counter() - request_started
+            return timings
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIサーバーの起動の速さのベンチマーク")
+    parser.add_argument("--rounds", type=int, default=3, help="起動を計測する回数（中央値を出す）")
+    args = parser.parse_args()
+
+    issuer = FakeClerkIssuer()
+    stripe = FakeStripe()
+    env = {
+        **os.environ,
+        "CLERK_JWT_ISSUER": issuer.url,
+        "STRIPE_API_KEY": "sk_test_bench",
+        "STRIPE_API_BASE": stripe.url,
+        "DATABASE_ECHO": "false",
+        "WEBHOOK_WORKERS": "0",
+    }
+
+    measure_imports(env)
+    rounds = [measure_startup(env, free_port()) for _ in range(args.rounds)]
+    print(f"uvicorn start -> /readyz 200 {statistics.median(r['ready'] for r in rounds) * 1000:8.1f} ms (median of {args.rounds})")
+    for path in FIRST_REQUESTS:
+        first = statistics.median(r[f"{path} first"] for r in rounds) * 1000
+        second = statistics.median(r[f"{path} second"] for r in rounds) * 1000
+        print(f"  first {path:<28} {first:8.1f} ms  (second {second:.1f} ms)")
+    issuer.close()
+    stripe.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# api/benchmarks/bench_stripe_chaos.py
+# Stripeの障害（応答の遅延・5xx）を注入し、Stripeを呼ぶエンドポイントのレイテンシが時間の上限内に収まるかを確かめる
+# Stripeの代用（FakeStripe）の遅延とエラーの割合を、次の段階ごとに切り替える
+# - healthy:   通常（遅延 20 ms）
+# - slow:      応答が時間の上限より遅い（遅延 5 s）
+# - failing:   すべて500を返す
+# - recovered: 通常に戻す（サーキットブレーカーが試しの呼び出しで閉じる）
+# 段階ごとに、決済系のエンドポイント（PaymentIntentの取得・作成とサブスクリプションの解約予約）に負荷をかけ、
+# ステータスごとの件数・レイテンシ・StripeへのHTTPの呼び出し回数（再試行を含み、遅い応答は応答した段階で数える）を出す。あわせて価格のキャッシュを破棄した直後に
+# /api/prices を同時に呼び、Stripeへの問い合わせが1回にまとまること、障害時も最後に取得した価格を返すことを確かめる
+# 最大レイテンシが上限（更新系の時間の上限 + MARGIN_SECONDS）を超えたら終了コード1で終わる
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（loadtest_ で始まるユーザーを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_stripe_chaos.py [--requests 200] [--concurrency 20]
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from load_test import (
+    Scenarios,
+    cleanup_database,
+    configure_environment,
+    free_port,
+    percentile,
+    run_scenario,
+    setup_database,
+    start_server,
+)
+from stand_ins import FakeClerkIssuer, FakeStripe
+
+READ_TIMEOUT_SECONDS = 1
+WRITE_TIMEOUT_SECONDS = 2
+CIRCUIT_RESET_SECONDS = 2
+# DBの処理やイベントループの混雑の分として、時間の上限に足す余裕
+MARGIN_SECONDS = 1
+PHASES = [
+    ("healthy", 0.02, 0.0),
+    ("slow", 5.0, 0.0),
+    ("failing", 0.0, 1.0),
+    ("recovered", 0.02, 0.0),
+]
+PRICE_BURST = 50
+
+
+class StatusCountingClient:
+    """run_scenario に渡すクライアント。応答のステータスごとの件数を数える"""
+
+    def __init__(self, client):
+        self.client = client
+        self.statuses = Counter()
+
+    async def request(self, method, path, headers=None, content=None):
+        response = await self.client.request(method, path, headers=headers, content=content)
+        self.statuses[response.status_code] += 1
+        return response
+
+
+async def checkout_phase(client, scenarios: Scenarios, args):
+    def make_request(n):
+        if n % 2:
+            return "POST", "/api/cancel-subscription", scenarios.auth(n), None
+        return "POST", "/api/create-payment-intent", {**scenarios.auth(n), "Idempotency-Key": uuid.uuid4().hex}, None
+
+    counting = StatusCountingClient(client)
+    latencies, _, elapsed = await run_scenario(counting, make_request, args.requests, args.concurrency)
+    latencies.sort()
+    return counting.statuses, latencies, elapsed
+
+
+async def price_burst(client):
+    import main
+
+    # 価格のWebhookを受けたときと同じく、共有キャッシュとワーカーのキャッシュを破棄する
+    # （共有キャッシュはプロセス内のバックエンドなので、このイベントループから削除できる）
+    await main.shared_cache.delete(main.PRICE_CACHE_KEY)
+    main.price_catalog.invalidate()
+    statuses = Counter()
+    latencies = []
+
+    async def one():
+        started = time.perf_counter()
+        response = await client.get("/api/prices")
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+
+    await asyncio.gather(*(one() for _ in range(PRICE_BURST)))
+    latencies.sort()
+    return statuses, latencies
+
+
+async def run(base_url: str, scenarios: Scenarios, stripe: FakeStripe, args) -> bool:
+    import httpx
+
+    import main
+
+    bound = WRITE_TIMEOUT_SECONDS + MARGIN_SECONDS
+    ok = True
+    limits = httpx.Limits(max_connections=args.concurrency + PRICE_BURST)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        for name, latency, error_rate in PHASES:
+            stripe.latency_seconds, stripe.error_rate = latency, error_rate
+            if name == "recovered":
+                # サーキットブレーカーが試しの呼び出しを通すまで待つ
+                await asyncio.sleep(CIRCUIT_RESET_SECONDS)
+            calls_before = stripe.total_calls()
+            statuses, latencies, elapsed = await checkout_phase(client, scenarios, args)
+            checkout_calls = stripe.total_calls() - calls_before
+            price_calls_before = stripe.calls["GET ^/v1/prices$"] + stripe.calls["error"]
+            price_statuses, price_latencies = await price_burst(client)
+            price_calls = stripe.calls["GET ^/v1/prices$"] + stripe.calls["error"] - price_calls_before
+
+            worst = max(latencies[-1], price_latencies[-1])
+            ok = ok and worst <= bound
+            print(
+                f"{name:<10} checkout {dict(sorted(statuses.items()))}  p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+                f"  p99 {percentile(latencies, 99) * 1000:7.1f} ms  max {latencies[-1] * 1000:7.1f} ms"
+                f"  {len(latencies) / elapsed:6.1f} req/s  Stripe HTTP calls {checkout_calls}"
+            )
+            print(
+                f"{'':<10} prices   {dict(sorted(price_statuses.items()))}  max {price_latencies[-1] * 1000:7.1f} ms"
+                f"  Stripe HTTP calls {price_calls} for {PRICE_BURST} concurrent requests"
+                f"  circuit {main.stripe_gateway.breaker.state}  {'OK' if worst <= bound else 'NG'}"
+            )
+    print(f"latency bound {bound:.1f} s: {'OK' if ok else 'EXCEEDED'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stripeの障害を注入し、エンドポイントのレイテンシの上限を確かめる")
+    parser.add_argument("--requests", type=int, default=200, help="段階ごとの決済系のリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時に送るリクエスト数")
+    parser.add_argument("--users", type=int, default=50, help="テスト用のユーザー数")
+    args = parser.parse_args()
+
+    issuer = FakeClerkIssuer()
+    stripe = FakeStripe()
+    configure_environment(issuer, stripe.url)
+    os.environ.update({
+        "STRIPE_MAX_NETWORK_RETRIES": "2",
+        "STRIPE_READ_TIMEOUT_SECONDS": str(READ_TIMEOUT_SECONDS),
+        "STRIPE_WRITE_TIMEOUT_SECONDS": str(WRITE_TIMEOUT_SECONDS),
+        "STRIPE_CIRCUIT_RESET_SECONDS": str(CIRCUIT_RESET_SECONDS),
+    })
+    logging.disable(logging.WARNING)
+
+    setup_database(args.users)
+    server, thread = start_server(free_port())
+    scenarios = Scenarios(issuer, args.users, run_id=str(int(time.time())))
+    print(
+        f"{args.requests} checkout requests per phase, concurrency {args.concurrency}, "
+        f"timeouts read {READ_TIMEOUT_SECONDS} s / write {WRITE_TIMEOUT_SECONDS} s"
+    )
+    try:
+        ok = asyncio.run(run(f"http://127.0.0.1:{server.config.port}", scenarios, stripe, args))
+    finally:
+        server.should_exit = True
+        thread.join()
+        cleanup_database()
+        issuer.close()
+        stripe.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
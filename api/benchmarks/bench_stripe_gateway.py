@@ -0,0 +1,95 @@
+# api/benchmarks/bench_stripe_gateway.py
+# Stripeの応答が遅いときに、同期のStripe呼び出し（stripe.Customer.create）を async def の中で行う場合と
+# StripeGateway（非同期HTTPクライアント）を使う場合で、同時リクエストのスループットを比較する
+# Stripeの代わりに、一定の遅延を入れて応答するローカルサーバー（stripe-mock の代用）を立ち上げる
+#
+# 実行方法
+# python benchmarks/bench_stripe_gateway.py
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+import stripe
+
+from stripe_gateway import StripeGateway
+
+LATENCY_SECONDS = 0.1
+CONCURRENCY = 50
+REQUESTS = 200
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(LATENCY_SECONDS)
+        body = json.dumps({"id": "cus_bench", "object": "customer", "email": "bench@example.com"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 同時接続を取りこぼさないよう、listenのバックログを広げる
+    request_queue_size = 256
+
+
+def start_fake_stripe() -> str:
+    server = FakeStripeServer(("127.0.0.1", 0), FakeStripeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+async def measure(name, request):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<8} {REQUESTS / elapsed:8.1f} req/s  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms")
+
+
+async def run():
+    api_base = start_fake_stripe()
+    stripe.api_key = "sk_test_bench"
+    stripe.api_base = api_base
+    stripe.max_network_retries = 0
+    gateway = StripeGateway("sk_test_bench", api_base=api_base, max_network_retries=0)
+
+    async def blocking_request():
+        # 以前の main.py と同じく、async def の中で同期のStripe呼び出しを行う
+        stripe.Customer.create(email="bench@example.com", metadata={"user_id": "bench"})
+
+    async def gateway_request():
+        await gateway.create_customer("bench@example.com", "bench")
+
+    print(f"{REQUESTS} requests, concurrency {CONCURRENCY}, Stripe latency {LATENCY_SECONDS * 1000:.0f} ms")
+    await measure("blocking", blocking_request)
+    await measure("gateway", gateway_request)
+    await gateway.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+# api/benchmarks/bench_symbol_search.py
+# 5万件の合成カタログに対して、銘柄検索インデックスの構築時間と検索レイテンシを計測する
+# どれかの検索のp99が目標（TARGET_P99_US）を超えたら終了コード1で終わる
+#
+# 実行方法
+# python benchmarks/bench_symbol_search.py
+import random
+import statistics
+import string
+import sys
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from symbol_search import SymbolSearchIndex
+
+CATALOG_SIZE = 50_000
+QUERY_ROUNDS = 200
+# 検索1回あたりのp99の目標（入力のたびに検索するため、1ミリ秒を十分下回るようにする）
+TARGET_P99_US = 1000
+
+KANJI = "日本東京大阪三菱住友井物産商事製薬電気工業化学鉄道銀行建設自動車精機通信不動産"
+KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+
+
+def synthetic_catalog(size: int, seed: int = 42):
+    rng = random.Random(seed)
+    symbols = []
+    for n in range(size):
+        kind = n % 10
+        if kind < 6:
+            label = "".join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 5)))
+            label += "".join(rng.choice(KANJI) for _ in range(rng.randint(2, 6)))
+            value, category = f"TSE:{1000 + n % 9000}{'' if n < 9000 else chr(65 + n // 9000)}", "japan"
+        elif kind < 9:
+            ticker = "".join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(2, 5)))
+            label = f"{ticker.title()} {rng.choice(['Inc.', 'Corp.', 'Holdings', 'Group'])}"
+            value, category = f"NASDAQ:{ticker}{n}", "us"
+        else:
+            base, quote = rng.sample(["USD", "JPY", "EUR", "GBP", "AUD", "NZD", "CHF", "CAD"], 2)
+            label, value, category = f"{base}/{quote} {n}", f"FX:{base}{quote}{n}", "fx"
+        symbols.append({"id": n + 1, "label": label, "value": value, "category": category})
+    return symbols
+
+
+def run() -> bool:
+    symbols = synthetic_catalog(CATALOG_SIZE)
+
+    started = time.perf_counter()
+    index = SymbolSearchIndex(symbols)
+    print(f"built index for {len(index)} symbols in {time.perf_counter() - started:.2f}s")
+
+    queries = {
+        "ticker code": ("7203", None),
+        "exchange prefix": ("tse:72", "japan"),
+        "katakana": ("トヨ", None),
+        "hiragana -> katakana": ("とよ", None),
+        "kanji substring": ("三菱", "japan"),
+        "single kanji": ("鉄", None),
+        "us ticker prefix": ("ab", "us"),
+        "multi-term": ("usd jpy", "fx"),
+        "no match": ("zzzzzz", None),
+    }
+    ok = True
+    for name, (query, category) in queries.items():
+        timings = []
+        for _ in range(QUERY_ROUNDS):
+            started = time.perf_counter()
+            total, _ = index.search(query, category=category, limit=50)
+            timings.append(time.perf_counter() - started)
+        median_us = statistics.median(timings) * 1_000_000
+        p99_us = sorted(timings)[int(len(timings) * 0.99) - 1] * 1_000_000
+        ok = ok and p99_us <= TARGET_P99_US
+        print(
+            f"{name:<24} {total:>6} hits  p50 {median_us:>8.1f} us  p99 {p99_us:>8.1f} us"
+            f"  {'OK' if p99_us <= TARGET_P99_US else 'NG'}"
+        )
+    print(f"p99 target {TARGET_P99_US} us: {'OK' if ok else 'EXCEEDED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
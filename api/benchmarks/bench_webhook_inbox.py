@@ -0,0 +1,149 @@
+# api/benchmarks/bench_webhook_inbox.py
+# Stripe Webhookのバースト（数千件）を送り、受信箱への保存（応答までの時間）と
+# ワーカーによる処理のスループットを計測する
+# 処理後、各顧客のサブスクリプション終了日が最後のイベントの値になっていること（発生順に処理されたこと）を確認する
+# 最後に同じイベントをすべて再送し（障害後のStripeの再送を想定）、重複として読み飛ばされることを確認する
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（bench_ で始まるユーザーとイベントを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/bench_webhook_inbox.py
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_bench")
+
+import httpx
+from sqlalchemy import delete, select
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import main
+from database import async_engine
+from models import ProcessedWebhookEvent, User, WebhookEvent
+
+CUSTOMERS = 200
+EVENTS = 5000
+CONCURRENCY = 50
+WORKERS = (1, 4)
+
+
+def sign(payload: bytes, secret: str) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def make_events(round_number: int):
+    base = int(time.time())
+    events = []
+    for n in range(EVENTS):
+        customer = n % CUSTOMERS
+        events.append({
+            "id": f"evt_bench_{round_number}_{n}",
+            "object": "event",
+            "type": "customer.subscription.updated",
+            "created": base + n,
+            "data": {"object": {
+                "id": f"sub_bench_{customer}",
+                "object": "subscription",
+                "customer": f"cus_bench_{customer}",
+                "status": "active",
+                "items": {"data": [{"current_period_end": base + 86400 + n}]},
+            }},
+        })
+    return events
+
+
+async def cleanup():
+    async with AsyncSession(async_engine) as session:
+        await session.execute(delete(WebhookEvent).where(WebhookEvent.event_id.like("evt_bench_%")))
+        await session.execute(
+            delete(ProcessedWebhookEvent).where(ProcessedWebhookEvent.event_id.like("evt_bench_%"))
+        )
+        await session.execute(delete(User).where(User.user_id.like("bench_%")))
+        await session.commit()
+
+
+async def ingest(client: httpx.AsyncClient, events, secret: str, name: str = "ingest"):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def send(event):
+        payload = json.dumps(event).encode()
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/api/stripe-webhooks", content=payload, headers={"Stripe-Signature": sign(payload, secret)}
+            )
+            latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(event) for event in events))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(
+        f"{name:<15} {len(events) / elapsed:8.0f} events/s"
+        f"  p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f} ms"
+    )
+
+
+async def verify(events):
+    expected = {}
+    for event in events:
+        subscription = event["data"]["object"]
+        expected[subscription["customer"]] = subscription["items"]["data"][0]["current_period_end"]
+    async with AsyncSession(async_engine) as session:
+        rows = (await session.execute(
+            select(User.stripe_customer_id, User.subscription_end_date).where(User.user_id.like("bench_%"))
+        )).all()
+    out_of_order = sum(1 for customer_id, end_date in rows if int(end_date.timestamp()) != expected[customer_id])
+    print(f"                out of order: {out_of_order} / {len(rows)} customers")
+
+
+async def run():
+    logging.disable(logging.WARNING)
+    async_engine.echo = False
+    async with async_engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+
+    secret = os.environ["STRIPE_WEBHOOK_SECRET"]
+    transport = httpx.ASGITransport(app=main.app)
+    print(f"{EVENTS} events for {CUSTOMERS} customers, concurrency {CONCURRENCY}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for round_number, workers in enumerate(WORKERS):
+            await cleanup()
+            async with AsyncSession(async_engine) as session:
+                session.add_all([
+                    User(user_id=f"bench_{n}", email=f"bench_{n}@example.com", stripe_customer_id=f"cus_bench_{n}")
+                    for n in range(CUSTOMERS)
+                ])
+                await session.commit()
+
+            events = make_events(round_number)
+            await ingest(client, events, secret)
+
+            main.webhook_workers.concurrency = workers
+            started = time.perf_counter()
+            processed = await main.webhook_workers.drain()
+            elapsed = time.perf_counter() - started
+            print(f"drain {workers} worker(s) {processed / elapsed:8.0f} events/s  ({processed} events, {elapsed:.1f} s)")
+            await verify(events)
+
+            # 再送の嵐：すべて重複として受信箱に入らず、ワーカーの処理も発生しない
+            await ingest(client, events, secret, name="resend")
+            print(f"                reprocessed: {await main.webhook_workers.drain()} events")
+
+    await cleanup()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+# api/benchmarks/common.py
+# ベンチマーク共通のヘルパー（api/ をインポートパスに追加し、テスト用の鍵とトークンを生成する）
+import os
+import sys
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# main.py / database.py のインポートに必要な環境変数（未設定の場合のみ）
+# エンジンの作成時には接続しないため、DBを使わないベンチマークではダミーのURLで構わない
+os.environ.setdefault("DATABASE_URL", "postgresql://postgres@localhost/kabukawa_bench")
+os.environ.setdefault("CLERK_JWT_ISSUER", "https://clerk.bench.local")
+
+
+class SigningKey:
+    """RS256トークンに署名するためのテスト用RSA鍵"""
+
+    def __init__(self, kid: str = "bench-key"):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jose import jwk
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = kid
+        self.private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        # PEMのパースは重いので、署名用の鍵オブジェクトは一度だけ作る
+        self._private_key = jwk.construct(self.private_pem, "RS256")
+        public_jwk = self._private_key.public_key().to_dict()
+        public_jwk.update(kid=kid, use="sig")
+        self.public_jwk = public_jwk
+
+    def jwks(self) -> dict:
+        return {"keys": [self.public_jwk]}
+
+    def sign(self, sub: str, issuer: str, ttl_seconds: int = 300) -> str:
+        from jose import jwt
+
+        now = int(time.time())
+        claims = {"sub": sub, "iss": issuer, "iat": now, "exp": now + ttl_seconds}
+        return jwt.encode(claims, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+
+def report(name: str, seconds: float, iterations: int) -> None:
+    per_call_us = seconds / iterations * 1_000_000
+    print(f"{name:<40} {per_call_us:>10.1f} us/req  ({iterations} iterations)")
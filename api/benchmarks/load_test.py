@@ -0,0 +1,385 @@
+# api/benchmarks/load_test.py
+# APIの主要エンドポイントに負荷をかけ、エンドポイントごとのスループット・レイテンシ（p50/p95/p99）・
+# 1リクエストあたりのDBクエリ数とStripe呼び出し数を計測する
+# APIサーバーは uvicorn で起動し（このプロセスの別スレッド）、実際のHTTPでリクエストを送る
+# 外部サービスはローカルの代用（stand_ins.py）を使う
+# - Clerk: JWKSを配信し、RS256トークンに署名する発行者
+# - Stripe: 固定の応答を返すサーバー（--stripe-api-base で本物の stripe-mock にも向けられる）
+# Webhookは受信箱への保存（応答まで）を計測する（WEBHOOK_WORKERS=0 で、このプロセスでは処理しない）
+#
+# --save-baseline で結果を基準ファイルに保存し、--compare で基準と比べて悪化していれば終了コード1で終わる
+# レイテンシとスループットは --tolerance の割合まで、クエリ数とStripe呼び出し数は増えたら悪化とみなす
+# 負荷をかける側も同じマシンで動くため、基準ファイルは同じマシンで作ったものと比べる
+# DATABASE_URL にベンチマーク用のPostgreSQLを指定して実行する（loadtest_ で始まるユーザーとイベントを作成・削除する）
+#
+# 実行方法
+# DATABASE_URL=postgresql://... python benchmarks/load_test.py --save-baseline
+# DATABASE_URL=postgresql://... python benchmarks/load_test.py --compare
+# DATABASE_URL=postgresql://... python benchmarks/load_test.py --only layout_get,symbols --requests 2000
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import common  # noqa: F401  (api/ をインポートパスに追加する)
+
+from stand_ins import FakeClerkIssuer, FakeStripe
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_test_baseline.json")
+CLERK_WEBHOOK_SECRET = "whsec_bG9hZHRlc3QtY2xlcmstd2ViaG9vay1zZWNyZXQ="
+STRIPE_WEBHOOK_SECRET = "whsec_loadtest"
+
+# 比べる指標と、大きいほど良いか
+METRICS = {"throughput": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+EXACT_METRICS = ["queries_per_request", "stripe_calls_per_request"]
+
+
+def percentile(sorted_values, p: float) -> float:
+    """最近接順位法によるパーセンタイル"""
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class QueryCounter:
+    """エンジンが実行したSQL文の数を数える（APIサーバーのスレッドから呼ばれる）"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class Scenarios:
+    """エンドポイントごとに、n 番目のリクエスト（method, path, headers, body）を作る"""
+
+    def __init__(self, issuer: FakeClerkIssuer, users: int, run_id: str):
+        self.users = users
+        self.run_id = run_id
+        # 同じユーザーは同じトークンを使い回す（実際のクライアントと同じく、検証済みトークンのキャッシュが効く）
+        self.tokens = [issuer.sign(f"loadtest_{n}") for n in range(users)]
+
+    def auth(self, n: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[n % self.users]}"}
+
+    @staticmethod
+    def layout_document(n: int) -> dict:
+        items = [
+            {"i": f"chart-{k}", "x": (k % 3) * 4, "y": (k // 3) * 3, "w": 4, "h": 3,
+             "symbol": f"TRADU:{7200 + k}", "label": f"Chart {k} ({n})"}
+            for k in range(6)
+        ]
+        return {breakpoint: items for breakpoint in ("lg", "md")}
+
+    def layout_get(self, n):
+        return "GET", "/api/layout", self.auth(n), None
+
+    def layout_post(self, n):
+        body = json.dumps(self.layout_document(n)).encode()
+        return "POST", "/api/layout", {**self.auth(n), "Content-Type": "application/json"}, body
+
+    def symbols(self, n):
+        return "GET", "/api/symbols", {"Accept-Encoding": "gzip"}, None
+
+    def user_status(self, n):
+        return "GET", "/api/user-status", self.auth(n), None
+
+    def prices(self, n):
+        return "GET", "/api/prices", {}, None
+
+    def bootstrap(self, n):
+        # ダッシュボードの初回表示（手元にETagがなく、4つのセクションをすべて受け取る）
+        return "GET", "/api/bootstrap", {**self.auth(n), "Accept-Encoding": "gzip"}, None
+
+    def clerk_webhook(self, n):
+        from svix.webhooks import Webhook
+
+        user_id = f"loadtest_{n % self.users}"
+        msg_id = f"msg_loadtest_{self.run_id}_{n}"
+        now = datetime.now(timezone.utc)
+        body = json.dumps({
+            "object": "event",
+            "type": "user.updated",
+            "data": {"id": user_id, "email_addresses": [{"email_address": f"{user_id}@example.com"}]},
+        })
+        signature = Webhook(CLERK_WEBHOOK_SECRET).sign(msg_id, now, body)
+        headers = {
+            "svix-id": msg_id,
+            "svix-timestamp": str(int(now.timestamp())),
+            "svix-signature": signature,
+            "Content-Type": "application/json",
+        }
+        return "POST", "/api/clerk-webhooks", headers, body.encode()
+
+    def stripe_webhook(self, n):
+        customer = n % self.users
+        now = int(time.time())
+        body = json.dumps({
+            "id": f"evt_loadtest_{self.run_id}_{n}",
+            "object": "event",
+            "type": "customer.subscription.updated",
+            "created": now,
+            "data": {"object": {
+                "id": f"sub_loadtest_{customer}",
+                "object": "subscription",
+                "customer": f"cus_loadtest_{customer}",
+                "status": "active",
+                "items": {"data": [{"current_period_end": now + 30 * 86400}]},
+            }},
+        }).encode()
+        signature = hmac.new(STRIPE_WEBHOOK_SECRET.encode(), f"{now}.".encode() + body, hashlib.sha256).hexdigest()
+        headers = {"Stripe-Signature": f"t={now},v1={signature}", "Content-Type": "application/json"}
+        return "POST", "/api/stripe-webhooks", headers, body
+
+
+SCENARIOS = [
+    "layout_get", "layout_post", "symbols", "user_status", "prices", "bootstrap", "clerk_webhook", "stripe_webhook",
+]
+
+
+def configure_environment(issuer: FakeClerkIssuer, stripe_api_base: str) -> None:
+    """main.py のインポート前に、APIサーバーをローカルの代用に向ける"""
+    os.environ.update({
+        "CLERK_JWT_ISSUER": issuer.url,
+        "CLERK_WEBHOOK_SECRET": CLERK_WEBHOOK_SECRET,
+        "STRIPE_API_KEY": "sk_test_loadtest",
+        "STRIPE_API_BASE": stripe_api_base,
+        "STRIPE_WEBHOOK_SECRET": STRIPE_WEBHOOK_SECRET,
+        "STRIPE_MAX_NETWORK_RETRIES": "0",
+        "WEBHOOK_WORKERS": "0",
+        "DATABASE_ECHO": "false",
+    })
+
+
+def setup_database(users: int) -> None:
+    from sqlalchemy import func
+    from sqlmodel import Session, SQLModel, select
+
+    from database import engine
+    from models import Symbol, User
+
+    SQLModel.metadata.create_all(engine)
+    cleanup_database()
+    with Session(engine) as session:
+        # 有効なサブスクリプションを持つユーザー（/api/user-status がStripeを参照する経路）
+        end_date = datetime.now(timezone.utc) + timedelta(days=30)
+        session.add_all([
+            User(
+                user_id=f"loadtest_{n}",
+                email=f"loadtest_{n}@example.com",
+                stripe_customer_id=f"cus_loadtest_{n}",
+                stripe_subscription_id=f"sub_loadtest_{n}",
+                subscription_end_date=end_date,
+            )
+            for n in range(users)
+        ])
+        session.commit()
+        has_symbols = session.exec(select(func.count()).select_from(Symbol)).one() > 0
+    if not has_symbols:
+        import seed
+
+        seed.seed_data()
+
+
+def cleanup_database() -> None:
+    from sqlalchemy import text
+
+    from database import engine
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM webhookevent WHERE event_id LIKE 'evt_loadtest_%' OR event_id LIKE 'msg_loadtest_%'"))
+        conn.execute(text("DELETE FROM processedwebhookevent WHERE event_id LIKE 'evt_loadtest_%' OR event_id LIKE 'msg_loadtest_%'"))
+        users = """SELECT id FROM "user" WHERE user_id LIKE 'loadtest_%'"""
+        conn.execute(text(f"DELETE FROM layoutitem WHERE user_id IN ({users})"))
+        conn.execute(text(f"DELETE FROM userlayout WHERE user_id IN ({users})"))
+        conn.execute(text("""DELETE FROM "user" WHERE user_id LIKE 'loadtest_%'"""))
+
+
+def start_server(port: int):
+    import uvicorn
+
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, name="api-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("API server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+async def run_scenario(client, make_request, requests: int, concurrency: int):
+    """concurrency 個のクライアントが、応答を受け取るたびに次のリクエストを送る（クローズドループ）"""
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            n = next_index
+            next_index += 1
+            method, path, headers, body = make_request(n)
+            started = time.perf_counter()
+            response = await client.request(method, path, headers=headers, content=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run_load_test(base_url, scenarios, names, args, query_counter, stripe):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        # 計測の前に、全ユーザーのレイアウトを保存しておく
+        for n in range(args.users):
+            method, path, headers, body = scenarios.layout_post(n)
+            (await client.request(method, path, headers=headers, content=body)).raise_for_status()
+
+        for name in names:
+            make_request = getattr(scenarios, name)
+            # ウォームアップ（接続の確立、キャッシュの構築など）は計測に含めない
+            await run_scenario(client, lambda n: make_request(args.requests + n), args.warmup, args.concurrency)
+
+            queries_before = query_counter.count
+            stripe_before = stripe.total_calls() if stripe else 0
+            latencies, errors, elapsed = await run_scenario(client, make_request, args.requests, args.concurrency)
+            latencies.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "throughput": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "queries_per_request": round((query_counter.count - queries_before) / len(latencies), 2),
+                "stripe_calls_per_request": (
+                    round((stripe.total_calls() - stripe_before) / len(latencies), 2) if stripe else None
+                ),
+            }
+    return results
+
+
+def print_results(results: dict) -> None:
+    print(f"{'endpoint':<16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'stripe':>7} {'errors':>7}")
+    for name, r in results.items():
+        stripe_calls = "-" if r["stripe_calls_per_request"] is None else f"{r['stripe_calls_per_request']:.2f}"
+        print(
+            f"{name:<16} {r['throughput']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}"
+            f" {r['queries_per_request']:>8.2f} {stripe_calls:>7} {r['errors']:>7}"
+        )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """基準より悪化した指標を返す"""
+    regressions = []
+    for name, current in results.items():
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} requests failed")
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            limit = base[metric] * (1 - tolerance if higher_is_better else 1 + tolerance)
+            if (current[metric] < limit) if higher_is_better else (current[metric] > limit):
+                regressions.append(f"{name}: {metric} {current[metric]} (baseline {base[metric]}, limit {limit:.2f})")
+        for metric in EXACT_METRICS:
+            if current[metric] is not None and base.get(metric) is not None and current[metric] > base[metric]:
+                regressions.append(f"{name}: {metric} {current[metric]} (baseline {base[metric]})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIの主要エンドポイントの負荷試験")
+    parser.add_argument("--requests", type=int, default=1000, help="エンドポイントごとの計測リクエスト数")
+    parser.add_argument("--warmup", type=int, default=50, help="エンドポイントごとのウォームアップのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時に送るリクエスト数")
+    parser.add_argument("--users", type=int, default=200, help="テスト用のユーザー数")
+    parser.add_argument("--only", help=f"計測するエンドポイント（カンマ区切り）: {','.join(SCENARIOS)}")
+    parser.add_argument("--stripe-api-base", help="本物の stripe-mock のURL（例: http://localhost:12111）。省略時は内蔵の代用を使う")
+    parser.add_argument("--stripe-latency-ms", type=float, default=0, help="内蔵のStripeの代用の応答遅延（ミリ秒）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準ファイルのパス")
+    parser.add_argument("--save-baseline", action="store_true", help="結果を基準ファイルに保存する")
+    parser.add_argument("--compare", action="store_true", help="基準ファイルと比べ、悪化していれば終了コード1で終わる")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="レイテンシとスループットの許容する悪化の割合")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else SCENARIOS
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    issuer = FakeClerkIssuer()
+    stripe = None if args.stripe_api_base else FakeStripe(latency_seconds=args.stripe_latency_ms / 1000)
+    configure_environment(issuer, args.stripe_api_base or stripe.url)
+    logging.disable(logging.WARNING)
+
+    from database import async_engine
+
+    setup_database(args.users)
+    query_counter = QueryCounter(async_engine)
+    server, thread = start_server(free_port())
+    base_url = f"http://127.0.0.1:{server.config.port}"
+    scenarios = Scenarios(issuer, args.users, run_id=str(int(time.time())))
+    print(f"{args.requests} requests per endpoint, concurrency {args.concurrency}, {args.users} users")
+    try:
+        results = asyncio.run(run_load_test(base_url, scenarios, names, args, query_counter, stripe))
+    finally:
+        server.should_exit = True
+        thread.join()
+        cleanup_database()
+    print_results(results)
+
+    config = {"requests": args.requests, "concurrency": args.concurrency, "users": args.users}
+    exit_code = 0
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"warning: baseline was recorded with {baseline.get('config')}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print("OK: no regressions against the baseline" if not regressions else f"{len(regressions)} regressions")
+        exit_code = 1 if regressions else 0
+    if args.save_baseline:
+        if args.only and os.path.exists(args.baseline):
+            # 一部のエンドポイントだけ計測した場合は、他のエンドポイントの基準を残す
+            with open(args.baseline, encoding="utf-8") as f:
+                saved = json.load(f)
+            results = {**saved["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# api/benchmarks/stand_ins.py
+# 負荷試験用に外部サービスの代わりをするローカルサーバー
+# - FakeClerkIssuer: JWKSを配信し、同じ鍵でRS256トークンに署名するClerkの発行者
+# - FakeStripe: APIサーバーが呼ぶStripe APIだけに固定の応答を返す stripe-mock の代用（遅延・レート制限・エラーを指定できる）
+# - FakeRedis: 共有キャッシュが使うコマンド（GET / SET / DEL / PUBLISH / SUBSCRIBE）だけを実装したRedisの代用
+import json
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from common import SigningKey
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 同時接続を取りこぼさないよう、listenのバックログを広げる
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # タイムアウトで呼び出し側が先に切断した応答（障害の注入中に起きる）は、エラーとして出力しない
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler) -> StandInServer:
+    server = StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeClerkIssuer:
+    """/.well-known/jwks.json を配信し、その鍵で署名したトークンを発行する"""
+
+    def __init__(self):
+        self.key = SigningKey()
+        jwks = self.key.jwks()
+
+        class Handler(JSONHandler):
+            def do_GET(self):
+                if self.path == "/.well-known/jwks.json":
+                    self.send_json(200, jwks)
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+        self.server = serve(Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def sign(self, sub: str, ttl_seconds: int = 3600) -> str:
+        return self.key.sign(sub, self.url, ttl_seconds=ttl_seconds)
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+PRICES = [
+    {"id": "price_one_time", "object": "price", "lookup_key": "one_time_purchase", "unit_amount": 3000, "currency": "jpy", "active": True},
+    {"id": "price_monthly", "object": "price", "lookup_key": "subscription_monthly", "unit_amount": 500, "currency": "jpy", "active": True},
+]
+
+
+def subscription(subscription_id: str) -> dict:
+    return {
+        "id": subscription_id,
+        "object": "subscription",
+        "status": "active",
+        "cancel_at_period_end": False,
+        "cancel_at": None,
+        "ended_at": None,
+        "items": {"object": "list", "data": [{"current_period_end": int(time.time()) + 30 * 86400}]},
+    }
+
+
+class FakeStripe:
+    """
+    APIサーバーが使うStripe APIに固定の応答を返す（stripe-mock の代用）
+    呼び出し回数をパスごとに数え、1リクエストあたりのStripe呼び出し回数を計測できるようにする
+    """
+
+    ROUTES = [
+        ("GET", re.compile(r"^/v1/prices$"), lambda stand_in, m, query: {"object": "list", "data": PRICES, "has_more": False, "url": "/v1/prices"}),
+        ("GET", re.compile(r"^/v1/subscriptions$"), lambda stand_in, m, query: stand_in.list_subscriptions(query)),
+        ("GET", re.compile(r"^/v1/subscriptions/([^/]+)$"), lambda stand_in, m, query: subscription(m.group(1))),
+        ("POST", re.compile(r"^/v1/subscriptions/([^/]+)$"), lambda stand_in, m, query: subscription(m.group(1))),
+        ("POST", re.compile(r"^/v1/customers$"), lambda stand_in, m, query: {"id": "cus_stand_in", "object": "customer"}),
+        ("GET", re.compile(r"^/v1/payment_intents/([^/]+)$"), lambda stand_in, m, query: {
+            "id": m.group(1), "object": "payment_intent", "status": "requires_payment_method", "client_secret": f"{m.group(1)}_secret",
+        }),
+        ("POST", re.compile(r"^/v1/payment_intents$"), lambda stand_in, m, query: {
+            "id": "pi_stand_in", "object": "payment_intent", "status": "requires_payment_method", "client_secret": "pi_stand_in_secret",
+        }),
+    ]
+
+    def __init__(self, latency_seconds: float = 0.0, subscriptions=None, rate_limit: int = 0, error_rate: float = 0.0):
+        # 遅延とエラーの割合は、動かしている間に変えられる（障害の注入）
+        self.latency_seconds = latency_seconds
+        # 500（api_error）を返す呼び出しの割合
+        self.error_rate = error_rate
+        # GET /v1/subscriptions で返すサブスクリプション（id の順に並べてページ送りする）
+        self.subscriptions = sorted(subscriptions or [], key=lambda subscription: subscription["id"])
+        # 1秒あたりの呼び出し回数の上限（超えた呼び出しには429を返す。0で無制限）
+        self.rate_limit = rate_limit
+        self.rate_limited = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        stand_in = self
+
+        class Handler(JSONHandler):
+            def handle_api(self, method: str):
+                if method == "POST":
+                    self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                url = urlparse(self.path)
+                path, query = url.path, {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if stand_in.over_rate_limit():
+                    self.send_json(429, {"error": {"type": "invalid_request_error", "code": "rate_limit", "message": "Too many requests"}})
+                    return
+                if stand_in.latency_seconds:
+                    time.sleep(stand_in.latency_seconds)
+                if stand_in.error_rate and random.random() < stand_in.error_rate:
+                    stand_in.calls["error"] += 1
+                    self.send_json(500, {"error": {"type": "api_error", "message": "Injected failure"}})
+                    return
+                for route_method, pattern, respond in stand_in.ROUTES:
+                    match = pattern.match(path)
+                    if route_method == method and match:
+                        stand_in.calls[f"{method} {pattern.pattern}"] += 1
+                        self.send_json(200, respond(stand_in, match, query))
+                        return
+                self.send_json(404, {"error": {"type": "invalid_request_error", "message": f"No route: {method} {path}"}})
+
+            def do_GET(self):
+                self.handle_api("GET")
+
+            def do_POST(self):
+                self.handle_api("POST")
+
+        self.server = serve(Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def over_rate_limit(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            second, count = self._window
+            now = int(time.monotonic())
+            count = count + 1 if second == now else 1
+            self._window = (now, count)
+            if count > self.rate_limit:
+                self.rate_limited += 1
+                return True
+            return False
+
+    def list_subscriptions(self, query: dict) -> dict:
+        matched = [s for s in self.subscriptions if query.get("status") in (None, "all", s["status"])]
+        if "starting_after" in query:
+            matched = [s for s in matched if s["id"] > query["starting_after"]]
+        limit = int(query.get("limit", 10))
+        return {"object": "list", "data": matched[:limit], "has_more": len(matched) > limit, "url": "/v1/subscriptions"}
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+class FakeRedis:
+    """
+    RESP2で話す最小限のRedis互換サーバー（共有キャッシュのテスト・ベンチマーク用）
+    GET / SET（EX・PX・NX）/ DEL / PUBLISH / SUBSCRIBE / UNSUBSCRIBE / PING に対応する
+    コマンドごとの実行回数を数える
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.subscribers = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.write_lock = threading.Lock()
+
+            def send(self, data: bytes):
+                with self.write_lock:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+
+            def read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b"*"):
+                    return line.split()
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+            def handle(self):
+                try:
+                    while True:
+                        args = self.read_command()
+                        if args is None:
+                            break
+                        self.send(stand_in.execute(self, args))
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    with stand_in.lock:
+                        for subscribers in stand_in.subscribers.values():
+                            subscribers.discard(self)
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 256
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"redis://127.0.0.1:{self.server.server_address[1]}/0"
+
+    @staticmethod
+    def bulk(value) -> bytes:
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    @staticmethod
+    def array(items) -> bytes:
+        encoded = b"".join(b":%d\r\n" % item if isinstance(item, int) else FakeRedis.bulk(item) for item in items)
+        return b"*%d\r\n" % len(items) + encoded
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, connection, args) -> bytes:
+        command = args[0].decode().upper()
+        self.calls[command] += 1
+        with self.lock:
+            if command == "PING":
+                return b"+PONG\r\n"
+            if command in ("CLIENT", "SELECT"):
+                return b"+OK\r\n"
+            if command == "GET":
+                return self.bulk(self._get(args[1]))
+            if command == "SET":
+                key, value, options = args[1], args[2], [arg.decode().upper() for arg in args[3:]]
+                expires_at = None
+                for name, factor in (("EX", 1), ("PX", 0.001)):
+                    if name in options:
+                        expires_at = time.monotonic() + int(args[3 + options.index(name) + 1]) * factor
+                if "NX" in options and self._get(key) is not None:
+                    return b"$-1\r\n"
+                self.data[key] = (value, expires_at)
+                return b"+OK\r\n"
+            if command == "GETDEL":
+                value = self._get(args[1])
+                self.data.pop(args[1], None)
+                return self.bulk(value)
+            if command == "DEL":
+                deleted = sum(1 for key in args[1:] if self._get(key) is not None and self.data.pop(key, None))
+                return b":%d\r\n" % deleted
+            if command == "PUBLISH":
+                receivers = list(self.subscribers.get(args[1], ()))
+            elif command in ("SUBSCRIBE", "UNSUBSCRIBE"):
+                replies = []
+                for channel in args[1:]:
+                    subscribers = self.subscribers.setdefault(channel, set())
+                    if command == "SUBSCRIBE":
+                        subscribers.add(connection)
+                    else:
+                        subscribers.discard(connection)
+                    count = sum(1 for members in self.subscribers.values() if connection in members)
+                    replies.append(self.array([command.lower().encode(), channel, count]))
+                return b"".join(replies)
+            else:
+                return b"-ERR unknown command '%s'\r\n" % command.encode()
+        # 購読者への送信はロックの外で行う
+        message = self.array([b"message", args[1], args[2]])
+        for receiver in receivers:
+            try:
+                receiver.send(message)
+            except OSError:
+                pass
+        return b":%d\r\n" % len(receivers)
+
+    def close(self) -> None:
+        self.server.shutdown()
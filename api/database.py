@@ -1,7 +1,12 @@
 # api/database.py
 import os
 from dotenv import load_dotenv
-from sqlmodel import create_engine, SQLModel, Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics import InstrumentedAsyncQueuePool, instrument_engine
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -10,10 +15,40 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in the environment variables.")
 
-# データベースエンジンを作成
-engine = create_engine(DATABASE_URL, echo=True)
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "true").lower() == "true"
+
+def to_async_url(url: str):
+    """
+    同期ドライバのURLを asyncpg 用のURLに変換する
+    libpq の sslmode は asyncpg では ssl という名前で渡す
+    """
+    async_url = make_url(url)
+    if async_url.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        async_url = async_url.set(drivername="postgresql+asyncpg")
+        query = dict(async_url.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        async_url = async_url.set(query=query)
+    return async_url
+
+# データベースエンジンを作成（seed.py / create_tables.py などの同期スクリプト用）
+engine = create_engine(DATABASE_URL, echo=DATABASE_ECHO)
+
+# APIサーバー用の非同期エンジン
+async_engine = create_async_engine(
+    to_async_url(DATABASE_URL),
+    echo=DATABASE_ECHO,
+    pool_size=int(os.getenv("DATABASE_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+    # 接続の取り出しの待ち時間をメトリクスに記録する
+    poolclass=InstrumentedAsyncQueuePool,
+)
+# リクエストごとのSQL文の数とプールの状態をメトリクスに記録する
+instrument_engine(async_engine)
 
 # APIエンドポイントでセッションを取得するための依存関係
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    # コミット後も属性を参照できるよう、expire_on_commit は無効にする（非同期では遅延読み込みができないため）
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
         yield session
\ No newline at end of file
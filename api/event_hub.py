@@ -0,0 +1,192 @@
+# api/event_hub.py
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Set
+
+import orjson
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+
+class EventSubscription:
+    """
+    1つの接続（ユーザーの1つのタブ・端末）の購読
+    接続数が多くても軽いよう、未送信のイベントは種類ごとに最新の1件だけを持つ
+    （イベントは「変わった」という知らせなので、まとめても失われる情報はない）
+    """
+
+    __slots__ = ("user_id", "pending", "closed", "_waiter")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.pending: Optional[Dict[str, Any]] = None
+        self.closed = False
+        self._waiter: Optional[asyncio.Future] = None
+
+    def push(self, event_type: str, data: Any) -> None:
+        if self.pending is None:
+            self.pending = {}
+        self.pending[event_type] = data
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """イベントが来るか、閉じられるか、timeout 秒たつまで待ち、未送信のイベントを返す（なければ None）"""
+        if self.pending is None and not self.closed:
+            loop = asyncio.get_running_loop()
+            self._waiter = loop.create_future()
+            timer = loop.call_later(timeout, self._wake)
+            try:
+                await self._waiter
+            finally:
+                timer.cancel()
+                self._waiter = None
+        events, self.pending = self.pending, None
+        return events
+
+
+class EventHub:
+    """
+    ユーザーごとのイベント（レイアウト・プレミアム状態の変更）を、そのユーザーの接続に配るプロセス内のPub/Sub
+    - 配信はバックエンド（shared_cache のバックエンドと同じ publish / subscribe を持つもの）を経由し、
+      Redisなら全ワーカーの接続に、プロセス内のバックエンドならこのワーカーの接続にだけ届く
+    - バックエンドに送れなかった場合は、少なくともこのワーカーの接続には配る
+    """
+
+    def __init__(self, backend, channel: str = "events"):
+        self.backend = backend
+        self.channel = channel
+        self._subscriptions: Dict[str, Set[EventSubscription]] = {}
+        self._connections = 0
+
+    @property
+    def connections(self) -> int:
+        return self._connections
+
+    def subscribe(self, user_id: str) -> EventSubscription:
+        subscription = EventSubscription(user_id)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        self._connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.user_id]
+        self._connections -= 1
+
+    def _dispatch(self, message: str) -> None:
+        try:
+            event = orjson.loads(message)
+        except orjson.JSONDecodeError:
+            logger.warning(f"不正なイベントを受け取りました: {message[:200]}")
+            return
+        for subscription in self._subscriptions.get(event["user"], ()):
+            subscription.push(event["type"], event.get("data"))
+
+    async def publish(self, user_id: str, event_type: str, data: Any = None) -> None:
+        """user_id のすべての接続（全ワーカー）に event_type のイベントを送る"""
+        message = orjson.dumps({"user": user_id, "type": event_type, "data": data}).decode()
+        try:
+            await self.backend.publish(self.channel, message)
+        except Exception as e:
+            logger.warning(f"イベントを配信できませんでした (type: {event_type}): {e}")
+            self._dispatch(message)
+
+    async def start(self) -> None:
+        """他のワーカーからのイベントの購読を始める（APIサーバーの起動時に呼ぶ）"""
+        await self.backend.subscribe(self.channel, self._dispatch)
+
+    def close(self) -> None:
+        """すべての接続を閉じる（停止時に呼ぶ）"""
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+
+
+class EventStreamResponse(Response):
+    """
+    購読したイベントを Server-Sent Events で送り続けるレスポンス
+    待機中の接続を軽くするため、StreamingResponse（接続ごとにタスクグループを作る）を使わず、
+    切断の検知だけを小さなタスクで行う
+    - イベントがない間は heartbeat 秒ごとにコメント行を送り、プロキシに接続を切られないようにする
+    - max_duration 秒（認証したトークンの期限まで）たったら閉じる（クライアントは新しいトークンで接続し直す）
+    - 再接続までの待ち時間（retry）はばらつかせ、再起動後の再接続が一度に集中しないようにする
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        hub: EventHub,
+        user_id: str,
+        heartbeat: float = 25,
+        max_duration: float = 3600,
+        retry_ms: int = 5000,
+    ):
+        # StreamingResponse と同じく本文を持たない（Content-Length をつけない）
+        self.status_code = 200
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.hub = hub
+        self.user_id = user_id
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        self.retry_ms = retry_ms
+
+    @staticmethod
+    def encode(events: Dict[str, Any]) -> bytes:
+        return b"".join(
+            b"event: " + event_type.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+            for event_type, data in events.items()
+        )
+
+    async def _wait_for_disconnect(self, receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def _stream(self, subscription: EventSubscription, send) -> None:
+        deadline = time.monotonic() + self.max_duration
+        while time.monotonic() < deadline:
+            events = await subscription.wait(min(self.heartbeat, max(0.0, deadline - time.monotonic())))
+            if subscription.closed:
+                break
+            body = self.encode(events) if events else b": ping\n\n"
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    async def _finish(self, disconnect: asyncio.Future, send) -> None:
+        if not disconnect.done():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope, receive, send) -> None:
+        subscription = self.hub.subscribe(self.user_id)
+        disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        disconnect.add_done_callback(lambda _: subscription.close())
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": self.raw_headers})
+            retry = random.randint(self.retry_ms, self.retry_ms * 2)
+            await send({"type": "http.response.body", "body": b"retry: %d\n\n" % retry, "more_body": True})
+            try:
+                await self._stream(subscription, send)
+            except asyncio.CancelledError:
+                # サーバーの停止時（--timeout-graceful-shutdown を過ぎたとき）も応答を終えてから、キャンセルを呼び出し元に伝える
+                # （クライアントは retry の時間の後に、別のワーカーへ接続し直す）
+                await self._finish(disconnect, send)
+                raise
+            await self._finish(disconnect, send)
+        finally:
+            self.hub.unsubscribe(subscription)
+            disconnect.cancel()
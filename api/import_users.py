@@ -0,0 +1,218 @@
+# api/import_users.py
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import IO, Iterator, List, Optional, Tuple
+
+from database import engine
+
+# 1バッチで COPY → INSERT ... ON CONFLICT する件数（メモリに載るのはこの件数分だけ）
+DEFAULT_BATCH_SIZE = 10000
+
+CREATE_TEMP_TABLES_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS import_batch (user_id TEXT NOT NULL, email TEXT NOT NULL);
+CREATE TEMP TABLE IF NOT EXISTS import_seen (user_id TEXT PRIMARY KEY);
+"""
+
+# 同じバッチ内で同じユーザーが複数回出てきた場合は、後の行を使う
+UPSERT_SQL = """
+WITH upserted AS (
+    INSERT INTO "user" (user_id, email, is_premium)
+    SELECT DISTINCT ON (user_id) user_id, email, false
+    FROM import_batch
+    ORDER BY user_id, ctid DESC
+    ON CONFLICT (user_id) DO UPDATE SET email = EXCLUDED.email
+    WHERE "user".email IS DISTINCT FROM EXCLUDED.email
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+"""
+
+# エクスポートにないユーザーを削除する
+# エクスポートの作成後にWebhookで作成・更新されたユーザーは、エクスポートに含まれていなくても残す
+FIND_MISSING_SQL = """
+CREATE TEMP TABLE import_missing ON COMMIT DROP AS
+SELECT u.id FROM "user" AS u
+WHERE NOT EXISTS (SELECT 1 FROM import_seen AS s WHERE s.user_id = u.user_id)
+  AND NOT EXISTS (
+      SELECT 1 FROM webhookevent AS w
+      WHERE w.source = 'clerk' AND w.ordering_key = u.user_id AND w.received_at >= %(exported_at)s
+  )
+"""
+
+DELETE_MISSING_SQL = """
+DELETE FROM layoutitem WHERE user_id IN (SELECT id FROM import_missing);
+DELETE FROM userlayout WHERE user_id IN (SELECT id FROM import_missing);
+DELETE FROM "user" WHERE id IN (SELECT id FROM import_missing);
+"""
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """JSON配列のファイルを、全体を読み込まずに要素ごとに返す"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("JSON export must be an array of users")
+    pos = 1
+    eof = False
+    while True:
+        # 要素の間の空白とカンマを読み飛ばす
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = f.read(chunk_size), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of JSON export")
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # 要素が読み込んだ範囲をまたいでいるので、続きを読み込んでからやり直す
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield item
+        pos = end
+
+def iter_users(path: str) -> Iterator[dict]:
+    """ClerkのユーザーのエクスポートをJSON配列またはNDJSON（1行1ユーザー）として読み込む"""
+    with open(path, encoding="utf-8") as f:
+        head = f.read(1024).lstrip()
+        f.seek(0)
+        if head.startswith("["):
+            yield from iter_json_array(f)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def primary_email(user: dict) -> Optional[str]:
+    addresses = user.get("email_addresses") or []
+    primary_id = user.get("primary_email_address_id")
+    for address in addresses:
+        if address.get("id") == primary_id and address.get("email_address"):
+            return address["email_address"]
+    if addresses and addresses[0].get("email_address"):
+        return addresses[0]["email_address"]
+    return user.get("primary_email_address") or user.get("email_address")
+
+def iter_batches(users: Iterator[dict], batch_size: int, skipped: List[int]) -> Iterator[List[Tuple[str, str]]]:
+    batch = []
+    for user in users:
+        user_id = user.get("id")
+        email = primary_email(user)
+        if not user_id or not email:
+            skipped[0] += 1
+            continue
+        batch.append((user_id, email))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def copy_batch(cursor, batch: List[Tuple[str, str]]) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    cursor.execute("TRUNCATE import_batch")
+    cursor.copy_expert("COPY import_batch (user_id, email) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def import_users(
+    path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    delete_missing: bool = False,
+    exported_at: Optional[datetime] = None,
+    dry_run: bool = False,
+) -> dict:
+    stats = {"read": 0, "inserted": 0, "updated": 0, "skipped": 0, "deleted": 0}
+    skipped = [0]
+    started = time.perf_counter()
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(CREATE_TEMP_TABLES_SQL)
+        cursor.execute("TRUNCATE import_seen")
+        connection.commit()
+
+        # バッチごとにコミットする（途中で止まっても、やり直せば続きから同じ結果になる）
+        for batch in iter_batches(iter_users(path), batch_size, skipped):
+            copy_batch(cursor, batch)
+            if delete_missing:
+                cursor.execute("INSERT INTO import_seen SELECT user_id FROM import_batch ON CONFLICT DO NOTHING")
+            if not dry_run:
+                cursor.execute(UPSERT_SQL)
+                inserted, updated = cursor.fetchone()
+                stats["inserted"] += inserted
+                stats["updated"] += updated
+            connection.commit()
+
+            stats["read"] += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"{stats['read']} users ({stats['read'] / elapsed:.0f} rows/s)", flush=True)
+
+        stats["skipped"] = skipped[0]
+        if delete_missing:
+            if stats["read"] == 0:
+                raise ValueError("The export has no users; refusing to delete every user")
+            cursor.execute(FIND_MISSING_SQL, {"exported_at": exported_at or datetime.now(timezone.utc)})
+            cursor.execute("SELECT count(*) FROM import_missing")
+            stats["deleted"] = cursor.fetchone()[0]
+            if not dry_run:
+                cursor.execute(DELETE_MISSING_SQL)
+            connection.commit()
+    finally:
+        connection.close()
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="ClerkのユーザーのエクスポートをUserテーブルに一括で取り込む")
+    parser.add_argument("path", help="エクスポートのファイル（JSON配列 または NDJSON）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1回のCOPYで取り込む件数")
+    parser.add_argument(
+        "--delete-missing",
+        action="store_true",
+        help="エクスポートにないユーザーを削除する（レイアウトも削除される）",
+    )
+    parser.add_argument(
+        "--exported-at",
+        type=lambda value: datetime.fromisoformat(value).astimezone(timezone.utc),
+        help="エクスポートの作成日時（ISO 8601）。これ以降にWebhookを受信したユーザーは削除しない（既定: ファイルの更新日時）",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="件数を数えるだけで変更しない")
+    args = parser.parse_args()
+
+    exported_at = args.exported_at or datetime.fromtimestamp(os.path.getmtime(args.path), tz=timezone.utc)
+    stats = import_users(
+        args.path,
+        batch_size=args.batch_size,
+        delete_missing=args.delete_missing,
+        exported_at=exported_at,
+        dry_run=args.dry_run,
+    )
+    print(
+        f"Done! read {stats['read']}, inserted {stats['inserted']}, updated {stats['updated']}, "
+        f"skipped {stats['skipped']}, deleted {stats['deleted']}"
+        f"{' (dry run)' if args.dry_run else ''} in {stats['seconds']:.1f}s "
+        f"({stats['read'] / max(stats['seconds'], 1e-9):.0f} rows/s)"
+    )
+
+if __name__ == "__main__":
+    main()
+
+# 取り込み方法（create_tables.py の後に実行する）
+# python import_users.py clerk_users.json --delete-missing
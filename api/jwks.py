@@ -0,0 +1,168 @@
+# api/jwks.py
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+
+from metrics import JWKS_FETCHES
+from shared_cache import SharedCache
+
+# ワーカー間で共有するキャッシュのキー
+JWKS_CACHE_KEY = "jwks"
+# 定期更新の間隔と共有キャッシュの有効期間を、それぞれ TTL のこの割合にする
+# （共有キャッシュの期限切れ直前に読んだ鍵を次の更新まで使っても、鍵の変更の反映は最大で TTL 遅れるだけになる）
+REFRESH_FRACTION = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSKeyStore:
+    """
+    ClerkのJWKSを kid ごとにパース済みの公開鍵として保持するストア
+    - TTL の半分ごとにバックグラウンドで再取得する（鍵の変更は遅くとも TTL 以内に反映される）
+    - 未知の kid が来た場合は一度だけ再取得する（間隔はレート制限する）
+    - cache を渡すと取得したJWKSをワーカー間で共有し、Clerkへの取得を全ワーカーで1回にする
+    """
+
+    def __init__(
+        self,
+        jwks_url: str,
+        ttl_seconds: float = 3600,
+        min_refresh_interval: float = 30,
+        http_timeout: float = 5.0,
+        cache: Optional[SharedCache] = None,
+    ):
+        self.jwks_url = jwks_url
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_interval = min_refresh_interval
+        self.http_timeout = http_timeout
+        self.cache = cache
+        self._keys: Dict[str, Key] = {}
+        self._last_attempt_at: float = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._rotation_listeners: List[Callable[[], None]] = []
+
+    @property
+    def kids(self):
+        return set(self._keys)
+
+    def add_rotation_listener(self, listener: Callable[[], None]) -> None:
+        """鍵の集合が変わった（ローテーションされた）ときに呼ばれるコールバックを登録する"""
+        self._rotation_listeners.append(listener)
+
+    async def _fetch(self) -> dict:
+        async with httpx.AsyncClient(timeout=self.http_timeout) as client:
+            response = await client.get(self.jwks_url)
+            response.raise_for_status()
+            return response.json()
+
+    async def _fetch_counted(self) -> dict:
+        try:
+            jwks = await self._fetch()
+        except Exception:
+            JWKS_FETCHES.labels("error").inc()
+            raise
+        JWKS_FETCHES.labels("success").inc()
+        return jwks
+
+    async def _load(self, force: bool) -> dict:
+        if self.cache is None:
+            return await self._fetch_counted()
+        if force:
+            # 未知の kid：共有キャッシュのJWKSも古い可能性があるので捨てる
+            await self.cache.delete(JWKS_CACHE_KEY)
+        return await self.cache.get_or_load(
+            JWKS_CACHE_KEY, self._fetch_counted, ttl=self.ttl_seconds * REFRESH_FRACTION
+        )
+
+    @staticmethod
+    def _parse_keys(jwks: dict) -> Dict[str, Key]:
+        keys: Dict[str, Key] = {}
+        for key_data in jwks.get("keys", []):
+            kid = key_data.get("kid")
+            if not kid or key_data.get("kty") != "RSA":
+                continue
+            if key_data.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[kid] = jwk.construct(key_data, algorithm=key_data.get("alg", "RS256"))
+            except JWKError as e:
+                logger.warning(f"JWKSの鍵をパースできませんでした (kid: {kid}): {e}")
+        return keys
+
+    async def refresh(self, force: bool = False) -> None:
+        """JWKSを取得し、鍵の辞書を丸ごと差し替える（force なら共有キャッシュを使わずに取得し直す）"""
+        async with self._lock:
+            self._last_attempt_at = time.monotonic()
+            jwks = await self._load(force)
+            keys = self._parse_keys(jwks)
+            if not keys:
+                raise ValueError("JWKS contains no usable RSA signing keys")
+            rotated = bool(self._keys) and set(keys) != set(self._keys)
+            # 辞書の差し替えはアトミックなので、読み取り側はロック不要
+            self._keys = keys
+            logger.info(f"JWKSを更新しました (kids: {sorted(keys)})")
+        if rotated:
+            for listener in self._rotation_listeners:
+                listener()
+
+    async def get_key(self, kid: str) -> Optional[Key]:
+        """kid に対応する公開鍵を返す。見つからない場合は一度だけ再取得を試みる"""
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # 未知の kid：鍵のローテーション直後の可能性があるので再取得する
+        if self._lock.locked():
+            # 他のリクエストが取得中なら、その完了を待って結果を使う
+            async with self._lock:
+                pass
+            return self._keys.get(kid)
+
+        # 不正なトークンによる連続取得を防ぐため、再取得の間隔を制限する
+        if time.monotonic() - self._last_attempt_at < self.min_refresh_interval:
+            return None
+        try:
+            # 他のワーカーが新しい鍵を取得済みなら共有キャッシュから読み、なければClerkから取得し直す
+            await self.refresh()
+            if kid not in self._keys and self.cache is not None:
+                await self.refresh(force=True)
+        except Exception as e:
+            logger.error(f"JWKSの再取得に失敗しました: {e}", exc_info=True)
+        return self._keys.get(kid)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl_seconds * REFRESH_FRACTION)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 取得に失敗しても既存の鍵で検証を続ける
+                logger.error(f"JWKSの定期更新に失敗しました: {e}", exc_info=True)
+
+    async def start(self) -> None:
+        """起動時に鍵を取得し、定期更新タスクを開始する"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"起動時のJWKS取得に失敗しました。初回リクエスト時に再試行します: {e}")
+            self._last_attempt_at = 0.0
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
@@ -0,0 +1,287 @@
+# api/layout_store.py
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, not_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import LayoutItem, User, UserLayout
+
+# ブレークポイントごとのアイテムのリスト。アイテムは i, x, y, w, h, symbol, label を持つ辞書
+LayoutDocument = Dict[str, List[dict]]
+LayoutKey = Tuple[str, str]  # (i, breakpoint)
+
+ITEM_FIELDS = ("i", "x", "y", "w", "h", "symbol", "label")
+_UPDATABLE_FIELDS = ("x", "y", "w", "h", "symbol", "label")
+
+# 楽観的ロックが競合したときに、If-Match指定のない書き込みを再試行する回数
+MAX_WRITE_ATTEMPTS = 3
+
+
+class LayoutConflictError(Exception):
+    """If-Match で指定されたレイアウトのバージョンが現在のバージョンと一致しない"""
+
+    def __init__(self, current_version: Optional[int] = None):
+        super().__init__(f"Layout version conflict (current: {current_version})")
+        self.current_version = current_version
+
+
+def layout_etag(user_id: int, version: int) -> str:
+    # 同じブラウザで別のユーザーがログインしても一致しないよう、ユーザーIDを含める
+    return f'"layout-{user_id}-{version}"'
+
+
+def parse_layout_version(if_match: Optional[str]) -> Optional[int]:
+    """If-Match ヘッダー（"layout-1-3" 形式のETagまたは数値）からバージョン番号を取り出す"""
+    if not if_match:
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"').rsplit("-", 1)[-1]
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _item_dict(item) -> dict:
+    return {field: getattr(item, field) for field in ITEM_FIELDS}
+
+
+def group_layout_items(items: Iterable[LayoutItem]) -> LayoutDocument:
+    layouts: LayoutDocument = {}
+    for item in items:
+        layouts.setdefault(item.breakpoint, []).append(_item_dict(item))
+    return layouts
+
+
+def apply_layout_changes(
+    layouts: LayoutDocument, upserts: Dict[LayoutKey, dict], removed: Set[LayoutKey]
+) -> LayoutDocument:
+    """レイアウトに差分を適用した新しいレイアウトを返す（既存アイテムの並び順は保つ）"""
+    result: LayoutDocument = {}
+    pending = dict(upserts)
+    for breakpoint, items in layouts.items():
+        new_items = []
+        for item in items:
+            key = (item["i"], breakpoint)
+            if key in removed:
+                continue
+            new_items.append(pending.pop(key, item))
+        result[breakpoint] = new_items
+    for (i, breakpoint), item in pending.items():
+        result.setdefault(breakpoint, []).append(item)
+    return {breakpoint: items for breakpoint, items in result.items() if items}
+
+
+class RowLayoutStore:
+    """レイアウトをアイテムごとに LayoutItem の行として保存する（既定の保存方式）"""
+
+    name = "rows"
+
+    async def read(self, session: AsyncSession, user: User) -> Tuple[LayoutDocument, int]:
+        items = (await session.execute(
+            select(LayoutItem).where(LayoutItem.user_id == user.id).order_by(LayoutItem.id)
+        )).scalars().all()
+        return group_layout_items(items), user.layout_version
+
+    async def read_version(self, session: AsyncSession, clerk_user_id: str) -> Optional[Tuple[int, int]]:
+        """(ユーザーのid, レイアウトのバージョン) だけを返す（条件付きGET用）"""
+        return (await session.execute(
+            select(User.id, User.layout_version).where(User.user_id == clerk_user_id)
+        )).first()
+
+    async def read_with_user(self, session: AsyncSession, clerk_user_id: str) -> Optional[Tuple[User, LayoutDocument, int]]:
+        """ユーザーとレイアウトを1つのSELECT（LEFT OUTER JOIN）で取得する"""
+        user = (await session.execute(
+            select(User).options(joinedload(User.layouts)).where(User.user_id == clerk_user_id)
+        )).unique().scalars().first()
+        if user is None:
+            return None
+        items = sorted(user.layouts, key=lambda item: item.id)
+        return user, group_layout_items(items), user.layout_version
+
+    async def _bump_version(self, session: AsyncSession, user_id: int, expected_version: Optional[int]) -> int:
+        # ユーザー行の更新で同じユーザーへの書き込みを直列化し、同時にバージョンを比較する
+        stmt = update(User).where(User.id == user_id)
+        if expected_version is not None:
+            stmt = stmt.where(User.layout_version == expected_version)
+        version = (await session.execute(
+            stmt.values(layout_version=User.layout_version + 1).returning(User.layout_version)
+        )).scalar_one_or_none()
+        if version is None:
+            raise LayoutConflictError(
+                (await session.execute(select(User.layout_version).where(User.id == user_id))).scalar_one_or_none()
+            )
+        return version
+
+    async def _upsert(self, session: AsyncSession, user_id: int, upserts: Dict[LayoutKey, dict]) -> None:
+        if not upserts:
+            return
+        insert_stmt = pg_insert(LayoutItem).values(
+            [{**item, "breakpoint": breakpoint, "user_id": user_id} for (_, breakpoint), item in upserts.items()]
+        )
+        await session.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=["user_id", "i", "breakpoint"],
+                set_={column: insert_stmt.excluded[column] for column in _UPDATABLE_FIELDS},
+            )
+        )
+
+    async def apply_changes(
+        self,
+        session: AsyncSession,
+        user: User,
+        upserts: Dict[LayoutKey, dict],
+        removed: Set[LayoutKey],
+        expected_version: Optional[int] = None,
+    ) -> int:
+        version = await self._bump_version(session, user.id, expected_version)
+        # 追加と更新を1つの INSERT ... ON CONFLICT DO UPDATE で、削除を1つの DELETE で行う
+        await self._upsert(session, user.id, upserts)
+        if removed:
+            await session.execute(
+                delete(LayoutItem).where(
+                    LayoutItem.user_id == user.id,
+                    tuple_(LayoutItem.i, LayoutItem.breakpoint).in_(list(removed)),
+                )
+            )
+        return version
+
+    async def replace(
+        self,
+        session: AsyncSession,
+        user: User,
+        layouts: LayoutDocument,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        version = await self._bump_version(session, user.id, expected_version)
+        upserts = {(item["i"], breakpoint): item for breakpoint, items in layouts.items() for item in items}
+        await self._upsert(session, user.id, upserts)
+        # 送られてこなかったアイテムを削除する
+        stmt = delete(LayoutItem).where(LayoutItem.user_id == user.id)
+        if upserts:
+            stmt = stmt.where(not_(tuple_(LayoutItem.i, LayoutItem.breakpoint).in_(list(upserts))))
+        await session.execute(stmt)
+        return version
+
+
+class DocumentLayoutStore:
+    """
+    レイアウトを1ユーザー1行のJSONBドキュメント（UserLayout）として保存する
+    書き込みはバージョン番号による compare-and-swap で行う
+    """
+
+    name = "document"
+
+    async def read(self, session: AsyncSession, user: User) -> Tuple[LayoutDocument, int]:
+        row = (await session.execute(
+            select(UserLayout.document, UserLayout.version).where(UserLayout.user_id == user.id)
+        )).first()
+        if row is not None:
+            return row.document, row.version
+        # まだドキュメントがないユーザー（移行前）は、既存の行から組み立てる
+        return await RowLayoutStore().read(session, user)
+
+    async def read_version(self, session: AsyncSession, clerk_user_id: str) -> Optional[Tuple[int, int]]:
+        """(ユーザーのid, レイアウトのバージョン) だけを返す（条件付きGET用）"""
+        return (await session.execute(
+            select(User.id, func.coalesce(UserLayout.version, User.layout_version))
+            .outerjoin(UserLayout, UserLayout.user_id == User.id)
+            .where(User.user_id == clerk_user_id)
+        )).first()
+
+    async def read_with_user(self, session: AsyncSession, clerk_user_id: str) -> Optional[Tuple[User, LayoutDocument, int]]:
+        """ユーザーとレイアウトのドキュメントを1つのSELECT（LEFT OUTER JOIN）で取得する"""
+        row = (await session.execute(
+            select(User, UserLayout.document, UserLayout.version)
+            .outerjoin(UserLayout, UserLayout.user_id == User.id)
+            .where(User.user_id == clerk_user_id)
+        )).first()
+        if row is None:
+            return None
+        user, document, version = row
+        if document is None:
+            return (user, *await RowLayoutStore().read(session, user))
+        return user, document, version
+
+    async def _compare_and_swap(
+        self, session: AsyncSession, user_id: int, document: LayoutDocument, base_version: int
+    ) -> Optional[int]:
+        now = datetime.now(timezone.utc)
+        version = (await session.execute(
+            update(UserLayout)
+            .where(UserLayout.user_id == user_id, UserLayout.version == base_version)
+            .values(document=document, version=UserLayout.version + 1, updated_at=now)
+            .returning(UserLayout.version)
+        )).scalar_one_or_none()
+        if version is not None:
+            return version
+        # ドキュメントがまだない場合だけ作成する（既にあれば、バージョンが変わったということ）
+        return (await session.execute(
+            pg_insert(UserLayout)
+            .values(user_id=user_id, document=document, version=base_version + 1, updated_at=now)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+            .returning(UserLayout.version)
+        )).scalar_one_or_none()
+
+    async def _read_modify_write(
+        self,
+        session: AsyncSession,
+        user: User,
+        modify: Callable[[LayoutDocument], LayoutDocument],
+        expected_version: Optional[int],
+    ) -> int:
+        version = None
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            layouts, version = await self.read(session, user)
+            if expected_version is not None and version != expected_version:
+                raise LayoutConflictError(version)
+            new_version = await self._compare_and_swap(session, user.id, modify(layouts), version)
+            if new_version is not None:
+                return new_version
+            if expected_version is not None:
+                break
+        raise LayoutConflictError(version)
+
+    async def apply_changes(
+        self,
+        session: AsyncSession,
+        user: User,
+        upserts: Dict[LayoutKey, dict],
+        removed: Set[LayoutKey],
+        expected_version: Optional[int] = None,
+    ) -> int:
+        return await self._read_modify_write(
+            session, user, lambda layouts: apply_layout_changes(layouts, upserts, removed), expected_version
+        )
+
+    async def replace(
+        self,
+        session: AsyncSession,
+        user: User,
+        layouts: LayoutDocument,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        return await self._read_modify_write(session, user, lambda _: layouts, expected_version)
+
+
+async def delete_user_layouts(session: AsyncSession, user_id: int) -> None:
+    """
+    ユーザーのレイアウトを両方の保存形式から削除する（ユーザーを削除する前に呼ぶ）
+    UserLayout.user_id は user.id への外部キーで ON DELETE がないため、先に消さないとユーザーを削除できない
+    LAYOUT_STORAGE を切り替えた後も古い形式の行が残っているため、設定に関わらず両方を消す
+    """
+    await session.execute(delete(LayoutItem).where(LayoutItem.user_id == user_id))
+    await session.execute(delete(UserLayout).where(UserLayout.user_id == user_id))
+
+
+def get_layout_store(name: str):
+    if name == DocumentLayoutStore.name:
+        return DocumentLayoutStore()
+    if name == RowLayoutStore.name:
+        return RowLayoutStore()
+    raise ValueError(f"Unknown LAYOUT_STORAGE: {name}")
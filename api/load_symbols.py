@@ -0,0 +1,159 @@
+# api/load_symbols.py
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from sqlmodel import Session
+
+from database import engine
+from symbol_snapshot import bump_catalog_version
+
+# 銘柄ファイルの1行（label, value）。value は銘柄の一意なキー（例: "TRADU:7203"）
+SymbolRow = Tuple[str, str]
+
+CREATE_TEMP_TABLE_SQL = """
+CREATE TEMP TABLE symbol_load (label TEXT NOT NULL, value TEXT NOT NULL, category TEXT NOT NULL) ON COMMIT DROP
+"""
+
+# 同じ value が複数回出てきた場合は、後の行を使う
+DEDUPLICATE_SQL = """
+CREATE TEMP TABLE symbol_incoming ON COMMIT DROP AS
+SELECT DISTINCT ON (value) label, value, category FROM symbol_load ORDER BY value, ctid DESC;
+CREATE UNIQUE INDEX ON symbol_incoming (value);
+ANALYZE symbol_incoming;
+"""
+
+UPDATE_SQL = """
+UPDATE symbol AS s SET label = i.label, category = i.category
+FROM symbol_incoming AS i
+WHERE s.value = i.value AND (s.label, s.category) IS DISTINCT FROM (i.label, i.category)
+"""
+
+INSERT_SQL = """
+INSERT INTO symbol (label, value, category)
+SELECT i.label, i.value, i.category FROM symbol_incoming AS i
+WHERE NOT EXISTS (SELECT 1 FROM symbol AS s WHERE s.value = i.value)
+"""
+
+# 読み込んだカテゴリの銘柄のうち、ファイルにないものを削除する（読み込んでいないカテゴリには触れない）
+DELETE_SQL = """
+DELETE FROM symbol AS s
+WHERE s.category = ANY(%(categories)s)
+  AND NOT EXISTS (SELECT 1 FROM symbol_incoming AS i WHERE i.value = s.value)
+"""
+
+def read_symbol_file(path: str) -> Iterator[SymbolRow]:
+    """CSV（label,value のヘッダー付き）またはNDJSON（{"label": ..., "value": ...}）の銘柄ファイルを読み込む"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            label, value = (row.get("label") or "").strip(), (row.get("value") or "").strip()
+            if not label or not value:
+                raise ValueError(f"{path}: label and value are required: {row}")
+            yield label, value
+
+def find_symbol_files(sources: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    "カテゴリ=ファイル" の指定またはディレクトリから、カテゴリごとのファイルを集める
+    ディレクトリの場合は、ファイル名（拡張子を除く）をカテゴリとする（例: japan.csv, us.ndjson）
+    """
+    files: Dict[str, List[str]] = {}
+    for source in sources:
+        if "=" in source:
+            category, path = source.split("=", 1)
+            files.setdefault(category, []).append(path)
+        elif os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                category, ext = os.path.splitext(name)
+                if ext in (".csv", ".ndjson", ".jsonl"):
+                    files.setdefault(category, []).append(os.path.join(source, name))
+        else:
+            raise ValueError(f"Specify a directory or category=path: {source}")
+    return files
+
+def sync_symbols(session: Session, symbols: Dict[str, Iterable[SymbolRow]]) -> dict:
+    """
+    カテゴリごとの銘柄リストと Symbol テーブルの差分（value で照合）を一括で反映する
+    変更があればカタログのバージョンを進める。コミットは呼び出し側で行う
+    """
+    started = time.perf_counter()
+    connection = session.connection()
+    # 同時に実行された読み込み同士の書き込みを直列化する（読み取りはブロックしない）
+    connection.exec_driver_sql("LOCK TABLE symbol IN SHARE ROW EXCLUSIVE MODE")
+    connection.exec_driver_sql(CREATE_TEMP_TABLE_SQL)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    read = 0
+    for category, rows in symbols.items():
+        count = 0
+        for label, value in rows:
+            writer.writerow((label, value, category))
+            count += 1
+        if count == 0:
+            # 空のファイルでカテゴリの銘柄がすべて消えないようにする
+            raise ValueError(f"No symbols for category: {category}")
+        read += count
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    cursor.copy_expert("COPY symbol_load (label, value, category) FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.execute(DEDUPLICATE_SQL)
+
+    cursor.execute(UPDATE_SQL)
+    updated = cursor.rowcount
+    cursor.execute(INSERT_SQL)
+    inserted = cursor.rowcount
+    cursor.execute(DELETE_SQL, {"categories": list(symbols)})
+    deleted = cursor.rowcount
+
+    stats = {"read": read, "inserted": inserted, "updated": updated, "deleted": deleted, "version": None}
+    if inserted or updated or deleted:
+        # APIサーバーに銘柄スナップショットの再構築を促す
+        stats["version"] = bump_catalog_version(session)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="銘柄ファイルとSymbolテーブルの差分を一括で反映する")
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="銘柄ファイルのディレクトリ（japan.csv などカテゴリ名のファイルを置く）または category=path",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="差分の件数を表示するだけで反映しない")
+    args = parser.parse_args()
+
+    files = find_symbol_files(args.sources)
+    if not files:
+        raise SystemExit("No symbol files found")
+    symbols = {
+        category: (row for path in paths for row in read_symbol_file(path))
+        for category, paths in files.items()
+    }
+
+    with Session(engine) as session:
+        stats = sync_symbols(session, symbols)
+        if args.dry_run:
+            session.rollback()
+        else:
+            session.commit()
+
+    print(
+        f"Done! read {stats['read']}, inserted {stats['inserted']}, updated {stats['updated']}, "
+        f"deleted {stats['deleted']} in {stats['seconds']:.2f}s"
+        + (" (dry run)" if args.dry_run else f" (catalog version: {stats['version'] or 'unchanged'})")
+    )
+
+if __name__ == "__main__":
+    main()
+
+# 銘柄の読み込み方法（カテゴリごとのファイルを置いたディレクトリを指定する）
+# python load_symbols.py data/symbols
+# python load_symbols.py us=nasdaq_listed.csv
@@ -1,21 +1,53 @@
 # api/main.py
 import os
-import stripe
+import gzip
+import json
+import time
+import asyncio
+import secrets
 import logging
-from fastapi import FastAPI, Depends, HTTPException, Request, Header
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from functools import lru_cache
+from fastapi import FastAPI, Depends, HTTPException, Request, Header, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
-from typing import List, Dict, Optional
+from sqlalchemy import event as sa_event, text as sa_text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import TYPE_CHECKING, Generic, List, Dict, Optional, TypeVar
+import orjson
 from pydantic import BaseModel
-import requests
-from jose import jwt, jwk
+from jose import jwt
 from jose.exceptions import JWTError, ExpiredSignatureError, JWTClaimsError
-from svix.webhooks import Webhook, WebhookVerificationError
-from database import get_session
+from database import async_engine, get_session
+from jwks import JWKSKeyStore
+from token_cache import VerifiedTokenCache
+from price_catalog import CatalogPrice, PriceCatalog, to_catalog_prices
+from shared_cache import SharedCache, create_cache_backend
+from event_hub import EventHub, EventStreamResponse
+from stripe_gateway import CircuitBreaker, StripeGateway, StripeUnavailableError
+from webhook_inbox import NonRetryableEventError, WebhookWorkerPool, enqueue_event, is_duplicate_event
+from symbol_snapshot import SymbolSnapshot, SymbolSnapshotCache
+from http_cache import accepts_gzip, etag_matches, make_etag
+from metrics import MetricsMiddleware, render_metrics
+from request_profiler import ProfilerMiddleware, parse_sample_rates
+from layout_store import (
+    ITEM_FIELDS as LAYOUT_ITEM_FIELDS,
+    LayoutConflictError,
+    delete_user_layouts,
+    get_layout_store,
+    layout_etag,
+    parse_layout_version,
+)
 from datetime import datetime, timezone
 
-from models import LayoutItem, Symbol, User
+from models import User
+
+if TYPE_CHECKING:
+    from svix.webhooks import Webhook
 
 # --- ロガーのセットアップ ---
 logging.basicConfig(level=logging.INFO)
@@ -46,7 +78,78 @@ class PricesResponse(BaseModel):
     one_time: Optional[PriceInfo] = None
     subscription: Optional[PriceInfo] = None
 
-app = FastAPI()
+# レイアウトのアイテム（ブレークポイントごとのリストの要素）
+class LayoutItemData(BaseModel):
+    i: str
+    x: int
+    y: int
+    w: int
+    h: int
+    symbol: str
+    label: str
+
+# レイアウトの差分保存で受け取るアイテム（キーは (i, breakpoint)）
+class LayoutItemChange(BaseModel):
+    i: str
+    breakpoint: str
+    x: int
+    y: int
+    w: int
+    h: int
+    symbol: str
+    label: str
+
+class LayoutItemKey(BaseModel):
+    i: str
+    breakpoint: str
+
+class LayoutPatch(BaseModel):
+    upserts: List[LayoutItemChange] = []
+    removed: List[LayoutItemKey] = []
+
+class LayoutVersionResponse(BaseModel):
+    version: int
+
+class EventStreamTicketResponse(BaseModel):
+    ticket: str
+    expires_in: int
+
+# 銘柄リスト・検索結果の要素（読み取り専用。ORMのモデルを経由せずに辞書をそのまま返す）
+class SymbolData(BaseModel):
+    id: int
+    label: str
+    value: str
+    category: str
+
+class SymbolSearchResponse(BaseModel):
+    total: int
+    items: List[SymbolData]
+
+SectionData = TypeVar("SectionData")
+
+# /api/bootstrap の各セクション（クライアントが同じETagを持っていれば data を省き、not_modified を true にする）
+class BootstrapSection(BaseModel, Generic[SectionData]):
+    etag: Optional[str] = None
+    not_modified: bool = False
+    data: Optional[SectionData] = None
+
+class BootstrapResponse(BaseModel):
+    user_status: BootstrapSection[UserStatus]
+    layout: BootstrapSection[Dict[str, List[LayoutItemData]]]
+    symbols: BootstrapSection[List[SymbolData]]
+    prices: BootstrapSection[PricesResponse]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動・停止の処理（start_app / stop_app）は、使うオブジェクトを定義した後にまとめている
+    await start_app(app)
+    try:
+        yield
+    finally:
+        await stop_app(app)
+
+# 既定のレスポンスは orjson でエンコードする（標準のjsonより高速）
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # 環境変数から許可するオリジンを文字列として取得
 origins_str = os.getenv("ALLOWED_ORIGINS", "")
@@ -63,6 +166,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 遅いリクエストを調べるためのプロファイラ（PROFILER_TOKEN か PROFILER_SAMPLE_RATES を設定したときだけ有効）
+profiler_token = os.getenv("PROFILER_TOKEN") or None
+profiler_sample_rates = parse_sample_rates(os.getenv("PROFILER_SAMPLE_RATES", ""))
+if profiler_token or profiler_sample_rates:
+    app.add_middleware(
+        ProfilerMiddleware,
+        token=profiler_token,
+        sample_rates=profiler_sample_rates,
+        output_dir=os.getenv("PROFILER_OUTPUT_DIR", "profiles"),
+        interval=float(os.getenv("PROFILER_INTERVAL_SECONDS", "0.001")),
+    )
+
+# ルートごとの処理時間・ステータス・SQL文の数を記録する（/metrics で公開する）
+app.add_middleware(MetricsMiddleware)
+
 # Clerkの発行者(Issuer)とJWKSのエンドポイントURLを環境変数から取得
 CLERK_JWT_ISSUER = os.getenv("CLERK_JWT_ISSUER")
 if not CLERK_JWT_ISSUER:
@@ -73,43 +191,264 @@ JWKS_URL = f"{CLERK_JWT_ISSUER}/.well-known/jwks.json"
 
 # OAuth2スキームの定義
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# /api/events 用（EventSource はヘッダーを付けられないため、ヘッダーがなければ接続用のチケットで認証する）
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# ワーカー間で共有するキャッシュ（CACHE_URL 未設定ならプロセス内のLRU）
+# JWKSや価格情報の取得を全ワーカーで1回にまとめ、Webhookで知った変更を全ワーカーに通知する
+shared_cache = SharedCache(
+    create_cache_backend(os.getenv("CACHE_URL")),
+    namespace=os.getenv("CACHE_NAMESPACE", "kabukawa"),
+)
+
+# ユーザーごとの変更（レイアウト・プレミアム状態）を /api/events の接続に配るPub/Sub
+# 共有キャッシュと同じバックエンドを通すため、CACHE_URL を設定すれば他のワーカーで起きた変更も届く
+event_hub = EventHub(shared_cache.backend, channel=f"{shared_cache.namespace}:events")
+
+# JWKSをkidごとに保持するストア（TTLで定期更新、未知のkidで再取得）
+jwks_store = JWKSKeyStore(
+    JWKS_URL,
+    ttl_seconds=float(os.getenv("JWKS_TTL_SECONDS", "3600")),
+    min_refresh_interval=float(os.getenv("JWKS_MIN_REFRESH_INTERVAL_SECONDS", "30")),
+    cache=shared_cache,
+)
+
+# 検証済みトークンのクレームをキャッシュし、同じトークンのRS256検証を省略する
+verified_token_cache = VerifiedTokenCache(
+    maxsize=int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+)
+# 鍵がローテーションされたら、旧鍵で検証したトークンを破棄する
+jwks_store.add_rotation_listener(verified_token_cache.clear)
+
+# Stripe APIの呼び出し口（非同期のHTTPクライアントで、応答待ちの間も他のリクエストを処理する）
+# stripe パッケージは読み込みが重いため、最初にStripeを呼ぶときまで読み込まない
+stripe_gateway = StripeGateway(
+    os.getenv("STRIPE_API_KEY"),
+    api_base=os.getenv("STRIPE_API_BASE") or None,
+    timeout=float(os.getenv("STRIPE_TIMEOUT_SECONDS", "30")),
+    max_network_retries=int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2")),
+    read_timeout=float(os.getenv("STRIPE_READ_TIMEOUT_SECONDS", "5")),
+    write_timeout=float(os.getenv("STRIPE_WRITE_TIMEOUT_SECONDS", "15")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("STRIPE_CIRCUIT_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("STRIPE_CIRCUIT_RESET_SECONDS", "30")),
+    ),
+)
+
+def stripe_unavailable(e: StripeUnavailableError) -> HTTPException:
+    """Stripeの障害時に返す503（しばらくしてから再試行してもらう）"""
+    logger.warning(f"Stripeを呼べませんでした: {e}")
+    return HTTPException(
+        status_code=503,
+        detail="決済サービスに接続できません。しばらくしてから再度お試しください。",
+        headers={"Retry-After": str(int(stripe_gateway.breaker.reset_timeout))},
+    )
+
+# Stripeダッシュボードで管理している価格のlookup_key
+ONE_TIME_LOOKUP_KEY = "one_time_purchase"
+SUBSCRIPTION_LOOKUP_KEY = "subscription_monthly"
+
+PRICE_CATALOG_TTL_SECONDS = float(os.getenv("PRICE_CATALOG_TTL_SECONDS", "300"))
+PRICE_CACHE_KEY = "prices"
+
+def load_price_catalog(lookup_keys: List[str]) -> Dict[str, CatalogPrice]:
+    async def load():
+        prices = to_catalog_prices(await stripe_gateway.list_prices(lookup_keys))
+        return {key: asdict(price) for key, price in prices.items()}
+
+    # 共有キャッシュを経由し、複数のワーカーが同時に再取得してもStripeへの問い合わせは1回にする
+    prices = shared_cache.get_or_load_from_thread(PRICE_CACHE_KEY, load, ttl=PRICE_CATALOG_TTL_SECONDS)
+    return {key: CatalogPrice(**price) for key, price in prices.items()}
+
+# 価格情報のキャッシュ（Stripe側の変更はWebhookで全ワーカーのキャッシュが破棄される）
+price_catalog = PriceCatalog(
+    [ONE_TIME_LOOKUP_KEY, SUBSCRIPTION_LOOKUP_KEY],
+    ttl_seconds=PRICE_CATALOG_TTL_SECONDS,
+    loader=load_price_catalog,
+)
+shared_cache.on_invalidate(PRICE_CACHE_KEY, price_catalog.invalidate)
+
+# ユーザーごとのプレミアム状態のスナップショットのキャッシュ（変更時に破棄するため、TTLは念のための上限）
+USER_STATUS_CACHE_TTL_SECONDS = float(os.getenv("USER_STATUS_CACHE_TTL_SECONDS", "300"))
 
-# JWKSをキャッシュする変数
-jwks_cache = None
+def user_status_cache_key(user_id: str) -> str:
+    return f"user-status:{user_id}"
 
-# Stripe APIキーの設定
-stripe.api_key = os.getenv("STRIPE_API_KEY")
+async def load_entitlement_snapshot(user_id: str) -> Optional[dict]:
+    # 同時のキャッシュミスは1回の読み込みにまとめられるため、リクエストのセッションではなく専用のセッションで読む
+    async with AsyncSession(async_engine) as session:
+        user = (await session.exec(select(User).where(User.user_id == user_id))).first()
+    return entitlement_snapshot(user) if user else None
 
-def get_jwks():
+def entitlement_snapshot(user: User) -> dict:
+    return {
+        "is_premium": user.is_premium,
+        "subscription_end_date": user.subscription_end_date.isoformat() if user.subscription_end_date else None,
+        "cancel_at_period_end": user.subscription_cancel_at_period_end,
+    }
+
+def user_status_from_snapshot(snapshot: dict) -> UserStatus:
+    if snapshot["is_premium"]:
+        return UserStatus(status="lifetime")
+    end_date = snapshot["subscription_end_date"] and datetime.fromisoformat(snapshot["subscription_end_date"])
+    # 期間の終了はキャッシュした後に来ることがあるため、読むたびに判定する
+    if end_date and end_date > datetime.now(timezone.utc):
+        return UserStatus(
+            status="subscribed",
+            subscription_end_date=end_date,
+            cancel_at_period_end=snapshot["cancel_at_period_end"],
+        )
+    return UserStatus(status="none")
+
+async def user_statuses_changed(user_ids: List[str]) -> None:
+    """プレミアム状態のキャッシュを破棄し、接続中のクライアントに変更を知らせる（破棄した後に知らせる）"""
+    await shared_cache.delete(*(user_status_cache_key(user_id) for user_id in user_ids))
+    for user_id in user_ids:
+        await event_hub.publish(user_id, "user-status")
+
+# 実行中のキャッシュの破棄と通知（タスクが途中で回収されないように参照を持っておく）
+pending_invalidations = set()
+
+def invalidate_user_status_after_commit(session: AsyncSession, user_id: str) -> None:
     """
-    ClerkからJWKSを取得し、キャッシュする
+    session のコミット後に、ユーザーのプレミアム状態のキャッシュを破棄し、変更を知らせる
+    コミット前に破棄すると、その間に読み込んだリクエストが古い状態をキャッシュし直してしまう
     """
-    global jwks_cache
-    if jwks_cache is None:
-        response = requests.get(JWKS_URL)
-        response.raise_for_status()
-        jwks_cache = response.json()
-    return jwks_cache
+    def invalidate(_):
+        task = asyncio.get_running_loop().create_task(user_statuses_changed([user_id]))
+        pending_invalidations.add(task)
+        task.add_done_callback(pending_invalidations.discard)
+
+    sa_event.listen(session.sync_session, "after_commit", invalidate, once=True)
+
+# レイアウトの保存方式（rows: アイテムごとの行、document: ユーザーごとのJSONBドキュメント）
+layout_store = get_layout_store(os.getenv("LAYOUT_STORAGE", "rows"))
+
+# 事前にエンコード済みの銘柄リスト（カタログのバージョンが変わると再構築される）
+symbol_snapshot_cache = SymbolSnapshotCache(
+    check_interval=float(os.getenv("SYMBOL_SNAPSHOT_CHECK_SECONDS", "10")),
+)
+
+# Webhookの受信箱からイベントを取り出して処理するワーカー（0でこのプロセスでは処理しない）
+# 処理関数はこのファイルの後半で定義するため、呼び出し時に参照する
+webhook_workers = WebhookWorkerPool(
+    async_engine,
+    handlers={"stripe": lambda session, event: process_stripe_event(session, event),
+              "clerk": lambda session, evt: process_clerk_event(session, evt)},
+    concurrency=int(os.getenv("WEBHOOK_WORKERS", "4")),
+    max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8")),
+    retention_days=float(os.getenv("WEBHOOK_RETENTION_DAYS", "30")),
+)
+
+# Stripeのサブスクリプションとの定期的な照合（0で無効。cron で reconcile_subscriptions.py を実行してもよい）
+# 複数のワーカーで有効にしても、アドバイザリロックにより同時に照合するのは1つだけ
+SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS = float(os.getenv("SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS", "0"))
+
+async def reconcile_subscriptions_periodically():
+    from reconcile_subscriptions import format_stats, reconcile_subscriptions
+
+    loop = asyncio.get_running_loop()
+
+    def invalidate(user_ids: List[str]) -> None:
+        # 照合のスレッドから、直したユーザーのプレミアム状態のキャッシュを破棄し、変更を知らせる
+        asyncio.run_coroutine_threadsafe(user_statuses_changed(user_ids), loop).result()
+
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS)
+        try:
+            stats = await asyncio.to_thread(reconcile_subscriptions, stripe_gateway, on_changed=invalidate)
+            if stats is not None:
+                logger.info(f"Stripeのサブスクリプションと照合しました: {format_stats(stats)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stripeのサブスクリプションとの照合に失敗しました: {e}", exc_info=True)
+
+# 起動時のウォームアップ（最初のリクエストが接続・鍵・価格・銘柄リストの取得を待たないようにする）
+# 価格が共有キャッシュにあれば（他のワーカーが取得済みなら）、stripe パッケージも読み込まない
+# 待つのは STARTUP_WARMUP_TIMEOUT_SECONDS まで。終わらなかったものは裏で続け、/readyz で状態を確認できる
+STARTUP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("STARTUP_WARMUP_TIMEOUT_SECONDS", "10"))
+# 起動時に開いておくDBの接続数（プールの常時保持数を超えない）
+DATABASE_WARM_CONNECTIONS = min(int(os.getenv("DATABASE_WARM_CONNECTIONS", "2")), async_engine.pool.size())
+
+async def warm_database_pool():
+    async def connect():
+        async with async_engine.connect() as connection:
+            await connection.execute(sa_text("SELECT 1"))
+
+    # 同時に接続し、開いた接続をプールに残す
+    await asyncio.gather(*(connect() for _ in range(DATABASE_WARM_CONNECTIONS)))
+
+async def read_symbol_snapshot() -> SymbolSnapshot:
+    # リクエストのセッションと並行して使えるよう、専用のセッションで読む（キャッシュが新しければDBには触れない）
+    async with AsyncSession(async_engine) as session:
+        return await symbol_snapshot_cache.get(session)
+
+async def warm_up() -> None:
+    started = time.perf_counter()
+    warmups = {
+        "database": warm_database_pool(),
+        "jwks": jwks_store.start(),
+        "prices": asyncio.to_thread(price_catalog.get_all),
+        "symbols": read_symbol_snapshot(),
+    }
+    tasks = {asyncio.ensure_future(warmup): name for name, warmup in warmups.items()}
+    done, pending = await asyncio.wait(tasks, timeout=STARTUP_WARMUP_TIMEOUT_SECONDS)
+    for task in done:
+        if task.exception() is not None:
+            # 失敗しても起動は続ける（最初のリクエストで取得し直す）
+            logger.warning(f"起動時のウォームアップに失敗しました ({tasks[task]}): {task.exception()}")
+    if pending:
+        logger.warning(f"起動時のウォームアップが終わっていません: {', '.join(sorted(tasks[task] for task in pending))}")
+    logger.info(f"起動時のウォームアップ: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def start_app(app: FastAPI) -> None:
+    # 他の起動処理が共有キャッシュを使うため、最初に開始する
+    try:
+        await shared_cache.start()
+    except Exception as e:
+        logger.error(f"共有キャッシュの無効化通知を購読できませんでした: {e}", exc_info=True)
+    try:
+        await event_hub.start()
+    except Exception as e:
+        logger.error(f"イベントの配信を購読できませんでした: {e}", exc_info=True)
+    await warm_up()
+    webhook_workers.start()
+    if SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS > 0:
+        app.state.reconcile_task = asyncio.create_task(
+            reconcile_subscriptions_periodically(), name="subscription-reconciler"
+        )
+    app.state.ready = True
+
+async def stop_app(app: FastAPI) -> None:
+    app.state.ready = False
+    event_hub.close()
+    reconcile_task = getattr(app.state, "reconcile_task", None)
+    if reconcile_task is not None:
+        reconcile_task.cancel()
+        await asyncio.gather(reconcile_task, return_exceptions=True)
+    await webhook_workers.stop()
+    await jwks_store.stop()
+    await stripe_gateway.close()
+    await shared_cache.close()
 
 async def get_current_user_payload(token: str = Depends(oauth2_scheme)):
     """
     トークンを検証し、ユーザーペイロードを返す依存関係
     """
+    return await verify_token(token)
+
+async def verify_token(token: str) -> dict:
+    cached_payload = verified_token_cache.get(token)
+    if cached_payload is not None:
+        return cached_payload
+
     try:
-        jwks = get_jwks()
         # トークンのヘッダーからキーID (kid) を取得
         unverified_header = jwt.get_unverified_header(token)
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"],
-                }
-        if not rsa_key:
+        kid = unverified_header.get("kid")
+        rsa_key = await jwks_store.get_key(kid) if kid else None
+        if rsa_key is None:
             raise HTTPException(status_code=401, detail="Unable to find appropriate key")
 
         # トークンをデコードして検証
@@ -120,6 +459,7 @@ async def get_current_user_payload(token: str = Depends(oauth2_scheme)):
             issuer=CLERK_JWT_ISSUER,
             options={"verify_aud": False} # audienceの検証はClerk側で行われるため不要
         )
+        verified_token_cache.put(token, payload)
         return payload
     except ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
@@ -127,32 +467,34 @@ async def get_current_user_payload(token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=401, detail=f"Invalid claims: {e}")
     except JWTError as e:
         raise HTTPException(status_code=401, detail=f"JWT Error: {e}")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 async def get_current_user(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     clerk_user: dict = Depends(get_current_user_payload)
 ) -> User:
     """
     DBから現在のユーザー情報を取得する依存関係
     """
-    user = session.exec(select(User).where(User.user_id == clerk_user["sub"])).first()
+    user = (await session.exec(select(User).where(User.user_id == clerk_user["sub"]))).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found in database")
     return user
 
 async def get_current_user_for_update(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     clerk_user: dict = Depends(get_current_user_payload)
 ) -> User:
     """
     DBから現在のユーザー情報を取得し、行をロックする依存関係
     """
     # with_for_update() をつけることで、トランザクションが完了するまでこの行をロックする
-    user = session.exec(
+    user = (await session.exec(
         select(User).where(User.user_id == clerk_user["sub"]).with_for_update()
-    ).first()
+    )).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found in database")
     return user
@@ -161,115 +503,228 @@ async def get_current_user_for_update(
 def read_root():
     return {"message": "Welcome to Kabukawa-View API"}
 
+# Prometheus形式のメトリクスを返すエンドポイント
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# 準備ができたかを返すエンドポイント（ロードバランサー・オーケストレーターの振り分けの判定用）
+# 起動処理が終わり、DBに接続でき、JWKSの鍵を持っていれば200、そうでなければ503を返す
+# 価格・銘柄リスト・Stripeのサーキットブレーカーは状態を返すだけにする（Stripeの障害などでワーカーを振り分けから外さないため）
+READINESS_DB_TIMEOUT_SECONDS = float(os.getenv("READINESS_DB_TIMEOUT_SECONDS", "2"))
+
+async def ping_database() -> bool:
+    async def ping():
+        async with async_engine.connect() as connection:
+            await connection.execute(sa_text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(ping(), timeout=READINESS_DB_TIMEOUT_SECONDS)
+        return True
+    except Exception as e:
+        logger.warning(f"準備の確認でDBに接続できませんでした: {e}")
+        return False
+
+@app.get("/readyz", include_in_schema=False)
+async def get_readiness():
+    checks = {
+        "started": getattr(app.state, "ready", False),
+        "database": await ping_database(),
+        "jwks": bool(jwks_store.kids),
+    }
+    ready = all(checks.values())
+    checks["prices"] = price_catalog.loaded
+    checks["symbols"] = symbol_snapshot_cache.loaded
+    checks["stripe"] = stripe_gateway.breaker.state == "closed"
+    return ORJSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
 # 現在のユーザーのプレミアム状態を返すエンドポイント
+# フロントエンドが画面ごとにポーリングするため、Stripeは呼ばずにWebhookで更新したスナップショットを返す
+# スナップショットはユーザーごとに共有キャッシュに置き、変更時（Webhook・解約予約）に破棄する
 @app.get("/api/user-status", response_model=UserStatus)
-def get_user_status(current_user: User = Depends(get_current_user)):
-    if current_user.is_premium:
-        return UserStatus(status="lifetime")
-    elif current_user.subscription_end_date and current_user.subscription_end_date > datetime.now(timezone.utc):
-        # サブスクリプションが有効な場合
-        cancel_at_period_end = False
-        if current_user.stripe_subscription_id:
-            try:
-                # Stripeから最新のサブスクリプション情報を取得
-                subscription = stripe.Subscription.retrieve(current_user.stripe_subscription_id)
-                logger.info(f"サブスク状態: {subscription.status}, cancel_at_period_end={subscription.cancel_at_period_end}, cancel_at={subscription.cancel_at}, ended_at={subscription.ended_at}")
-                cancel_at_period_end = subscription.cancel_at_period_end
-            except stripe.error.StripeError as e:
-                # Stripe APIエラーが発生しても、とりあえず処理は続行
-                logger.error(f"Stripe サブスクリプション情報の取得に失敗しました: {e}", exc_info=True)
-
-        return UserStatus(
-            status="subscribed",
-            subscription_end_date=current_user.subscription_end_date,
-            cancel_at_period_end=cancel_at_period_end
-        )
-    else:
-        return UserStatus(status="none")
+async def get_user_status(clerk_user: dict = Depends(get_current_user_payload)):
+    user_id = clerk_user["sub"]
+    snapshot = await shared_cache.get_or_load(
+        user_status_cache_key(user_id),
+        lambda: load_entitlement_snapshot(user_id),
+        ttl=USER_STATUS_CACHE_TTL_SECONDS,
+    )
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="User not found in database")
+    return user_status_from_snapshot(snapshot)
 
 # レイアウトを取得するエンドポイント
-@app.get("/api/layout", response_model=Dict[str, List[LayoutItem]])
-def get_layout(
-    current_user: User = Depends(get_current_user)
+@app.get("/api/layout", response_model=Dict[str, List[LayoutItemData]])
+async def get_layout(
+    session: AsyncSession = Depends(get_session),
+    clerk_user: dict = Depends(get_current_user_payload),
+    if_none_match: Optional[str] = Header(None),
 ):
-    layouts: Dict[str, List[LayoutItem]] = {}
-    for item in current_user.layouts:
-        if item.breakpoint not in layouts:
-            layouts[item.breakpoint] = []
-        layouts[item.breakpoint].append(item)
-    return layouts
+    # フォーカスやマウントのたびに再取得されるため、変更がなければバージョンの確認だけで304を返す
+    if if_none_match:
+        current = await layout_store.read_version(session, clerk_user["sub"])
+        if current is None:
+            raise HTTPException(status_code=404, detail="User not found in database")
+        etag = layout_etag(*current)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    # ユーザーとレイアウトを1回のクエリで取得する
+    result = await layout_store.read_with_user(session, clerk_user["sub"])
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found in database")
+    user, layouts, version = result
+    # ストアが返す辞書は response_model と同じ形なので、検証し直さずにそのままエンコードする
+    return ORJSONResponse(
+        layouts, headers={"ETag": layout_etag(user.id, version), "Cache-Control": "private, no-cache"}
+    )
 
 # レイアウトを保存するエンドポイント
 @app.post("/api/layout")
-def save_layout(
-    layouts: Dict[str, List[LayoutItem]],
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+async def save_layout(
+    layouts: Dict[str, List[LayoutItemData]],
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    if_match: Optional[str] = Header(None),
 ):
-    # DBに保存されている既存のアイテムを全て取得し、ユニークID(i)とbreakpointのタプルをキーにする
-    db_items_query = session.exec(select(LayoutItem).where(LayoutItem.user_id == current_user.id)).all()
-    db_items_dict = {(item.i, item.breakpoint): item for item in db_items_query}
-
-    # フロントから来たアイテムのキーをセットで保持
-    incoming_item_keys = set()
-
-    # 1. 更新と追加
-    for breakpoint, layout_items in layouts.items():
-        for incoming_item in layout_items:
-            item_key = (incoming_item.i, breakpoint)
-            incoming_item_keys.add(item_key)
-
-            db_item = db_items_dict.get(item_key)
-
-            if db_item:
-                # --- 既存アイテムの更新 ---
-                db_item.x = incoming_item.x
-                db_item.y = incoming_item.y
-                db_item.w = incoming_item.w
-                db_item.h = incoming_item.h
-                db_item.symbol = incoming_item.symbol
-                db_item.label = incoming_item.label
-                session.add(db_item)
-            else:
-                # --- 新規アイテムの追加 ---
-                # incoming_itemを辞書に変換し、breakpointを追加してから検証する
-                item_data = incoming_item.model_dump()
-                item_data['breakpoint'] = breakpoint
-
-                new_item = LayoutItem.model_validate(item_data)
-                new_item.user_id = current_user.id # userリレーションではなくuser_idを直接設定
-                session.add(new_item)
-
-    # 2. 削除
-    # DBにあり、フロントから来ていないアイテムを削除
-    for key, db_item in db_items_dict.items():
-        if key not in incoming_item_keys:
-            session.delete(db_item)
-
-    session.commit()
-    return {"message": "Layout saved successfully"}
-
-# 銘柄リストを取得するエンドポイント
-@app.get("/api/symbols", response_model=List[Symbol])
-def get_symbols(session: Session = Depends(get_session)):
-    symbols = session.exec(select(Symbol)).all()
-    return symbols
-
-# Clerk Webhook用のエンドポイント
-@app.post("/api/clerk-webhooks")
-async def handle_webhook(request: Request, session: Session = Depends(get_session)):
-    webhook_secret = os.getenv("CLERK_WEBHOOK_SECRET")
-    if not webhook_secret:
-        raise HTTPException(status_code=500, detail="Webhook secret not configured")
+    # フロントから来ていないアイテムは削除し、来たアイテムで置き換える
+    # （ORMのモデルではなく軽量なモデルで受け取り、そのまま辞書にする）
+    document = {
+        breakpoint: [item.model_dump() for item in items]
+        for breakpoint, items in layouts.items()
+    }
+    try:
+        version = await layout_store.replace(
+            session, current_user, document, expected_version=parse_layout_version(if_match)
+        )
+    except LayoutConflictError as e:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail=f"Layout was modified elsewhere (current version: {e.current_version})")
+    await session.commit()
+    # 他の端末・タブに変更を知らせる（保存した本人はバージョンで自分の変更だと分かる）
+    await event_hub.publish(current_user.user_id, "layout", {"version": version})
+    return {"message": "Layout saved successfully", "version": version}
+
+# 変更があったアイテムだけを保存するエンドポイント
+@app.patch("/api/layout", response_model=LayoutVersionResponse)
+async def patch_layout(
+    changes: LayoutPatch,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    if_match: Optional[str] = Header(None),
+):
+    # 同じキーが複数回含まれる場合は後のものを優先する（ON CONFLICTは同じ行を2回更新できないため）
+    upserts = {
+        (item.i, item.breakpoint): item.model_dump(include=set(LAYOUT_ITEM_FIELDS))
+        for item in changes.upserts
+    }
+    removed_keys = {(key.i, key.breakpoint) for key in changes.removed} - upserts.keys()
 
     try:
-        headers = dict(request.headers)
-        wh = Webhook(webhook_secret)
-        payload = await request.body()
-        evt = wh.verify(payload, headers)
-    except WebhookVerificationError as e:
-        raise HTTPException(status_code=400, detail=f"Webhook verification failed: {e}")
+        version = await layout_store.apply_changes(
+            session, current_user, upserts, removed_keys, expected_version=parse_layout_version(if_match)
+        )
+    except LayoutConflictError as e:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail=f"Layout was modified elsewhere (current version: {e.current_version})")
+    await session.commit()
+    await event_hub.publish(current_user.user_id, "layout", {"version": version})
+    return LayoutVersionResponse(version=version)
+
+# レイアウトとプレミアム状態の変更を Server-Sent Events で受け取るエンドポイント
+# イベント: layout（data: {"version": 保存後のバージョン}）、user-status（data: null）
+# クライアントは受け取ったら /api/layout・/api/user-status を取得し直す。接続し直したときも、途中の変更を逃した可能性があるため取得し直す
+# 認証は Authorization ヘッダーのClerkのトークン、または ticket クエリパラメータ（EventSource 用）の接続用チケット
+# チケットは POST /api/events/ticket で発行する。1回だけ使え、EVENT_STREAM_TICKET_SECONDS で期限が切れる
+# （URLはアクセスログに残るため、Clerkのトークンそのものはクエリパラメータで受け付けない）
+# トークンの検証は接続時だけ行うため、接続はトークンの期限（exp）で閉じ、新しいトークン・チケットで接続し直させる
+# 再接続でチケットは使えないため、EventSource の onerror で新しいチケットを取得して接続し直す
+EVENT_STREAM_MAX_CONNECTIONS = int(os.getenv("EVENT_STREAM_MAX_CONNECTIONS", "10000"))
+EVENT_STREAM_HEARTBEAT_SECONDS = float(os.getenv("EVENT_STREAM_HEARTBEAT_SECONDS", "25"))
+EVENT_STREAM_MAX_SECONDS = float(os.getenv("EVENT_STREAM_MAX_SECONDS", "3600"))
+EVENT_STREAM_TICKET_SECONDS = int(os.getenv("EVENT_STREAM_TICKET_SECONDS", "30"))
+
+def event_ticket_cache_key(ticket: str) -> str:
+    return f"event-ticket:{ticket}"
+
+# /api/events の接続用チケットを発行するエンドポイント
+# 別のワーカーに接続しても使えるよう、チケットは共有キャッシュに保存する（CACHE_URL 未設定なら発行したワーカーでだけ使える）
+@app.post("/api/events/ticket", response_model=EventStreamTicketResponse)
+async def create_event_ticket(clerk_user: dict = Depends(get_current_user_payload)):
+    ticket = secrets.token_urlsafe(32)
+    await shared_cache.set(
+        event_ticket_cache_key(ticket),
+        {"sub": clerk_user["sub"], "exp": clerk_user.get("exp")},
+        ttl=EVENT_STREAM_TICKET_SECONDS,
+    )
+    return EventStreamTicketResponse(ticket=ticket, expires_in=EVENT_STREAM_TICKET_SECONDS)
+
+@app.get("/api/events")
+async def get_events(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    ticket: Optional[str] = Query(None),
+):
+    if token:
+        clerk_user = await verify_token(token)
+    elif ticket:
+        clerk_user = await shared_cache.take(event_ticket_cache_key(ticket))
+        if clerk_user is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired ticket")
+    else:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    max_duration = EVENT_STREAM_MAX_SECONDS
+    if clerk_user.get("exp") is not None:
+        max_duration = min(max_duration, clerk_user["exp"] - time.time())
+        if max_duration <= 0:
+            raise HTTPException(status_code=401, detail="Token has expired")
+    # 1つのワーカーが持つ接続数の上限（超えたら他のワーカーに振り分けてもらう）
+    if event_hub.connections >= EVENT_STREAM_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="Too many event streams", headers={"Retry-After": "10"})
+    return EventStreamResponse(
+        event_hub,
+        clerk_user["sub"],
+        heartbeat=EVENT_STREAM_HEARTBEAT_SECONDS,
+        max_duration=max_duration,
+    )
 
+# 銘柄リストを取得するエンドポイント
+@app.get("/api/symbols", response_model=List[SymbolData])
+async def get_symbols(
+    session: AsyncSession = Depends(get_session),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
+    # 事前にシリアライズ・gzip圧縮したスナップショットをそのまま返す
+    snapshot = await symbol_snapshot_cache.get(session)
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(if_none_match, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    if accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=snapshot.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+# 銘柄をサーバー側で検索するエンドポイント
+@app.get("/api/symbols/search", response_model=SymbolSearchResponse)
+async def search_symbols(
+    q: str = Query("", max_length=100),
+    category: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_session),
+):
+    # 銘柄スナップショットと一緒に構築されたインメモリのインデックスで検索する
+    snapshot = await symbol_snapshot_cache.get(session)
+    total, items = snapshot.search_index.search(q, category=category, limit=limit, offset=offset)
+    # インデックスの要素は SymbolData と同じ形の辞書なので、検証し直さずにそのままエンコードする
+    return ORJSONResponse({"total": total, "items": items})
+
+# Clerkのイベントを処理する（受信箱のワーカーから呼ばれ、コミットはワーカーが行う）
+async def process_clerk_event(session: AsyncSession, evt: dict):
     event_type = evt["type"]
     data = evt["data"]
 
@@ -278,53 +733,89 @@ async def handle_webhook(request: Request, session: Session = Depends(get_sessio
 
         # email_addressesリストが存在し、空でないことを確認
         email_addresses = data.get("email_addresses", [])
-        if not email_addresses:
-            raise HTTPException(
-                status_code=400,
-                detail="Email address is required but was not provided by the webhook payload.",
-            )
-
-        email = email_addresses[0].get("email_address")
+        email = email_addresses[0].get("email_address") if email_addresses else None
         if not email:
-            raise HTTPException(
-                status_code=400,
-                detail="Email address is required but was not provided by the webhook payload.",
-            )
+            raise NonRetryableEventError("Email address is required but was not provided by the webhook payload.")
 
-        existing_user = session.exec(select(User).where(User.user_id == user_id)).first()
-        if not existing_user:
-            new_user = User(user_id=user_id, email=email, is_premium=False)
-            session.add(new_user)
-            session.commit()
+        # 既に存在するユーザー（一括取り込み済みなど）はそのままにする
+        await session.execute(
+            pg_insert(User)
+            .values(user_id=user_id, email=email, is_premium=False)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+        )
 
     elif event_type == "user.updated":
         user_id = data["id"]
-        user_to_update = session.exec(select(User).where(User.user_id == user_id)).first()
+        user_to_update = (await session.exec(select(User).where(User.user_id == user_id))).first()
         if user_to_update:
             # email_addressesが存在する場合のみ更新処理を行う
             email_addresses = data.get("email_addresses", [])
             if email_addresses and (email := email_addresses[0].get("email_address")):
                 user_to_update.email = email
                 session.add(user_to_update)
-                session.commit()
 
     elif event_type == "user.deleted":
         user_id = data.get("id")
         if user_id:
-            user_to_delete = session.exec(select(User).where(User.user_id == user_id)).first()
+            user_to_delete = (await session.exec(select(User).where(User.user_id == user_id))).first()
             if user_to_delete:
-                session.delete(user_to_delete)
-                session.commit()
+                await delete_user_layouts(session, user_to_delete.id)
+                await session.delete(user_to_delete)
+                invalidate_user_status_after_commit(session, user_id)
+
+# 署名の検証器はシークレットごとに1つだけ作って使い回す
+# svix パッケージはClerkのWebhookを受けるときまで読み込まない（起動を速くするため）
+@lru_cache(maxsize=4)
+def get_clerk_webhook(webhook_secret: str) -> "Webhook":
+    from svix.webhooks import Webhook
+
+    return Webhook(webhook_secret)
+
+# Clerk Webhook用のエンドポイント
+@app.post("/api/clerk-webhooks")
+async def handle_webhook(request: Request, session: AsyncSession = Depends(get_session)):
+    from svix.webhooks import WebhookVerificationError
+
+    webhook_secret = os.getenv("CLERK_WEBHOOK_SECRET")
+    if not webhook_secret:
+        raise HTTPException(status_code=500, detail="Webhook secret not configured")
+
+    try:
+        headers = dict(request.headers)
+        wh = get_clerk_webhook(webhook_secret)
+        payload = await request.body()
+        evt = wh.verify(payload, headers)
+    except WebhookVerificationError as e:
+        raise HTTPException(status_code=400, detail=f"Webhook verification failed: {e}")
+
+    # 再送されたイベント（処理済み・処理待ち）は保存せずに応答する
+    if await is_duplicate_event(session, "clerk", headers["svix-id"]):
+        return {"status": "success"}
+
+    # 検証済みのイベントを受信箱に保存してすぐに応答し、処理はワーカーに任せる
+    await enqueue_event(
+        session,
+        source="clerk",
+        event_id=headers["svix-id"],
+        event_type=evt["type"],
+        payload=evt,
+        created=datetime.fromtimestamp(int(headers["svix-timestamp"]), tz=timezone.utc),
+        ordering_key=evt.get("data", {}).get("id"),
+    )
+    await session.commit()
+    webhook_workers.notify()
 
     return {"status": "success"}
 
 # 買い切りプラン用のPayment Intentを作成するエンドポイント
 @app.post("/api/create-payment-intent", response_model=PaymentIntentResponse)
 async def create_payment_intent(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user_for_update),
     idempotency_key: str = Header(None, alias="Idempotency-Key"),
 ):
+    import stripe
+
     logger.info(f"create_payment_intent: 処理開始 (user_id: {current_user.user_id})")
     if current_user.is_premium:
         raise HTTPException(status_code=400, detail="すでに買い切りプランに登録済みです。")
@@ -336,10 +827,7 @@ async def create_payment_intent(
         # 顧客IDが存在しない場合は、Stripeで新規に作成する
         customer_id = current_user.stripe_customer_id
         if not customer_id:
-            customer = stripe.Customer.create(
-                email=current_user.email,
-                metadata={"user_id": current_user.user_id},
-            )
+            customer = await stripe_gateway.create_customer(current_user.email, current_user.user_id)
             customer_id = customer.id
             current_user.stripe_customer_id = customer_id
             session.add(current_user)
@@ -349,7 +837,7 @@ async def create_payment_intent(
         if current_user.stripe_payment_intent_id:
             try:
                 # 2. Stripe APIでPaymentIntentの現在の状態を取得
-                existing_pi = stripe.PaymentIntent.retrieve(
+                existing_pi = await stripe_gateway.retrieve_payment_intent(
                     current_user.stripe_payment_intent_id
                 )
                 # 3. まだ支払いが完了していない場合、そのclient_secretを返す
@@ -359,14 +847,13 @@ async def create_payment_intent(
                 # Stripe側でIDが無効な場合は、新規作成処理に進む
                 pass
 
-        # Stripeダッシュボードで価格を変更可能
-        prices = stripe.Price.list(lookup_keys=["one_time_purchase"], expand=["data.product"])
-        if not prices.data:
+        # Stripeダッシュボードで価格を変更可能（Webhookで同期されるキャッシュから取得）
+        price = await price_catalog.get_async(ONE_TIME_LOOKUP_KEY)
+        if not price:
              raise HTTPException(status_code=500, detail="価格情報が見つかりません。")
-        price = prices.data[0]
 
         # 4. 既存の有効なPaymentIntentがない場合、新規に作成
-        payment_intent = stripe.PaymentIntent.create(
+        payment_intent = await stripe_gateway.create_payment_intent(
             customer=customer_id,
             amount=price.unit_amount,
             currency="jpy",
@@ -382,20 +869,23 @@ async def create_payment_intent(
         # 5. 作成したPaymentIntentのIDをDBに保存
         current_user.stripe_payment_intent_id = payment_intent.id
         session.add(current_user)
-        session.commit()
+        await session.commit()
         logger.info(f"PaymentIntentの作成とDB保存に成功しました (pi_id: {payment_intent.id})")
 
         # フロントエンドで支払い処理を行うためのclient_secretを返す
         return PaymentIntentResponse(client_secret=payment_intent.client_secret)
+    except StripeUnavailableError as e:
+        await session.rollback()
+        raise stripe_unavailable(e)
     except Exception as e:
         logger.error(f"create_payment_intentで予期せぬエラー: {e}", exc_info=True)
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 # サブスクリプション作成用のエンドポイント
 @app.post("/api/create-subscription", response_model=PaymentIntentResponse)
 async def create_subscription(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user_for_update),
 ):
     if current_user.is_premium:
@@ -405,23 +895,19 @@ async def create_subscription(
         customer_id = current_user.stripe_customer_id
         # Stripe顧客でなければ、新規に作成
         if not customer_id:
-            customer = stripe.Customer.create(
-                email=current_user.email,
-                metadata={"user_id": current_user.user_id},
-            )
+            customer = await stripe_gateway.create_customer(current_user.email, current_user.user_id)
             customer_id = customer.id
             current_user.stripe_customer_id = customer_id
             session.add(current_user)
-            session.commit()
+            await session.commit()
 
-        # Stripeダッシュボードで価格を変更可能
-        prices = stripe.Price.list(lookup_keys=["subscription_monthly"], expand=["data.product"])
-        if not prices.data:
+        # Stripeダッシュボードで価格を変更可能（Webhookで同期されるキャッシュから取得）
+        price = await price_catalog.get_async(SUBSCRIPTION_LOOKUP_KEY)
+        if not price:
              raise HTTPException(status_code=500, detail="価格情報が見つかりません。")
-        price = prices.data[0]
 
         # サブスクリプションを作成
-        subscription = stripe.Subscription.create(
+        subscription = await stripe_gateway.create_subscription(
             customer=customer_id,
             items=[{"price": price.id}],
             payment_behavior="default_incomplete",
@@ -435,7 +921,7 @@ async def create_subscription(
 
         current_user.stripe_subscription_id = subscription.id
         session.add(current_user)
-        session.commit()
+        await session.commit()
 
         payment_intent = subscription.latest_invoice.confirmation_secret
 
@@ -446,29 +932,40 @@ async def create_subscription(
         return PaymentIntentResponse(
             client_secret=payment_intent.client_secret
         )
+    except StripeUnavailableError as e:
+        await session.rollback()
+        raise stripe_unavailable(e)
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 # サブスクリプションをキャンセルするエンドポイント
 @app.post("/api/cancel-subscription")
 async def cancel_subscription(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user_for_update),
 ):
+    import stripe
+
     if not current_user.stripe_subscription_id:
         raise HTTPException(status_code=400, detail="アクティブなサブスクリプションがありません。")
 
     try:
         # Stripeでサブスクリプションを即時削除するのではなく、
         # cancel_at_period_endフラグを立てて、期間終了時に解約されるようにスケジュールする
-        stripe.Subscription.modify(
+        subscription = await stripe_gateway.modify_subscription(
             current_user.stripe_subscription_id,
             cancel_at_period_end=True,
         )
-        # DBからは何も削除しない（Webhookで期間終了時に同期される）
-        session.commit()
+        # 解約予約をスナップショットにすぐ反映する（期間の終了はWebhookで同期される）
+        current_user.subscription_status = subscription.status
+        current_user.subscription_cancel_at_period_end = subscription.cancel_at_period_end
+        session.add(current_user)
+        invalidate_user_status_after_commit(session, current_user.user_id)
+        await session.commit()
         return {"message": "サブスクリプションの解約を予約しました。"}
+    except StripeUnavailableError as e:
+        raise stripe_unavailable(e)
     except stripe.error.StripeError as e:
         # Stripe APIエラーのハンドリング
         raise HTTPException(status_code=500, detail=f"Stripe APIエラー: {e}")
@@ -480,47 +977,88 @@ async def cancel_subscription(
 @app.get("/api/prices", response_model=PricesResponse)
 def get_prices():
     try:
-        # 複数のlookup_keyを一度に指定して価格を取得
-        prices = stripe.Price.list(
-            lookup_keys=["one_time_purchase", "subscription_monthly"],
-            active=True
-        )
-
-        response = PricesResponse()
-        for price in prices.data:
-            if price.lookup_key == "one_time_purchase":
-                response.one_time = PriceInfo(id=price.id, amount=price.unit_amount)
-            elif price.lookup_key == "subscription_monthly":
-                response.subscription = PriceInfo(id=price.id, amount=price.unit_amount)
-
-        return response
+        return read_prices()
+    except StripeUnavailableError as e:
+        # 一度も価格を取得できていないときだけ（取得済みなら最後に取得した価格を返す）
+        raise stripe_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail="価格情報の取得に失敗しました。")
 
-# Stripe Webhook用のエンドポイント
-@app.post("/api/stripe-webhooks")
-async def stripe_webhook(
-    request: Request,
-    session: Session = Depends(get_session),
-    stripe_signature: str = Header(None),
+def read_prices() -> PricesResponse:
+    # キャッシュ済みの価格を返す（期限切れの場合は裏で再取得する）
+    prices = price_catalog.get_all()
+
+    response = PricesResponse()
+    if one_time := prices.get(ONE_TIME_LOOKUP_KEY):
+        response.one_time = PriceInfo(id=one_time.id, amount=one_time.unit_amount)
+    if subscription := prices.get(SUBSCRIPTION_LOOKUP_KEY):
+        response.subscription = PriceInfo(id=subscription.id, amount=subscription.unit_amount)
+    return response
+
+# /api/bootstrap の応答をgzip圧縮する最小のサイズ（バイト）。銘柄リストを含む初回の応答が対象になる
+BOOTSTRAP_GZIP_MIN_BYTES = 1024
+
+def bootstrap_section(if_none_match: Optional[str], etag: str, data) -> dict:
+    if etag_matches(if_none_match, etag):
+        return {"etag": etag, "not_modified": True, "data": None}
+    return {"etag": etag, "not_modified": False, "data": data}
+
+# ダッシュボードの表示に必要なデータ（プレミアム状態・レイアウト・銘柄リスト・価格）を1回のリクエストで返すエンドポイント
+# トークンの検証は1回、ユーザーとレイアウトは1回のクエリで取得し、銘柄リストと価格はそれと並行して取得する
+# If-None-Match に手元にあるセクションのETag（レイアウトと銘柄リストは /api/layout・/api/symbols のETagと同じ）を
+# カンマ区切りで並べると、一致したセクションは data を省く。すべて一致すれば304を返す
+@app.get("/api/bootstrap", response_model=BootstrapResponse)
+async def get_bootstrap(
+    session: AsyncSession = Depends(get_session),
+    clerk_user: dict = Depends(get_current_user_payload),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
-    webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
-    if not webhook_secret:
-        raise HTTPException(status_code=500, detail="Stripe webhook secret not configured")
-
-    try:
-        payload = await request.body()
-        event = stripe.Webhook.construct_event(
-            payload=payload, sig_header=stripe_signature, secret=webhook_secret
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
-    except stripe.error.SignatureVerificationError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid signature: {e}")
+    layout_result, snapshot, prices = await asyncio.gather(
+        layout_store.read_with_user(session, clerk_user["sub"]),
+        read_symbol_snapshot(),
+        asyncio.to_thread(read_prices),
+        return_exceptions=True,
+    )
+    for result in (layout_result, snapshot):
+        if isinstance(result, BaseException):
+            raise result
+    if layout_result is None:
+        raise HTTPException(status_code=404, detail="User not found in database")
+    user, layouts, version = layout_result
+
+    # プレミアム状態は、キャッシュではなくレイアウトと一緒に読んだユーザーの行から判定する
+    user_status = user_status_from_snapshot(entitlement_snapshot(user)).model_dump(mode="json")
+    sections = {
+        "user_status": bootstrap_section(if_none_match, make_etag(orjson.dumps(user_status)), user_status),
+        "layout": bootstrap_section(if_none_match, layout_etag(user.id, version), layouts),
+        # 事前にエンコード済みの銘柄リストは、デコードせずにそのまま埋め込む
+        "symbols": bootstrap_section(if_none_match, snapshot.etag, orjson.Fragment(snapshot.body)),
+    }
+    if isinstance(prices, BaseException):
+        # 価格が取れなくてもダッシュボードは表示する（クライアントは /api/prices で取得し直す）
+        logger.warning(f"/api/bootstrap で価格情報の取得に失敗しました: {prices}")
+        sections["prices"] = {"etag": None, "not_modified": False, "data": None}
+    else:
+        prices = prices.model_dump(mode="json")
+        sections["prices"] = bootstrap_section(if_none_match, make_etag(orjson.dumps(prices)), prices)
+
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if all(section["not_modified"] for section in sections.values()):
+        return Response(status_code=304, headers=headers)
+    body = orjson.dumps(sections)
+    if accepts_gzip(accept_encoding) and len(body) >= BOOTSTRAP_GZIP_MIN_BYTES:
+        headers["Content-Encoding"] = "gzip"
+        body = gzip.compress(body, compresslevel=6)
+    # 各セクションは response_model と同じ形なので、検証し直さずにそのまま返す
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Stripeのイベントを処理する（受信箱のワーカーから呼ばれ、コミットはワーカーが行う）
+async def process_stripe_event(session: AsyncSession, event: dict):
+    import stripe
 
     event_data = event["data"]["object"]
     event_type = event["type"]
-    logger.info(f"Stripe Webhook受信: {event_type}")
 
     # --- 買い切りプランの支払いが成功したときの処理 ---
     if event_type == "payment_intent.succeeded":
@@ -529,28 +1067,29 @@ async def stripe_webhook(
         if metadata.get("plan_type") == "one_time":
             user_id = metadata.get("user_id")
             if user_id:
-                user = session.exec(
+                user = (await session.exec(
                     select(User).where(User.user_id == user_id).with_for_update()
-                ).first()
+                )).first()
                 if user and not user.is_premium:
                     # 既存のサブスクリプションがある場合、期間終了時にキャンセルされるように予約する
                     if user.stripe_subscription_id:
                         try:
-                            stripe.Subscription.modify(
+                            await stripe_gateway.modify_subscription(
                                 user.stripe_subscription_id,
                                 cancel_at_period_end=True,
                             )
                         except stripe.error.StripeError as e:
-                            # Stripe APIの呼び出しに失敗した場合、
-                            # 500エラーを返してStripeにWebhookの再試行を促す。
-                            # FastAPIの依存関係システムにより、DBへの変更は自動的にロールバックされる。
+                            # Stripe APIの呼び出しに失敗した場合は、例外をそのまま投げてワーカーに再試行させる
+                            # DBへの変更はワーカーがロールバックする
                             logger.error(f"Webhook: 既存サブスクの解約予約に失敗 (sub_id: {user.stripe_subscription_id}): {e}", exc_info=True)
-                            raise HTTPException(status_code=500, detail="サブスクリプション契約の更新に失敗しました。")
+                            raise
 
                     user.is_premium = True
                     user.stripe_payment_intent_id = None
+                    if user.stripe_subscription_id:
+                        user.subscription_cancel_at_period_end = True
                     session.add(user)
-                    session.commit()
+                    invalidate_user_status_after_commit(session, user.user_id)
                     logger.info(f"Webhook: 買い切りプランを有効化しました (user_id: {user.user_id})")
 
     # --- サブスクリプションの状態が変更されたときの処理 ---
@@ -559,24 +1098,34 @@ async def stripe_webhook(
         customer_id = subscription.get("customer")
 
         if not customer_id:
-            return {"status": "success", "detail": "No customer ID in event"}
+            logger.info("Webhook: No customer ID in event")
+            return
 
-        user = session.exec(
+        user = (await session.exec(
             select(User).where(User.stripe_customer_id == customer_id).with_for_update()
-        ).first()
+        )).first()
 
         if not user:
-            return {"status": "success", "detail": f"User with customer ID {customer_id} not found"}
+            logger.info(f"Webhook: User with customer ID {customer_id} not found")
+            return
 
         subscription_status = subscription.get("status")
         subscription_id = subscription.get("id")
 
+        # 受信箱は顧客ごとに発生順に処理するが、念のため反映済みのイベントより古いイベントでは上書きしない
+        event_at = datetime.fromtimestamp(event["created"], tz=timezone.utc) if event.get("created") else None
+        if event_at and user.subscription_event_at and event_at < user.subscription_event_at:
+            logger.info(f"Webhook: 古いサブスクリプションのイベントを無視しました (user_id: {user.user_id}, event: {event.get('id')})")
+            return
+
         if event_type == "customer.subscription.deleted":
             # 期間が終了し、サブスクリプションが完全に削除された場合
             # 念のため、現在DBに保存されているIDと比較する
             if user.stripe_subscription_id == subscription_id:
                 user.subscription_end_date = None
                 user.stripe_subscription_id = None
+                user.subscription_status = subscription_status
+                user.subscription_cancel_at_period_end = False
         else: # created or updated
             # ステータスが有効（支払い済み or トライアル中）の場合
             if subscription_status in ["active", "trialing"]:
@@ -590,24 +1139,80 @@ async def stripe_webhook(
                         end_date = datetime.fromtimestamp(current_period_end, tz=timezone.utc)
                         user.subscription_end_date = end_date
                         user.stripe_subscription_id = subscription_id
+                        user.subscription_status = subscription_status
+                        user.subscription_cancel_at_period_end = bool(subscription.get("cancel_at_period_end"))
             # ステータスが無効（支払い失敗、キャンセル済みなど）になった場合
             else:
                 user.subscription_end_date = None
                 user.stripe_subscription_id = None
+                user.subscription_status = subscription_status
+                user.subscription_cancel_at_period_end = False
 
+        if event_at:
+            user.subscription_event_at = event_at
         session.add(user)
-        session.commit()
+        invalidate_user_status_after_commit(session, user.user_id)
         logger.info(f"Webhook: サブスクリプション状態を更新しました (user_id: {user.user_id}, status: {subscription_status})")
 
     # --- 支払失敗時のハンドリング ---
     elif event_type == "payment_intent.payment_failed":
         user_id = event_data.get("metadata", {}).get("user_id")
         if user_id:
-            user = session.exec(select(User).where(User.user_id == user_id)).first()
+            user = (await session.exec(select(User).where(User.user_id == user_id))).first()
             if user:
                 # 支払いが失敗したので、次の支払いのためにIDをクリアする
                 user.stripe_payment_intent_id = None
                 session.add(user)
-                session.commit()
+
+    # --- 価格・商品がダッシュボードで変更されたときの処理 ---
+    elif event_type.startswith("price.") or event_type.startswith("product."):
+        # 共有キャッシュの価格を消してから、全ワーカーにキャッシュの破棄を通知する
+        await shared_cache.delete(PRICE_CACHE_KEY)
+        await shared_cache.broadcast(PRICE_CACHE_KEY)
+
+# Stripe Webhook用のエンドポイント
+@app.post("/api/stripe-webhooks")
+async def stripe_webhook(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    stripe_signature: str = Header(None),
+):
+    import stripe
+
+    webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+    if not webhook_secret:
+        raise HTTPException(status_code=500, detail="Stripe webhook secret not configured")
+
+    try:
+        payload = await request.body()
+        event = stripe.Webhook.construct_event(
+            payload=payload, sig_header=stripe_signature, secret=webhook_secret
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+    except stripe.error.SignatureVerificationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid signature: {e}")
+
+    event_type = event["type"]
+    logger.info(f"Stripe Webhook受信: {event_type}")
+
+    # 再送されたイベント（処理済み・処理待ち）は保存せずに応答する
+    if await is_duplicate_event(session, "stripe", event["id"]):
+        return {"status": "success"}
+
+    # 検証済みのイベントを受信箱に保存してすぐに応答し、処理はワーカーに任せる
+    # 同じ顧客のイベントは、Stripeでの発生順（created）に処理される
+    customer_id = event["data"]["object"].get("customer")
+    await enqueue_event(
+        session,
+        source="stripe",
+        event_id=event["id"],
+        event_type=event_type,
+        payload=json.loads(payload),
+        created=datetime.fromtimestamp(event["created"], tz=timezone.utc),
+        ordering_key=customer_id if isinstance(customer_id, str) else None,
+    )
+    await session.commit()
+    webhook_workers.notify()
 
     return {"status": "success"}
\ No newline at end of file
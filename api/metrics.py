@@ -0,0 +1,157 @@
+# api/metrics.py
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# --- HTTP ---
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTPリクエスト数", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTPリクエストの処理時間", ["method", "route"]
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "1リクエストで実行したSQL文の数", ["method", "route"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64),
+)
+
+# --- DB ---
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "コネクションプールから接続を取り出すまでの待ち時間（新規接続を含む）", ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+# --- Stripe ---
+STRIPE_REQUEST_DURATION = Histogram(
+    "stripe_request_duration_seconds", "Stripe APIの呼び出し時間", ["operation"]
+)
+STRIPE_REQUEST_ERRORS = Counter(
+    "stripe_request_errors_total", "Stripe APIの呼び出しエラー数", ["operation", "error"]
+)
+STRIPE_CIRCUIT_OPEN = Gauge(
+    "stripe_circuit_open", "Stripeのサーキットブレーカーが開いているか（1で開いている。ワーカーごと）"
+)
+STRIPE_FALLBACKS = Counter(
+    "stripe_fallbacks_total", "Stripeの障害時に、最後に取得できた結果を返した回数", ["operation"]
+)
+
+# --- JWKS ---
+JWKS_FETCHES = Counter(
+    "jwks_fetches_total", "ClerkのJWKSの取得回数", ["result"]
+)
+
+# --- Webhook ---
+WEBHOOK_PROCESSING_LAG = Histogram(
+    "webhook_processing_lag_seconds", "Webhookイベントを受信してから処理が終わるまでの時間", ["source", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 21600),
+)
+
+# 処理中のリクエストで実行したSQL文の数（リクエストの外では None）
+_request_queries: ContextVar[Optional[List[int]]] = ContextVar("request_queries", default=None)
+
+
+class MetricsMiddleware:
+    """
+    ルートごとのリクエスト数・処理時間・SQL文の数を記録するASGIミドルウェア
+    ラベルにはURLではなくルートのパス（/api/layout など）を使い、系列が増えすぎないようにする
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        queries = [0]
+        token = _request_queries.set(queries)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_queries.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_REQUEST_DURATION.labels(method, route).observe(elapsed)
+            HTTP_REQUEST_DB_QUERIES.labels(method, route).observe(queries[0])
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """接続の取り出しにかかった時間（空きを待つ時間と新規接続の時間）を記録するプール"""
+
+    metrics_name = "api"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+
+class PoolCollector:
+    """スクレイプ時にコネクションプールの状態を読み取る"""
+
+    def __init__(self, pool, name: str):
+        self.pool = pool
+        self.name = name
+
+    def collect(self):
+        states = {
+            "db_pool_size": ("プールが保持する接続数の上限（pool_size）", self.pool.size()),
+            "db_pool_checked_out": ("使用中の接続数", self.pool.checkedout()),
+            "db_pool_checked_in": ("プールで待機中の接続数", self.pool.checkedin()),
+            "db_pool_overflow": ("pool_size を超えて開いている接続数（負の値は未使用の枠）", self.pool.overflow()),
+        }
+        for metric_name, (documentation, value) in states.items():
+            gauge = GaugeMetricFamily(metric_name, documentation, labels=["engine"])
+            gauge.add_metric([self.name], value)
+            yield gauge
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def instrument_engine(engine, name: str = "api") -> None:
+    """SQL文の数を数えるイベントと、プールの状態のコレクターを登録する"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _count_query)
+    REGISTRY.register(PoolCollector(sync_engine.pool, name))
+
+
+@contextmanager
+def observe_stripe(operation: str):
+    """Stripe APIの呼び出し時間とエラーを操作（Price.list など）ごとに記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STRIPE_REQUEST_ERRORS.labels(operation, type(e).__name__).inc()
+        raise
+    finally:
+        STRIPE_REQUEST_DURATION.labels(operation).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """Prometheusのテキスト形式の本文と Content-Type を返す"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,107 @@
+# api/migrate.py
+import os
+
+from sqlalchemy import text
+from database import engine
+
+# タイムゾーン付きのUTC日時を保存する列（asyncpg はタイムゾーンなしの列にタイムゾーン付きの値を渡せない）
+TIMESTAMPTZ_COLUMNS = [
+    ("user", "subscription_end_date"),
+    ("catalogversion", "updated_at"),
+    ("userlayout", "updated_at"),
+]
+
+def to_timestamptz(table: str, column: str) -> str:
+    # 既存の値はUTCとして解釈する。変換済みの列には何もしない
+    return f"""
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = '{table}' AND column_name = '{column}') = 'timestamp without time zone' THEN
+            ALTER TABLE "{table}" ALTER COLUMN {column} TYPE TIMESTAMPTZ USING {column} AT TIME ZONE 'UTC';
+        END IF;
+    END $$
+    """
+
+# 既存のテーブルに対するスキーマ変更
+# create_all() は既存テーブルを変更しないため、ここに何度実行しても安全なSQLだけを並べる
+MIGRATIONS = [
+    # レイアウトのバージョン番号（PATCH /api/layout が返す）
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS layout_version INTEGER NOT NULL DEFAULT 0',
+    # 一意制約を張る前に、(user_id, i, breakpoint) が重複している古い行を削除する
+    """
+    DELETE FROM layoutitem a
+    USING layoutitem b
+    WHERE a.user_id = b.user_id AND a.i = b.i AND a.breakpoint = b.breakpoint AND a.id < b.id
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_layoutitem_user_i_breakpoint ON layoutitem (user_id, i, breakpoint)",
+    # サブスクリプションの状態のスナップショット（/api/user-status がStripeを呼ばずに返す）
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS subscription_status VARCHAR',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS subscription_cancel_at_period_end BOOLEAN NOT NULL DEFAULT false',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS subscription_event_at TIMESTAMPTZ',
+    *(to_timestamptz(table, column) for table, column in TIMESTAMPTZ_COLUMNS),
+]
+
+# 列の追加だけでは正しい値にならず、データの埋め戻しが必要な変更
+# 完了したものを schemabackfill に記録し、成功するまで migrate.py の実行のたびに試す
+CREATE_BACKFILL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schemabackfill (
+    name VARCHAR PRIMARY KEY,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+def backfill_subscription_snapshot() -> None:
+    """
+    subscription_status / subscription_cancel_at_period_end は追加時に既定値（NULL / false）になるため、
+    Stripeのサブスクリプションと一度照合して埋める（解約を予約済みのユーザーが「更新予定」と表示されないように）
+    """
+    with engine.connect() as conn:
+        subscribers = conn.execute(text(
+            'SELECT count(*) FROM "user" WHERE stripe_subscription_id IS NOT NULL AND subscription_event_at IS NULL'
+        )).scalar_one()
+    if not subscribers:
+        return
+    if not os.getenv("STRIPE_API_KEY"):
+        raise SystemExit(
+            f"{subscribers} subscribers need their subscription state backfilled from Stripe. "
+            "Set STRIPE_API_KEY and run python migrate.py again."
+        )
+    # stripe パッケージは重いため、埋め戻しが必要なときだけ読み込む
+    from reconcile_subscriptions import create_gateway, format_stats, reconcile_subscriptions
+
+    stats = reconcile_subscriptions(create_gateway())
+    if stats is None:
+        raise SystemExit("Another subscription reconciliation is running. Run python migrate.py again after it finishes.")
+    print(f"  backfilled subscriptions: {format_stats(stats)}")
+
+BACKFILLS = [
+    ("subscription_snapshot", backfill_subscription_snapshot),
+]
+
+def run_backfills() -> None:
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_BACKFILL_TABLE_SQL))
+        completed = set(conn.execute(text("SELECT name FROM schemabackfill")).scalars())
+    for name, backfill in BACKFILLS:
+        if name in completed:
+            continue
+        print(f"Backfilling {name}...")
+        backfill()
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO schemabackfill (name) VALUES (:name) ON CONFLICT DO NOTHING"), {"name": name})
+
+def main():
+    print("Applying migrations...")
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+    run_backfills()
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
+
+# マイグレーションの実行方法（create_tables.py の後に実行する）
+# サブスクリプションを持つユーザーがいる場合は、状態をStripeから埋め戻すため STRIPE_API_KEY が必要
+# python migrate.py
@@ -0,0 +1,56 @@
+# api/migrate_layouts.py
+import argparse
+
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+from database import engine
+from models import UserLayout
+
+# LayoutItemの行をユーザーごとに集約し、UserLayoutのJSONBドキュメントとして一括で書き込む
+# アイテムは元の行の作成順（id順）に並べ、バージョンは User.layout_version を引き継ぐ
+COPY_LAYOUTS_SQL = """
+INSERT INTO userlayout (user_id, document, version, updated_at)
+SELECT per_breakpoint.user_id, jsonb_object_agg(per_breakpoint.breakpoint, per_breakpoint.items), u.layout_version, now()
+FROM (
+    SELECT
+        user_id,
+        breakpoint,
+        jsonb_agg(
+            jsonb_build_object('i', i, 'x', x, 'y', y, 'w', w, 'h', h, 'symbol', symbol, 'label', label)
+            ORDER BY id
+        ) AS items
+    FROM layoutitem
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id, breakpoint
+) AS per_breakpoint
+JOIN "user" AS u ON u.id = per_breakpoint.user_id
+GROUP BY per_breakpoint.user_id, u.layout_version
+ON CONFLICT (user_id) DO {on_conflict}
+"""
+
+OVERWRITE_SQL = "UPDATE SET document = EXCLUDED.document, version = userlayout.version + 1, updated_at = now()"
+
+def main():
+    parser = argparse.ArgumentParser(description="LayoutItemの行をユーザーごとのレイアウトドキュメントに移行する")
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="既にドキュメントがあるユーザーも、LayoutItemの内容で上書きする",
+    )
+    args = parser.parse_args()
+
+    SQLModel.metadata.create_all(engine, tables=[UserLayout.__table__])
+
+    print("Migrating layouts to documents...")
+    with engine.begin() as conn:
+        result = conn.execute(
+            text(COPY_LAYOUTS_SQL.format(on_conflict=OVERWRITE_SQL if args.overwrite else "NOTHING"))
+        )
+    print(f"Done! ({result.rowcount} users migrated)")
+
+if __name__ == "__main__":
+    main()
+
+# 移行方法（LAYOUT_STORAGE=document に切り替える前に実行する）
+# python migrate_layouts.py
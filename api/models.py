@@ -1,5 +1,7 @@
 # api/models.py
 from typing import List, Optional
+from sqlalchemy import Column, DateTime, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 from datetime import datetime
 
@@ -12,7 +14,15 @@ class User(SQLModel, table=True):
     stripe_payment_intent_id: Optional[str] = Field(default=None, index=True)
     stripe_customer_id: Optional[str] = Field(default=None, unique=True, index=True)
     stripe_subscription_id: Optional[str] = Field(default=None, unique=True)
-    subscription_end_date: Optional[datetime] = Field(default=None)
+    subscription_end_date: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    # Webhook（customer.subscription.*）と解約予約で更新するサブスクリプションの状態のスナップショット
+    # /api/user-status はStripeを呼ばずにこれを返す（subscription_end_date が期間の終了日時）
+    subscription_status: Optional[str] = Field(default=None)
+    subscription_cancel_at_period_end: bool = Field(default=False, sa_column_kwargs={"server_default": "false"})
+    # スナップショットに反映した最後のイベントの発生日時（これより古いイベントでは上書きしない）
+    subscription_event_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    # レイアウトが保存されるたびに1つ進むバージョン番号
+    layout_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     layouts: List["LayoutItem"] = Relationship(back_populates="user")
 
@@ -24,8 +34,20 @@ class Symbol(SQLModel, table=True):
     value: str = Field(unique=True, index=True)
     category: str
 
+# カタログのバージョンを管理するテーブルのモデル
+# seed実行時に更新され、/api/symbols のスナップショットを再構築するきっかけになる
+class CatalogVersion(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    version: int = Field(default=0)
+    updated_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+
 # LayoutItemテーブルのモデル
 class LayoutItem(SQLModel, table=True):
+    # (user_id, i, breakpoint) を一意にし、差分保存で INSERT ... ON CONFLICT を使えるようにする
+    __table_args__ = (
+        Index("uq_layoutitem_user_i_breakpoint", "user_id", "i", "breakpoint", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     i: str
     x: int
@@ -37,4 +59,47 @@ class LayoutItem(SQLModel, table=True):
     breakpoint: str
 
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    user: Optional[User] = Relationship(back_populates="layouts")
\ No newline at end of file
+    user: Optional[User] = Relationship(back_populates="layouts")
+
+# レイアウトを1ユーザー1行のJSONBドキュメントとして保存するテーブルのモデル
+# LAYOUT_STORAGE=document のときに使用し、version による compare-and-swap で更新する
+class UserLayout(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    document: dict = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    version: int = Field(default=0)
+    updated_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+
+# 受信したWebhookイベントを処理前に保存するテーブルのモデル（受信箱）
+# エンドポイントは署名の検証と保存だけを行い、バックグラウンドのワーカーが順に処理する
+class WebhookEvent(SQLModel, table=True):
+    # 未処理のイベントだけを対象にした部分インデックス（処理済みの行が増えても取り出しは遅くならない）
+    __table_args__ = (
+        Index("ix_webhookevent_pending", "event_created", "id", postgresql_where=text("status = 'pending'")),
+        Index(
+            "ix_webhookevent_pending_ordering", "ordering_key", "event_created", "id",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    source: str  # "stripe" / "clerk"
+    event_id: str = Field(index=True)
+    event_type: str
+    # 同じキー（Stripeの顧客ID・ClerkのユーザーID）のイベントは event_created の順に処理する
+    ordering_key: Optional[str] = Field(default=None)
+    event_created: datetime = Field(sa_type=DateTime(timezone=True))
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    status: str = Field(default="pending")  # "pending" / "done" / "failed" / "duplicate"
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(sa_type=DateTime(timezone=True))
+    last_error: Optional[str] = Field(default=None)
+    received_at: datetime = Field(sa_type=DateTime(timezone=True))
+    processed_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+
+
+# 処理済みのWebhookイベントのIDの台帳（Stripeの event.id / Clerk(Svix)の svix-id）
+# 再送されたイベントは、ユーザー行のロックやStripeの呼び出しの前にここで読み飛ばす
+class ProcessedWebhookEvent(SQLModel, table=True):
+    source: str = Field(primary_key=True)
+    event_id: str = Field(primary_key=True)
+    processed_at: datetime = Field(sa_type=DateTime(timezone=True), index=True)
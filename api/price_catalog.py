@@ -0,0 +1,122 @@
+# api/price_catalog.py
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 取得中に invalidate() された場合に、取得し直す回数の上限
+MAX_LOAD_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class CatalogPrice:
+    id: str
+    lookup_key: str
+    unit_amount: int
+    currency: str
+
+
+def to_catalog_prices(prices: Iterable) -> Dict[str, CatalogPrice]:
+    """StripeのPriceオブジェクトを lookup_key をキーにした辞書に変換する"""
+    return {
+        price.lookup_key: CatalogPrice(
+            id=price.id,
+            lookup_key=price.lookup_key,
+            unit_amount=price.unit_amount,
+            currency=price.currency,
+        )
+        for price in prices
+        if price.lookup_key
+    }
+
+
+class PriceCatalog:
+    """
+    lookup_key をキーにしたStripe価格のインプロセスキャッシュ
+    - TTLを過ぎた価格は古いまま返し、裏で再取得する（stale-while-revalidate）
+    - Webhookで価格の変更を受け取ったら invalidate() で破棄する
+    - 取得は loader（lookup_key のリストを受け取り、価格の辞書を返す同期関数）に任せる
+      （StripeGateway を経由させ、タイムアウトやサーキットブレーカーを効かせる）
+    """
+
+    def __init__(
+        self,
+        lookup_keys: Iterable[str],
+        loader: Callable[[List[str]], Dict[str, CatalogPrice]],
+        ttl_seconds: float = 300,
+    ):
+        self.lookup_keys = list(lookup_keys)
+        self.ttl_seconds = ttl_seconds
+        self._loader = loader
+        self._prices: Optional[Dict[str, CatalogPrice]] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+
+    def _load(self) -> Dict[str, CatalogPrice]:
+        for _ in range(MAX_LOAD_ATTEMPTS):
+            generation = self._generation
+            prices = self._loader(self.lookup_keys)
+            if generation == self._generation:
+                self._prices = prices
+                self._loaded_at = time.monotonic()
+                return prices
+            # 取得中に invalidate() された場合は、破棄される前の価格かもしれないため保存せずに取得し直す
+            # （バックグラウンド更新の最中だと、invalidate() からの再取得は始まらない）
+        # 破棄が続く場合は結果を保存せず、次の呼び出しで取得し直す
+        logger.warning("取得中に価格情報のキャッシュが繰り返し破棄されたため、結果を保存しません")
+        return prices
+
+    def _refresh_worker(self) -> None:
+        try:
+            with self._load_lock:
+                self._load()
+        except Exception as e:
+            # 取得に失敗しても古い価格の提供は続ける
+            logger.error(f"価格情報のバックグラウンド更新に失敗しました: {e}", exc_info=True)
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self) -> None:
+        if self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh_worker, name="price-catalog-refresh", daemon=True).start()
+
+    def get_all(self) -> Dict[str, CatalogPrice]:
+        """全価格を返す。キャッシュが空の場合のみStripeへの取得を待つ"""
+        prices = self._prices
+        if prices is None:
+            with self._load_lock:
+                # ロック待ちの間に他のリクエストが取得済みなら、それを使う
+                prices = self._prices
+                if prices is None:
+                    prices = self._load()
+        elif time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self.refresh_in_background()
+        return prices
+
+    @property
+    def loaded(self) -> bool:
+        return self._prices is not None
+
+    def get(self, lookup_key: str) -> Optional[CatalogPrice]:
+        return self.get_all().get(lookup_key)
+
+    async def get_async(self, lookup_key: str) -> Optional[CatalogPrice]:
+        """非同期エンドポイント用。キャッシュが空の場合は、Stripeからの取得を別スレッドで待つ"""
+        if self._prices is None:
+            return (await asyncio.to_thread(self.get_all)).get(lookup_key)
+        return self.get(lookup_key)
+
+    def invalidate(self) -> None:
+        """キャッシュを破棄し、すぐに再取得を始める"""
+        self._generation += 1
+        self._prices = None
+        logger.info("価格情報のキャッシュを破棄しました")
+        self.refresh_in_background()
@@ -0,0 +1,339 @@
+# api/reconcile_subscriptions.py
+import argparse
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+import stripe
+
+from database import engine
+from stripe_gateway import StripeGateway
+
+# 有効（プレミアム）として扱うサブスクリプションの状態。Webhookの処理と同じく、それ以外は有効なサブスクなしとして扱う
+ENTITLED_STATUSES = ("active", "trialing")
+# Stripeの一覧APIの1ページの件数（上限）
+PAGE_SIZE = 100
+# 1回のCOPYで一時テーブルに入れる件数（メモリに載るのはこの件数とページの先読み分だけ）
+DEFAULT_BATCH_SIZE = 1000
+# 同時に一覧を取得する数（状態ごとに並行して取得する）
+DEFAULT_CONCURRENCY = 2
+# 1秒あたりのStripe APIの呼び出し回数（本番の読み取りの上限 100回/秒 を、APIサーバーのために空けておく）
+DEFAULT_REQUESTS_PER_SECOND = 20
+# レート制限（429）のときの再試行回数
+MAX_RATE_LIMIT_RETRIES = 5
+# 同時に1つのジョブだけが照合するための、PostgreSQLのアドバイザリロックのキー
+ADVISORY_LOCK_KEY = 7_201_021
+
+CREATE_TEMP_TABLE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS reconcile_subscription (
+    subscription_id TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    current_period_end TIMESTAMPTZ,
+    cancel_at_period_end BOOLEAN NOT NULL,
+    created TIMESTAMPTZ NOT NULL
+);
+TRUNCATE reconcile_subscription;
+"""
+
+# Stripeの有効なサブスクリプション（顧客ごとに最新の1件）と、Userテーブルのスナップショットの差分
+# 照合を始めた後にWebhookで更新されたユーザーは、Webhookの方が新しいため対象にしない
+FIND_DRIFT_SQL = """
+CREATE TEMP TABLE reconcile_drift ON COMMIT DROP AS
+WITH latest AS (
+    SELECT DISTINCT ON (customer_id) *
+    FROM reconcile_subscription
+    ORDER BY customer_id, created DESC
+)
+SELECT
+    u.id,
+    u.user_id,
+    u.stripe_subscription_id AS current_subscription_id,
+    u.subscription_end_date AS current_end_date,
+    u.subscription_cancel_at_period_end AS current_cancel_at_period_end,
+    l.subscription_id,
+    l.status,
+    l.current_period_end,
+    COALESCE(l.cancel_at_period_end, false) AS cancel_at_period_end
+FROM "user" AS u
+LEFT JOIN latest AS l ON l.customer_id = u.stripe_customer_id
+WHERE u.stripe_customer_id IS NOT NULL
+  AND (u.subscription_event_at IS NULL OR u.subscription_event_at < %(started_at)s)
+  AND (
+      u.stripe_subscription_id IS DISTINCT FROM l.subscription_id
+      OR u.subscription_end_date IS DISTINCT FROM l.current_period_end
+      OR u.subscription_cancel_at_period_end IS DISTINCT FROM COALESCE(l.cancel_at_period_end, false)
+      OR (l.subscription_id IS NOT NULL AND u.subscription_status IS DISTINCT FROM l.status)
+  )
+"""
+
+COUNT_DRIFT_SQL = """
+SELECT
+    count(*) FILTER (WHERE current_subscription_id IS NULL AND subscription_id IS NOT NULL),
+    count(*) FILTER (WHERE current_subscription_id IS NOT NULL AND subscription_id IS NULL),
+    count(*) FILTER (WHERE current_subscription_id <> subscription_id),
+    count(*) FILTER (WHERE current_subscription_id = subscription_id
+                       AND current_end_date IS DISTINCT FROM current_period_end),
+    count(*) FILTER (WHERE current_subscription_id = subscription_id
+                       AND current_cancel_at_period_end IS DISTINCT FROM cancel_at_period_end),
+    count(*)
+FROM reconcile_drift
+"""
+
+# Stripeに有効なサブスクリプションがないユーザーは、有効でないことしか分からないため状態を NULL にする
+# 反映した日時を subscription_event_at に入れ、照合より前に発生したイベントで上書きされないようにする
+# 差分を見つけた後にWebhookで更新されたユーザーは、ここでも対象にしない
+UPDATE_DRIFT_SQL = """
+UPDATE "user" AS u
+SET stripe_subscription_id = d.subscription_id,
+    subscription_end_date = d.current_period_end,
+    subscription_cancel_at_period_end = d.cancel_at_period_end,
+    subscription_status = d.status,
+    subscription_event_at = %(started_at)s
+FROM reconcile_drift AS d
+WHERE u.id = d.id
+  AND (u.subscription_event_at IS NULL OR u.subscription_event_at < %(started_at)s)
+RETURNING u.user_id
+"""
+
+
+class RateLimiter:
+    """複数のスレッドからの呼び出しを、1秒あたり rate 回までに間隔を空ける"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def call_with_backoff(function: Callable[[], stripe.ListObject], limiter: RateLimiter) -> stripe.ListObject:
+    """レート制限（429）のときは、待ち時間を倍にしながら再試行する"""
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        try:
+            return function()
+        except stripe.RateLimitError:
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+
+
+def to_row(subscription) -> tuple:
+    # items は StripeObject の dict.items と名前がぶつかるため、添字で読む
+    items = subscription["items"]["data"] if subscription.get("items") else []
+    current_period_end = items[0].get("current_period_end") if items else None
+    customer = subscription["customer"]
+    return (
+        subscription["id"],
+        customer if isinstance(customer, str) else customer["id"],
+        subscription["status"],
+        datetime.fromtimestamp(current_period_end, tz=timezone.utc).isoformat() if current_period_end else None,
+        "t" if subscription.get("cancel_at_period_end") else "f",
+        datetime.fromtimestamp(subscription["created"], tz=timezone.utc).isoformat(),
+    )
+
+
+def iter_subscription_pages(
+    gateway: StripeGateway,
+    statuses: Iterable[str],
+    concurrency: int,
+    limiter: RateLimiter,
+    stats: Dict[str, int],
+) -> Iterable[List[tuple]]:
+    """
+    状態ごとの一覧を並行してページ送りし、ページ（行のリスト）を順に返す
+    取得済みで未処理のページは concurrency の2倍までに抑える（超えると取得側が待つ）
+    """
+    statuses = list(statuses)
+    pages: "queue.Queue" = queue.Queue(maxsize=concurrency * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(status: str) -> None:
+        try:
+            starting_after = None
+            while not stop.is_set():
+                params = {"status": status, "limit": PAGE_SIZE}
+                if starting_after:
+                    params["starting_after"] = starting_after
+                page = call_with_backoff(lambda: gateway.list_subscriptions(**params), limiter)
+                if page.data and not put([to_row(subscription) for subscription in page.data]):
+                    return
+                if not page.has_more or not page.data:
+                    break
+                starting_after = page.data[-1]["id"]
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(statuses)))) as executor:
+        for status in statuses:
+            executor.submit(fetch, status)
+        try:
+            finished = 0
+            while finished < len(statuses):
+                item = pages.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    stats["pages"] += 1
+                    yield item
+        finally:
+            stop.set()
+
+
+def copy_rows(cursor, rows: List[tuple]) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY reconcile_subscription (subscription_id, customer_id, status, current_period_end, cancel_at_period_end, created)"
+        " FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def reconcile_subscriptions(
+    gateway: StripeGateway,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+    dry_run: bool = False,
+    on_changed: Optional[Callable[[List[str]], None]] = None,
+) -> Optional[dict]:
+    """
+    Stripeの有効なサブスクリプションを一覧で取得し、Userテーブルのスナップショットとの差分を一括で直す
+    on_changed には、直したユーザーの user_id が batch_size 件ずつ渡される（キャッシュの破棄用）
+    他のジョブが照合中なら何もせずに None を返す
+    """
+    stats = {"pages": 0, "subscriptions": 0, "missing": 0, "stale": 0, "replaced": 0,
+             "end_date": 0, "cancel_at_period_end": 0, "drifted": 0, "updated": 0}
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+    locked = cursor.fetchone()[0]
+    connection.commit()
+    if not locked:
+        connection.close()
+        return None
+    try:
+        cursor.execute(CREATE_TEMP_TABLE_SQL)
+        connection.commit()
+
+        # 一覧は一時テーブルに溜める（件数が増えてもPythonのメモリには batch_size 件しか載らない）
+        limiter = RateLimiter(requests_per_second)
+        batch: List[tuple] = []
+        for rows in iter_subscription_pages(gateway, ENTITLED_STATUSES, concurrency, limiter, stats):
+            batch.extend(rows)
+            stats["subscriptions"] += len(rows)
+            if len(batch) >= batch_size:
+                copy_rows(cursor, batch)
+                batch = []
+        if batch:
+            copy_rows(cursor, batch)
+        cursor.execute("ANALYZE reconcile_subscription")
+
+        cursor.execute(FIND_DRIFT_SQL, {"started_at": started_at})
+        cursor.execute(COUNT_DRIFT_SQL)
+        (stats["missing"], stats["stale"], stats["replaced"],
+         stats["end_date"], stats["cancel_at_period_end"], stats["drifted"]) = cursor.fetchone()
+
+        changed: List[str] = []
+        if not dry_run:
+            cursor.execute(UPDATE_DRIFT_SQL, {"started_at": started_at})
+            while rows := cursor.fetchmany(batch_size):
+                if on_changed is not None:
+                    changed.extend(user_id for (user_id,) in rows)
+                stats["updated"] += len(rows)
+        connection.commit()
+
+        if on_changed is not None:
+            for offset in range(0, len(changed), batch_size):
+                on_changed(changed[offset:offset + batch_size])
+    finally:
+        # 接続はプールに戻って使い回されるため、ロックを明示的に外す
+        connection.rollback()
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+        connection.commit()
+        connection.close()
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def create_gateway() -> StripeGateway:
+    """環境変数（APIサーバーと同じ STRIPE_*）からStripeの呼び出し口を作る（スクリプト用）"""
+    return StripeGateway(
+        os.getenv("STRIPE_API_KEY"),
+        api_base=os.getenv("STRIPE_API_BASE") or None,
+        timeout=float(os.getenv("STRIPE_TIMEOUT_SECONDS", "30")),
+        max_network_retries=int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2")),
+    )
+
+
+def format_stats(stats: dict, dry_run: bool = False) -> str:
+    return (
+        f"{stats['subscriptions']} subscriptions in {stats['pages']} pages, drifted {stats['drifted']} "
+        f"(missing {stats['missing']}, stale {stats['stale']}, replaced {stats['replaced']}, "
+        f"end_date {stats['end_date']}, cancel_at_period_end {stats['cancel_at_period_end']}), "
+        f"updated {stats['updated']}{' (dry run)' if dry_run else ''} in {stats['seconds']:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stripeのサブスクリプションと、Userテーブルのサブスクリプションの状態を照合して直す")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1回のCOPYで一時テーブルに入れる件数")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同時に一覧を取得する数")
+    parser.add_argument(
+        "--requests-per-second", type=float, default=DEFAULT_REQUESTS_PER_SECOND, help="1秒あたりのStripe APIの呼び出し回数の上限"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="差分を数えるだけで変更しない")
+    args = parser.parse_args()
+
+    stats = reconcile_subscriptions(
+        create_gateway(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+        dry_run=args.dry_run,
+    )
+    if stats is None:
+        print("Another reconciliation is running; skipped.")
+        return
+    # APIサーバーのキャッシュ（/api/user-status）は USER_STATUS_CACHE_TTL_SECONDS の経過後に反映される
+    print(f"Done! {format_stats(stats, args.dry_run)}")
+
+if __name__ == "__main__":
+    main()
+
+# 照合の実行方法（cron などで定期的に実行する。APIサーバーで定期実行する場合は SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS を設定する）
+# python reconcile_subscriptions.py --dry-run
+# python reconcile_subscriptions.py
@@ -0,0 +1,84 @@
+# api/replay_webhooks.py
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, select, tuple_, update
+
+from database import engine
+from models import ProcessedWebhookEvent, WebhookEvent
+
+def build_filters(args):
+    filters = [WebhookEvent.status == args.status]
+    if args.id:
+        filters.append(WebhookEvent.id.in_(args.id))
+    if args.source:
+        filters.append(WebhookEvent.source == args.source)
+    if args.event_type:
+        filters.append(WebhookEvent.event_type == args.event_type)
+    if args.since:
+        filters.append(WebhookEvent.received_at >= args.since)
+    return filters
+
+async def process_now():
+    # 受信箱のワーカーと同じ処理関数を使うため、APIのモジュールを読み込む
+    from database import async_engine
+    from main import webhook_workers
+
+    processed = await webhook_workers.drain()
+    await async_engine.dispose()
+    return processed
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhookの受信箱にあるイベントを未処理に戻し、再処理させる")
+    parser.add_argument(
+        "--status",
+        choices=["failed", "done", "duplicate", "pending"],
+        default="failed",
+        help="対象にするイベントの状態（既定: failed）",
+    )
+    parser.add_argument("--id", type=int, action="append", help="対象にするイベントのID（複数指定可）")
+    parser.add_argument("--source", choices=["stripe", "clerk"], help="対象にする送信元")
+    parser.add_argument("--event-type", help="対象にするイベントの種類（例: customer.subscription.updated）")
+    parser.add_argument(
+        "--since",
+        type=lambda value: datetime.fromisoformat(value).astimezone(timezone.utc),
+        help="この日時以降に受信したイベントだけを対象にする（ISO 8601）",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="対象の件数を表示するだけで変更しない")
+    parser.add_argument(
+        "--process-now",
+        action="store_true",
+        help="APIサーバーのワーカーを待たずに、このプロセスで処理する",
+    )
+    args = parser.parse_args()
+
+    filters = build_filters(args)
+    with engine.begin() as conn:
+        if args.dry_run:
+            count = conn.execute(select(func.count()).select_from(WebhookEvent).where(*filters)).scalar_one()
+            print(f"{count} events would be replayed")
+            return
+        # 処理済みのイベントを再処理する場合は、重複として読み飛ばされないよう台帳から外す
+        conn.execute(
+            delete(ProcessedWebhookEvent).where(
+                tuple_(ProcessedWebhookEvent.source, ProcessedWebhookEvent.event_id).in_(
+                    select(WebhookEvent.source, WebhookEvent.event_id).where(*filters)
+                )
+            )
+        )
+        result = conn.execute(
+            update(WebhookEvent)
+            .where(*filters)
+            .values(status="pending", attempts=0, last_error=None, next_attempt_at=func.now(), processed_at=None)
+        )
+    print(f"{result.rowcount} events marked as pending")
+
+    if args.process_now:
+        print(f"Done! ({asyncio.run(process_now())} events processed)")
+
+if __name__ == "__main__":
+    main()
+
+# 再処理の方法（処理に失敗したイベントを未処理に戻す）
+# python replay_webhooks.py --status failed --source stripe
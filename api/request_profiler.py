@@ -0,0 +1,166 @@
+# api/request_profiler.py
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 遅くなりがちな処理。プロファイルの中でこれらにかかった時間をまとめて出す
+# （名前: (関数名, ファイルパスに含まれる文字列)。ファイルパスが None ならどのファイルでもよい）
+FOCUS_FRAMES = {
+    "jwt": ("get_current_user_payload", None),
+    "db_commit": ("commit", "sqlalchemy"),
+    "db_execute": ("execute", "sqlalchemy"),
+    "stripe": (None, "stripe_gateway.py"),
+}
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """"POST /api/layout=0.01,GET /api/user-status=0.05" をルートごとのサンプリング率に変換する"""
+    rates = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        route, _, rate = entry.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        rates[(method.upper(), path.strip())] = float(rate)
+    return rates
+
+
+def summarize(root_frame) -> Dict[str, float]:
+    """FOCUS_FRAMES に当てはまるフレームの時間（秒）を合計する。入れ子になった同じ種類のフレームは数えない"""
+    totals = {name: 0.0 for name in FOCUS_FRAMES}
+
+    def walk(frame, inside):
+        for name, (function, path_part) in FOCUS_FRAMES.items():
+            if name in inside:
+                continue
+            if function is not None and frame.function != function:
+                continue
+            if path_part is not None and path_part not in (frame.file_path or ""):
+                continue
+            totals[name] += frame.time
+            inside = inside | {name}
+        for child in frame.children:
+            walk(child, inside)
+
+    if root_frame is not None:
+        walk(root_frame, frozenset())
+    return totals
+
+
+class ProfilerMiddleware:
+    """
+    リクエスト単位でサンプリングプロファイラ（pyinstrument）を動かすASGIミドルウェア
+    - X-Profile ヘッダーに PROFILER_TOKEN を付けたリクエストは、応答の代わりにプロファイルを添付ファイルで返す
+    - sample_rates に指定したルートは、その割合のリクエストをプロファイルして output_dir に保存する
+    - 非同期モードで計測するため、同時に処理中の他のリクエストの時間は含まれない
+    有効にする設定がなければ main.py はこのミドルウェアを追加しない（無効時のオーバーヘッドはない）
+    """
+
+    def __init__(
+        self,
+        app,
+        token: Optional[str] = None,
+        sample_rates: Optional[Dict[tuple, float]] = None,
+        output_dir: Optional[str] = None,
+        interval: float = 0.001,
+    ):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rates = sample_rates or {}
+        self.output_dir = output_dir
+        self.interval = interval
+
+    def _requested_format(self, scope) -> Optional[str]:
+        """X-Profile ヘッダーのトークンが正しければ、返すプロファイルの形式（html / text）を返す"""
+        if self.token is None:
+            return None
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-profile")
+        if token is None or not hmac.compare_digest(token, self.token):
+            return None
+        return "text" if headers.get(b"x-profile-format") == b"text" else "html"
+
+    def _sampled(self, scope) -> bool:
+        rate = self.sample_rates.get((scope["method"], scope["path"]))
+        return rate is not None and random.random() < rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        requested_format = self._requested_format(scope)
+        if requested_format is None and not (self.output_dir and self._sampled(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        from pyinstrument import Profiler
+
+        status = 500
+
+        async def send_or_discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            # プロファイルを返す場合は、元の応答は捨てる
+            if requested_format is None:
+                await send(message)
+
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_or_discard)
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - started
+            summary = summarize(profiler.last_session.root_frame() if profiler.last_session else None)
+            logger.info(
+                f"リクエストをプロファイルしました ({scope['method']} {scope['path']}, {status}, {elapsed * 1000:.1f} ms): "
+                + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in summary.items())
+            )
+            if self.output_dir:
+                # HTMLの生成とファイルへの書き込みは数十ミリ秒かかるため、イベントループを止めないよう別スレッドで行う
+                await asyncio.to_thread(self._save, profiler, scope, elapsed)
+
+        if requested_format is not None:
+            await self._send_profile(send, profiler, requested_format, status, elapsed, summary)
+
+    def _save(self, profiler, scope, elapsed: float) -> None:
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            route = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-")
+            path = os.path.join(self.output_dir, f"{timestamp}-{scope['method']}-{route}-{elapsed * 1000:.0f}ms.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        except Exception as e:
+            # プロファイルの保存に失敗しても、リクエストの処理には影響させない
+            logger.error(f"プロファイルの保存に失敗しました: {e}", exc_info=True)
+
+    @staticmethod
+    async def _send_profile(send, profiler, requested_format: str, status: int, elapsed: float, summary) -> None:
+        if requested_format == "text":
+            render, content_type, extension = profiler.output_text, "text/plain; charset=utf-8", "txt"
+        else:
+            render, content_type, extension = profiler.output_html, "text/html; charset=utf-8", "html"
+        body = await asyncio.to_thread(render)
+        data = body.encode()
+        headers = [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(data)).encode()),
+            (b"content-disposition", f'attachment; filename="profile.{extension}"'.encode()),
+            (b"x-profile-original-status", str(status).encode()),
+            (b"x-profile-duration-ms", f"{elapsed * 1000:.1f}".encode()),
+            (b"x-profile-summary", ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in summary.items()).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": data})
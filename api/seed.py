@@ -1,7 +1,7 @@
 # api/seed.py
-from sqlmodel import Session, select
+from sqlmodel import Session
 from database import engine
-from models import Symbol
+from load_symbols import sync_symbols
 
 # 日本株 (日経225全銘柄)
 nikkei225_symbols_data = [
@@ -171,26 +171,20 @@ index_symbols_data = [
 
 
 def seed_data():
+    symbols = {
+        "japan": [(s["label"], s["value"]) for s in nikkei225_symbols_data],
+        "us": [(s["label"], s["value"]) for s in us_stock_symbols_data],
+        "fx": [(s["label"], s["value"]) for s in fx_symbols_data],
+        "index": [(s["label"], s["value"]) for s in index_symbols_data],
+    }
     with Session(engine) as session:
-        # 既存のデータを削除
-        symbols_to_delete = session.exec(select(Symbol)).all()
-        for symbol in symbols_to_delete:
-            session.delete(symbol)
-        print("Deleted existing symbols.")
-
-        symbols_to_add = []
-        for s in nikkei225_symbols_data:
-            symbols_to_add.append(Symbol(label=s["label"], value=s["value"], category="japan"))
-        for s in us_stock_symbols_data:
-            symbols_to_add.append(Symbol(label=s["label"], value=s["value"], category="us"))
-        for s in fx_symbols_data:
-            symbols_to_add.append(Symbol(label=s["label"], value=s["value"], category="fx"))
-        for s in index_symbols_data:
-            symbols_to_add.append(Symbol(label=s["label"], value=s["value"], category="index"))
-
-        session.add_all(symbols_to_add)
+        # 既存の銘柄との差分だけを反映する（IDは変わらず、途中で銘柄リストが空になることもない）
+        stats = sync_symbols(session, symbols)
         session.commit()
-        print("Seeding finished.")
+    print(f"Inserted {stats['inserted']}, updated {stats['updated']}, deleted {stats['deleted']} symbols.")
+    if stats["version"] is not None:
+        print(f"Catalog version bumped to {stats['version']}.")
+    print("Seeding finished.")
 
 if __name__ == "__main__":
     seed_data()
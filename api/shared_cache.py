@@ -0,0 +1,315 @@
+# api/shared_cache.py
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# 無効化を知らせるチャンネル（メッセージはトピック名）
+INVALIDATION_CHANNEL = "invalidate"
+
+
+class MemoryCacheBackend:
+    """
+    プロセス内のLRUキャッシュ（CACHE_URL 未設定時の既定）
+    ワーカーが1つのとき、または共有しなくてよい開発環境用。無効化の通知はこのプロセス内にだけ届く
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def take(self, key: str) -> Optional[bytes]:
+        value = await self.get(key)
+        self._entries.pop(key, None)
+        return value
+
+    async def publish(self, channel: str, message: str) -> None:
+        for listener in self._listeners.get(channel, []):
+            listener(message)
+
+    async def subscribe(self, channel: str, listener: Callable[[str], None]) -> None:
+        self._listeners.setdefault(channel, []).append(listener)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+
+class RedisCacheBackend:
+    """
+    Redis（互換サーバーを含む）を使うワーカー間の共有キャッシュ
+    無効化の通知は Pub/Sub で全ワーカー（自分を含む）に届く
+    """
+
+    def __init__(self, url: str):
+        # Redisを使わない構成では redis パッケージを読み込まない
+        import redis.asyncio as redis
+
+        self.url = url
+        self._redis = redis
+        self._client = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pubsub = None
+        self._listeners: Dict[str, List[Callable[[str], None]]] = {}
+        self._listen_task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self):
+        # 接続はイベントループに結び付くため、別のループ（起動前のスクリプトなど）から使われたら作り直す
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = self._redis.from_url(self.url)
+            self._client_loop = loop
+        return self._client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self.client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*keys)
+
+    async def take(self, key: str) -> Optional[bytes]:
+        return await self.client.getdel(key)
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str, listener: Callable[[str], None]) -> None:
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        if channel not in self._listeners:
+            await self._pubsub.subscribe(channel)
+        self._listeners.setdefault(channel, []).append(listener)
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen(), name="cache-invalidation")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"].decode()
+                    for listener in self._listeners.get(channel, []):
+                        listener(message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 接続が切れても購読を続ける（次の listen() で再接続・再購読される）
+                logger.error(f"キャッシュの無効化通知の受信に失敗しました: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            await asyncio.gather(self._listen_task, return_exceptions=True)
+            self._listen_task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_cache_backend(url: Optional[str]):
+    """CACHE_URL（redis://... または rediss://...）からバックエンドを作る。未設定ならプロセス内のLRU"""
+    if not url:
+        return MemoryCacheBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCacheBackend(url)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+class SharedCache:
+    """
+    バックエンドを差し替えられるキャッシュ（値はJSONで保存する。None はキャッシュしない）
+    - get_or_load: キャッシュがなければ loader で取得して保存する。同じキーを同時に取得しようとした場合
+      （同じプロセス内の同時リクエスト、複数のワーカー）は、1つだけが loader を呼び、他はその結果を待つ
+    - broadcast / on_invalidate: Webhookなどで変更を知ったワーカーから、全ワーカーに無効化を知らせる
+    - バックエンドの障害時は、キャッシュなし（loader を直接呼ぶ）として動き続ける
+    """
+
+    def __init__(self, backend, namespace: str = "kabukawa", lock_ttl: float = 10, wait_interval: float = 0.05):
+        self.backend = backend
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait_interval = wait_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._invalidation_listeners: Dict[str, List[Callable[[], None]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Any:
+        try:
+            value = await self.backend.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"キャッシュの読み込みに失敗しました (key: {key}): {e}")
+            return None
+        return None if value is None else orjson.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        if value is None:
+            return
+        try:
+            await self.backend.set(self._key(key), orjson.dumps(value), ttl)
+        except Exception as e:
+            logger.warning(f"キャッシュの書き込みに失敗しました (key: {key}): {e}")
+
+    async def delete(self, *keys: str) -> None:
+        try:
+            await self.backend.delete(*(self._key(key) for key in keys))
+        except Exception as e:
+            logger.warning(f"キャッシュの削除に失敗しました (keys: {keys}): {e}")
+
+    async def take(self, key: str) -> Any:
+        """値を読み、同時に削除する（1回だけ使える値用。複数のワーカーが同時に読んでも、受け取るのは1つだけ）"""
+        try:
+            value = await self.backend.take(self._key(key))
+        except Exception as e:
+            logger.warning(f"キャッシュの読み込みに失敗しました (key: {key}): {e}")
+            return None
+        return None if value is None else orjson.loads(value)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        value = await self.get(key)
+        if value is not None:
+            return value
+        # 同じプロセス内の同時のキャッシュミスは、1回の取得にまとめる
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load_once(key, loader, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # 待っている側がキャンセルされても、取得自体は続ける（他の待ち手のため）
+        return await asyncio.shield(task)
+
+    async def _try_lock(self, lock_key: str, token: str) -> bool:
+        try:
+            return await self.backend.add(lock_key, token.encode(), self.lock_ttl)
+        except Exception as e:
+            logger.warning(f"キャッシュのロックを取得できませんでした。ロックなしで取得します: {e}")
+            return True
+
+    async def _unlock(self, lock_key: str, token: str) -> None:
+        try:
+            # ロックの期限が切れて他のワーカーが取り直した場合は、そのロックを消さない
+            if await self.backend.get(lock_key) == token.encode():
+                await self.backend.delete(lock_key)
+        except Exception as e:
+            logger.warning(f"キャッシュのロックを解放できませんでした（期限切れで解放されます）: {e}")
+
+    async def _load_once(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        lock_key = self._key(f"{key}:lock")
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl
+        # 他のワーカーが取得中なら、その結果が保存されるのを待つ
+        # （ロックの持ち主が落ちた場合は、期限が切れた後に自分で取得する）
+        while not await self._try_lock(lock_key, token):
+            await asyncio.sleep(self.wait_interval)
+            value = await self.get(key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                break
+        try:
+            # ロックを待っている間に保存された場合は、それを使う
+            value = await self.get(key)
+            if value is None:
+                value = await loader()
+                await self.set(key, value, ttl)
+            return value
+        finally:
+            await self._unlock(lock_key, token)
+
+    def get_or_load_from_thread(self, key: str, loader: Callable[[], Any], ttl: float, timeout: float = 60) -> Any:
+        """
+        同期コードを実行しているスレッドから get_or_load を呼ぶ
+        loader は、同期関数なら別スレッドで、コルーチン関数ならイベントループで実行する
+        start() の前（スクリプトなど）は、キャッシュを使わずに loader を呼ぶ
+        """
+        is_async = asyncio.iscoroutinefunction(loader)
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return asyncio.run(loader()) if is_async else loader()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("get_or_load_from_thread must not be called from the event loop thread")
+        future = asyncio.run_coroutine_threadsafe(
+            self.get_or_load(key, loader if is_async else lambda: asyncio.to_thread(loader), ttl), loop
+        )
+        return future.result(timeout)
+
+    def on_invalidate(self, topic: str, listener: Callable[[], None]) -> None:
+        """broadcast(topic) されたときに（どのワーカーからでも）呼ばれるコールバックを登録する"""
+        self._invalidation_listeners.setdefault(topic, []).append(listener)
+
+    def _dispatch(self, topic: str) -> None:
+        for listener in self._invalidation_listeners.get(topic, []):
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"キャッシュの無効化の処理に失敗しました (topic: {topic}): {e}", exc_info=True)
+
+    async def broadcast(self, topic: str) -> None:
+        """全ワーカーに topic の無効化を知らせる"""
+        try:
+            await self.backend.publish(self._key(INVALIDATION_CHANNEL), topic)
+        except Exception as e:
+            # 通知できなくても、少なくともこのワーカーでは無効化する
+            logger.warning(f"キャッシュの無効化を通知できませんでした (topic: {topic}): {e}")
+            self._dispatch(topic)
+
+    async def start(self) -> None:
+        """無効化の通知の購読を始める（APIサーバーの起動時に呼ぶ）"""
+        self._loop = asyncio.get_running_loop()
+        await self.backend.subscribe(self._key(INVALIDATION_CHANNEL), self._dispatch)
+
+    async def close(self) -> None:
+        self._loop = None
+        await self.backend.close()
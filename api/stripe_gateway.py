@@ -0,0 +1,246 @@
+# api/stripe_gateway.py
+import asyncio
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import STRIPE_CIRCUIT_OPEN, STRIPE_FALLBACKS, observe_stripe
+
+if TYPE_CHECKING:
+    import stripe
+
+logger = logging.getLogger(__name__)
+
+# 参照系の操作（短いタイムアウトを使い、同じ引数の同時呼び出しを1回にまとめる）
+READ_OPERATIONS = {"Price.list", "Subscription.retrieve", "PaymentIntent.retrieve"}
+
+
+class StripeUnavailableError(Exception):
+    """Stripeを呼べない（時間内に応答がない、またはサーキットブレーカーが開いている）"""
+
+    def __init__(self, operation: str, reason: str):
+        super().__init__(f"Stripe is unavailable ({operation}: {reason})")
+        self.operation = operation
+        self.reason = reason
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Stripe側の障害（接続エラー・5xx・429）か。カードの拒否や不正なリクエストは障害として数えない"""
+    import stripe
+
+    if isinstance(error, (StripeUnavailableError, stripe.APIConnectionError, stripe.RateLimitError)):
+        return True
+    return isinstance(error, stripe.APIError) and (error.http_status or 500) >= 500
+
+
+class CircuitBreaker:
+    """
+    Stripeの障害が続いたら呼び出しを止め、待たずに失敗させるサーキットブレーカー
+    - 障害が failure_threshold 回続いたら開く（呼び出しを止める）
+    - 開いてから reset_timeout 秒たったら、1件だけ試しに通す（半開）。成功すれば閉じ、失敗すればまた開く
+    - 価格の取得はスレッドからも呼ばれるため、状態はロックで守る
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        opened_at = self._opened_at
+        if opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Stripeへの呼び出しが回復しました（サーキットブレーカーを閉じます）")
+                STRIPE_CIRCUIT_OPEN.set(0)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if not self._probing:
+                    logger.warning(f"Stripeの障害が{self._failures}回続いたため、サーキットブレーカーを開きます")
+                    STRIPE_CIRCUIT_OPEN.set(1)
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """試しに通した呼び出しが結果を出さずに終わった（呼び出し側のキャンセル）"""
+        with self._lock:
+            self._probing = False
+
+
+class StripeGateway:
+    """
+    APIサーバーから使うStripe APIの呼び出し口
+    - 非同期エンドポイントからは *_async のメソッドを await し、Stripeの応答待ちでイベントループを止めない
+    - HTTPXのクライアントを使い回し、Stripeへの接続をキープアライブで再利用する
+    - api_base を指定すると stripe-mock などのローカルサーバーに向けられる
+    - 呼び出し時間とエラーを操作（Subscription.retrieve など）ごとにメトリクスに記録する
+    - stripe パッケージは最初の呼び出しまで読み込まない
+    - 非同期の呼び出しは、再試行を含めて参照系は read_timeout 秒、更新系は write_timeout 秒で打ち切る
+      （StripeUnavailableError。Stripeの障害時にリクエストが応答を待ち続けないようにする）
+    - Stripeの障害が続くとサーキットブレーカーが開き、しばらくは呼ばずに StripeUnavailableError にする
+    - 参照系は同じ引数の同時呼び出しを1回にまとめる。価格の一覧は、障害時に最後に取得できた結果を返す
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        api_base: Optional[str] = None,
+        timeout: float = 30,
+        max_network_retries: int = 2,
+        read_timeout: float = 5,
+        write_timeout: float = 15,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.max_network_retries = max_network_retries
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional["stripe.StripeClient"] = None
+        self._http_client: Optional["stripe.HTTPXClient"] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # 障害時に返す、最後に取得できた結果（キーは _read の key）
+        self._last_good: Dict[Hashable, Any] = {}
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> "stripe.StripeClient":
+        # APIキー未設定でも起動できるよう、クライアントは最初の呼び出し時に作る
+        # stripe パッケージの読み込みは重い（約1秒）ため、ここで初めて読み込み、起動を速くする
+        client = self._client
+        if client is not None:
+            return client
+        # イベントループと照合ジョブのスレッドから同時に呼ばれても、クライアントを1つだけ作る
+        with self._client_lock:
+            if self._client is None:
+                import stripe
+
+                # サブスクリプションの照合ジョブはスレッドから同期的に呼ぶため、同期メソッドも許可する
+                http_client = stripe.HTTPXClient(timeout=self.timeout, allow_sync_methods=True)
+                self._client = stripe.StripeClient(
+                    self.api_key,
+                    base_addresses={"api": self.api_base} if self.api_base else {},
+                    max_network_retries=self.max_network_retries,
+                    http_client=http_client,
+                )
+                self._http_client = http_client
+            return self._client
+
+    async def _call(self, operation: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        timeout = self.read_timeout if operation in READ_OPERATIONS else self.write_timeout
+        with observe_stripe(operation):
+            if not self.breaker.allow():
+                raise StripeUnavailableError(operation, "circuit open")
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await call()
+            except TimeoutError:
+                self.breaker.record_failure()
+                raise StripeUnavailableError(operation, f"no response within {timeout:g}s") from None
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if is_upstream_failure(e):
+                    self.breaker.record_failure()
+                else:
+                    # カードの拒否などはStripeが応答できている
+                    self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def _read(self, key: tuple, call: Callable[[], Awaitable[Any]], fallback: bool = False) -> Any:
+        """参照系の呼び出し。key（先頭は操作名）が同じ同時呼び出しは、1回の呼び出しの結果を共有する"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(key[0], call))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            # 待っている側がキャンセルされても、呼び出し自体は続ける（他の待ち手のため）
+            result = await asyncio.shield(task)
+        except Exception as e:
+            if not fallback or key not in self._last_good or not is_upstream_failure(e):
+                raise
+            logger.warning(f"Stripeを呼べないため、最後に取得した結果を返します ({key[0]}): {e}")
+            STRIPE_FALLBACKS.labels(key[0]).inc()
+            return self._last_good[key]
+        if fallback:
+            self._last_good[key] = result
+        return result
+
+    async def create_customer(self, email: str, user_id: str) -> "stripe.Customer":
+        return await self._call("Customer.create", lambda: self.client.v1.customers.create_async(
+            params={"email": email, "metadata": {"user_id": user_id}}
+        ))
+
+    async def retrieve_payment_intent(self, payment_intent_id: str) -> "stripe.PaymentIntent":
+        return await self._read(
+            ("PaymentIntent.retrieve", payment_intent_id),
+            lambda: self.client.v1.payment_intents.retrieve_async(payment_intent_id),
+        )
+
+    async def create_payment_intent(self, idempotency_key: Optional[str] = None, **params) -> "stripe.PaymentIntent":
+        options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+        return await self._call(
+            "PaymentIntent.create", lambda: self.client.v1.payment_intents.create_async(params=params, options=options)
+        )
+
+    async def create_subscription(self, **params) -> "stripe.Subscription":
+        return await self._call("Subscription.create", lambda: self.client.v1.subscriptions.create_async(params=params))
+
+    async def retrieve_subscription(self, subscription_id: str) -> "stripe.Subscription":
+        return await self._read(
+            ("Subscription.retrieve", subscription_id),
+            lambda: self.client.v1.subscriptions.retrieve_async(subscription_id),
+        )
+
+    async def modify_subscription(self, subscription_id: str, **params) -> "stripe.Subscription":
+        return await self._call(
+            "Subscription.modify", lambda: self.client.v1.subscriptions.update_async(subscription_id, params=params)
+        )
+
+    async def list_prices(self, lookup_keys: List[str]) -> List["stripe.Price"]:
+        """PriceCatalog のローダー用。Stripeの障害時は、最後に取得できた価格を返す"""
+        async def call():
+            return (await self.client.v1.prices.list_async(params={"lookup_keys": lookup_keys, "active": True})).data
+
+        return await self._read(("Price.list", tuple(lookup_keys)), call, fallback=True)
+
+    def list_subscriptions(self, **params) -> "stripe.ListObject":
+        """サブスクリプションの照合ジョブ用（同期。1ページ分だけ取得する。429からの再試行はジョブ側で行う）"""
+        with observe_stripe("Subscription.list"):
+            return self.client.v1.subscriptions.list(params=params)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.close_async()
+            self._client = None
+            self._http_client = None
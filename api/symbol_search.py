@@ -0,0 +1,264 @@
+# api/symbol_search.py
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# カタカナ（ァ〜ヶ）をひらがなに寄せるための変換表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# この長さまでの前方一致はインデックスで引き、それより長い検索語は候補を直接確認する
+PREFIX_INDEX_LENGTH = 3
+
+_EMPTY: Set[int] = frozenset()
+
+
+def normalize(text: str) -> str:
+    """
+    検索用に文字列を正規化する
+    - NFKCで全角英数字・半角カナを統一し、小文字化する
+    - カタカナはひらがなに変換し、「とよた」でも「トヨタ」にヒットさせる
+    """
+    return unicodedata.normalize("NFKC", text).lower().translate(_KATAKANA_TO_HIRAGANA)
+
+
+def _grams(text: str) -> Set[str]:
+    """1文字と2文字のn-gramを返す（1文字の検索語は漢字1文字での検索に使う）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _add(index: Dict[str, Set[int]], key: str, doc_id: int) -> None:
+    index.setdefault(key, set()).add(doc_id)
+
+
+class SymbolSearchIndex:
+    """
+    銘柄の label / value に対するn-gramの転置インデックス
+
+    一致の強さごとに以下の順で並べ、同じ強さの中ではラベルが短い（より具体的な）銘柄を上位にする
+    0. コード（"TRADU:7203" の "7203"）または value の完全一致
+    1. label の完全一致
+    2. label またはコードの前方一致
+    3. value の前方一致
+    4. label の部分一致
+    5. value の部分一致
+    """
+
+    def __init__(self, symbols: Iterable[dict]):
+        # ドキュメントIDを同順位内の並び順にしておき、ID順に並べるだけで順位が決まるようにする
+        entries = []
+        for symbol in symbols:
+            label = normalize(symbol["label"])
+            value = normalize(symbol["value"])
+            entries.append((len(label), symbol.get("id") or 0, label, value, symbol))
+        entries.sort(key=lambda entry: entry[:2])
+
+        self._symbols: List[dict] = []
+        self._labels: List[str] = []
+        self._values: List[str] = []
+        self._codes: List[str] = []
+        # label と value をつないだ文字列（複数の検索語の確認用。区切りの \x00 をまたいで一致することはない）
+        self._texts: List[str] = []
+        # n-gramごとのドキュメントIDのリスト（ID順＝順位順）。上位から必要な件数だけ取り出すのに使う
+        self._label_postings: Dict[str, List[int]] = {}
+        self._value_postings: Dict[str, List[int]] = {}
+        # label と value のどちらかに n-gram を含むドキュメント（複数の検索語の候補の絞り込み用）
+        self._text_grams: Dict[str, Set[int]] = {}
+        self._exact: Dict[str, Set[int]] = {}
+        self._exact_label: Dict[str, Set[int]] = {}
+        self._prefix: Dict[str, Set[int]] = {}
+        self._value_prefix: Dict[str, Set[int]] = {}
+        self._by_category: Dict[str, List[int]] = {}
+
+        for doc_id, (_, _, label, value, symbol) in enumerate(entries):
+            code = value.rsplit(":", 1)[-1]
+            self._symbols.append(symbol)
+            self._labels.append(label)
+            self._values.append(value)
+            self._codes.append(code)
+            self._texts.append(f"{label}\x00{value}")
+            self._by_category.setdefault(symbol["category"], []).append(doc_id)
+
+            # doc_id は増えていくので、追加するだけでリストはID順になる
+            label_grams, value_grams = _grams(label), _grams(value)
+            for gram in label_grams:
+                self._label_postings.setdefault(gram, []).append(doc_id)
+            for gram in value_grams:
+                self._value_postings.setdefault(gram, []).append(doc_id)
+            for gram in label_grams | value_grams:
+                _add(self._text_grams, gram, doc_id)
+            _add(self._exact, value, doc_id)
+            _add(self._exact, code, doc_id)
+            _add(self._exact_label, label, doc_id)
+            for length in range(1, PREFIX_INDEX_LENGTH + 1):
+                _add(self._prefix, label[:length], doc_id)
+                _add(self._prefix, code[:length], doc_id)
+                _add(self._value_prefix, value[:length], doc_id)
+
+        # 共通部分・所属の確認用の集合
+        self._label_grams = {gram: set(ids) for gram, ids in self._label_postings.items()}
+        self._value_grams = {gram: set(ids) for gram, ids in self._value_postings.items()}
+
+        # 検索語がないときの一覧は、元のID順（カタログの登録順）で返す
+        def by_symbol_id(doc_id: int) -> int:
+            return self._symbols[doc_id].get("id") or 0
+
+        self._all_by_id = sorted(range(len(self._symbols)), key=by_symbol_id)
+        self._by_category = {
+            category: sorted(ids, key=by_symbol_id) for category, ids in self._by_category.items()
+        }
+        self._category_sets = {category: set(ids) for category, ids in self._by_category.items()}
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    @staticmethod
+    def _hits(grams: Dict[str, Set[int]], texts: List[str], term: str, within: Optional[Set[int]]) -> Set[int]:
+        """検索語を部分文字列として含むドキュメント（within を指定すればその中だけ）"""
+        if len(term) <= 2:
+            # 1〜2文字の検索語はn-gramそのものなので確認は不要
+            posting = grams.get(term, _EMPTY)
+            return posting if within is None else posting & within
+        postings = []
+        for i in range(len(term) - 1):
+            posting = grams.get(term[i:i + 2])
+            if not posting:
+                return _EMPTY
+            postings.append(posting)
+        if within is not None:
+            postings.append(within)
+        # 小さい順に2つだけ共通部分を取り、残りのn-gramは部分一致の確認でまとめて確かめる
+        # （大きなリストとの共通部分を取るより、絞った候補の文字列を見る方が速い）
+        postings.sort(key=len)
+        candidates = postings[0] & postings[1]
+        if within is None or within is postings[0] or within is postings[1]:
+            return {doc_id for doc_id in candidates if term in texts[doc_id]}
+        return {doc_id for doc_id in candidates if doc_id in within and term in texts[doc_id]}
+
+    def _prefix_hits(self, term: str, label_hits: Set[int], value_hits: Set[int]) -> Tuple[Set[int], Set[int]]:
+        """(label またはコードの前方一致, value の前方一致)。インデックスにない長さは部分一致したものから確かめる"""
+        if len(term) <= PREFIX_INDEX_LENGTH:
+            return self._prefix.get(term, _EMPTY), self._value_prefix.get(term, _EMPTY)
+        labels, values, codes = self._labels, self._values, self._codes
+        prefix = {d for d in label_hits if labels[d].startswith(term)}
+        prefix |= {d for d in value_hits if codes[d].startswith(term)}
+        return prefix, {d for d in value_hits if values[d].startswith(term)}
+
+    def _tiers(self, term: str, docs: Set[int]) -> List[Set[int]]:
+        """検索語を含む docs を一致の強さ 0〜4 ごとに分けた集合（重なりあり。どれにも入らなければ 5）"""
+        labels = self._labels
+        prefix, value_prefix = self._prefix_hits(term, docs, docs)
+        return [
+            docs & self._exact.get(term, _EMPTY),
+            docs & self._exact_label.get(term, _EMPTY),
+            docs & prefix,
+            docs & value_prefix,
+            {d for d in docs if term in labels[d]},
+        ]
+
+    @staticmethod
+    def _take_ordered(
+        hits: Set[int],
+        postings: Dict[str, List[int]],
+        term: str,
+        excluded: Tuple[Set[int], ...],
+        count: int,
+    ) -> List[int]:
+        """hits のうち excluded に含まれないものを、ID順に先頭から count 件返す"""
+        ordered = postings.get(term) if len(term) <= 2 else None
+        if ordered is None or len(hits) * 4 < len(ordered):
+            # 一致が少なければ（長い検索語・カテゴリでの絞り込み）、一致したものだけを並べる
+            ordered = sorted(hits)
+        page = []
+        for doc_id in ordered:
+            if doc_id in hits and not any(doc_id in ids for ids in excluded):
+                page.append(doc_id)
+                if len(page) >= count:
+                    break
+        return page
+
+    def _search_term(self, term: str, within: Optional[Set[int]], limit: int, offset: int) -> Tuple[int, List[dict]]:
+        label_hits = self._hits(self._label_grams, self._labels, term, within)
+        value_hits = self._hits(self._value_grams, self._values, term, within)
+        # 強い一致（完全一致・前方一致）はすべて label か value の部分一致でもあるので、件数はこの2つの和集合
+        total = len(label_hits) + len(value_hits) - len(value_hits & label_hits)
+        if offset >= total:
+            return total, []
+
+        prefix, value_prefix = self._prefix_hits(term, label_hits, value_hits)
+
+        # 強い一致の集合から順に、offset + limit 件に達するまでだけ取り出す
+        # 部分一致（件数が多い）は集合を作り直さず、ID順のリストを先頭からたどる
+        wanted = offset + limit
+        page: List[int] = []
+        seen: Set[int] = set()
+        for hits in (self._exact.get(term, _EMPTY), self._exact_label.get(term, _EMPTY), prefix, value_prefix):
+            hits = hits - seen if within is None else (hits & within) - seen
+            page.extend(sorted(hits)[:wanted - len(page)])
+            if len(page) >= wanted:
+                return total, [self._symbols[doc_id] for doc_id in page[offset:]]
+            seen |= hits
+        page.extend(self._take_ordered(label_hits, self._label_postings, term, (seen,), wanted - len(page)))
+        if len(page) < wanted:
+            page.extend(
+                self._take_ordered(value_hits, self._value_postings, term, (seen, label_hits), wanted - len(page))
+            )
+        return total, [self._symbols[doc_id] for doc_id in page[offset:]]
+
+    def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[int, List[dict]]:
+        """(一致件数, 指定ページの銘柄リスト) を返す"""
+        terms = list(dict.fromkeys(normalize(query).split()))
+
+        if not terms:
+            # 検索語がない場合は、カテゴリ内の銘柄をID順に返す
+            doc_ids = self._by_category.get(category, []) if category is not None else self._all_by_id
+            return len(doc_ids), [self._symbols[doc_id] for doc_id in doc_ids[offset:offset + limit]]
+
+        category_ids = None
+        if category is not None:
+            category_ids = self._category_sets.get(category)
+            if not category_ids:
+                return 0, []
+
+        if len(terms) == 1:
+            return self._search_term(terms[0], category_ids, limit, offset)
+
+        # スペース区切りの検索語はすべてに一致するもの（AND）に絞り、一致の強さの合計で並べる
+        # 全検索語のn-gramのうち最も小さい2つのリストの共通部分だけを取り、残りの条件は候補の文字列で確かめる
+        postings = [] if category_ids is None else [category_ids]
+        for term in terms:
+            grams = [term] if len(term) <= 2 else [term[i:i + 2] for i in range(len(term) - 1)]
+            for gram in grams:
+                posting = self._text_grams.get(gram)
+                if not posting:
+                    return 0, []
+                postings.append(posting)
+        postings.sort(key=len)
+        texts = self._texts
+        matched = [
+            doc_id
+            for doc_id in postings[0] & postings[1]
+            if all(term in texts[doc_id] for term in terms)
+            and (category_ids is None or doc_id in category_ids)
+        ]
+
+        # 検索語ごとに、強さ k 以内の段階の数（5 - 強さ）を加点する。加点の合計が大きいほど順位の合計が小さい
+        # 1件ずつ順位を求めず、段階ごとの集合をまとめて数える
+        matched_set = set(matched)
+        bonus: Counter = Counter()
+        for term in terms:
+            reached: Set[int] = set()
+            for tier in self._tiers(term, matched_set):
+                reached |= tier
+                bonus.update(reached)
+        # 同点はID順（安定ソートなので、ID順に並べてから加点の降順に並べ直す）
+        matched.sort()
+        matched.sort(key=bonus.__getitem__, reverse=True)
+        return len(matched), [self._symbols[doc_id] for doc_id in matched[offset:offset + limit]]
@@ -0,0 +1,113 @@
+# api/symbol_snapshot.py
+import asyncio
+import gzip
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+import orjson
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from http_cache import make_etag
+from models import CatalogVersion, Symbol
+from symbol_search import SymbolSearchIndex
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_CATALOG = "symbols"
+
+
+@dataclass(frozen=True)
+class SymbolSnapshot:
+    version: int
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    count: int
+    search_index: SymbolSearchIndex
+
+
+async def get_catalog_version(session: AsyncSession, name: str = SYMBOL_CATALOG) -> int:
+    row = await session.get(CatalogVersion, name)
+    return row.version if row else 0
+
+
+def bump_catalog_version(session: Session, name: str = SYMBOL_CATALOG) -> int:
+    """カタログのバージョンを1つ進める（コミットは呼び出し側で行う）"""
+    row = session.get(CatalogVersion, name, with_for_update=True)
+    if row is None:
+        row = CatalogVersion(name=name, version=0)
+    row.version += 1
+    row.updated_at = datetime.now(timezone.utc)
+    session.add(row)
+    return row.version
+
+
+def encode_symbol_snapshot(payload: list, version: int) -> SymbolSnapshot:
+    # 区切りに空白を入れず、非ASCII文字はエスケープしない（json.dumps(ensure_ascii=False) と同じバイト列）
+    body = orjson.dumps(payload)
+    return SymbolSnapshot(
+        version=version,
+        body=body,
+        # mtime=0 で圧縮結果を決定的にする
+        gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+        etag=make_etag(body),
+        count=len(payload),
+        search_index=SymbolSearchIndex(payload),
+    )
+
+
+async def build_symbol_snapshot(session: AsyncSession, version: int) -> SymbolSnapshot:
+    rows = (await session.execute(
+        select(Symbol.id, Symbol.label, Symbol.value, Symbol.category).order_by(Symbol.id)
+    )).all()
+    payload = [
+        {"id": s.id, "label": s.label, "value": s.value, "category": s.category}
+        for s in rows
+    ]
+    # エンコード・圧縮・インデックス構築はCPUを使うので、イベントループを止めないよう別スレッドで行う
+    return await asyncio.to_thread(encode_symbol_snapshot, payload, version)
+
+
+class SymbolSnapshotCache:
+    """
+    /api/symbols のレスポンスを事前にエンコード・圧縮して保持するキャッシュ
+    検索用のインデックスも同じ銘柄データから一緒に構築する
+    カタログのバージョン行を一定間隔で確認し、変わっていれば再構築する
+    """
+
+    def __init__(self, check_interval: float = 10):
+        self.check_interval = check_interval
+        self._snapshot: Optional[SymbolSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, session: AsyncSession) -> SymbolSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return snapshot
+            version = await get_catalog_version(session)
+            if snapshot is None or snapshot.version != version:
+                snapshot = await build_symbol_snapshot(session, version)
+                self._snapshot = snapshot
+                logger.info(
+                    f"銘柄スナップショットを構築しました (version: {version}, count: {snapshot.count}, "
+                    f"bytes: {len(snapshot.body)}, gzip: {len(snapshot.gzip_body)})"
+                )
+            self._checked_at = time.monotonic()
+            return snapshot
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def invalidate(self) -> None:
+        self._snapshot = None
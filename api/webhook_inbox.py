@@ -0,0 +1,264 @@
+# api/webhook_inbox.py
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, exists, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics import WEBHOOK_PROCESSING_LAG
+from models import ProcessedWebhookEvent, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# イベントのペイロードを受け取って処理する関数。コミットはワーカーが行う
+EventHandler = Callable[[AsyncSession, dict], Awaitable[None]]
+
+# 次に処理するイベントを1件ロックして取り出す
+# 同じ ordering_key のより古いイベントが未処理（再試行待ちや他のワーカーが処理中のものを含む）なら取り出さない
+CLAIM_SQL = text("""
+SELECT e.* FROM webhookevent AS e
+WHERE e.status = 'pending'
+  AND e.next_attempt_at <= now()
+  AND NOT EXISTS (
+      SELECT 1 FROM webhookevent AS earlier
+      WHERE earlier.status = 'pending'
+        AND earlier.ordering_key = e.ordering_key
+        AND (earlier.event_created, earlier.id) < (e.event_created, e.id)
+  )
+ORDER BY e.event_created, e.id
+LIMIT 1
+FOR UPDATE OF e SKIP LOCKED
+""")
+
+
+class NonRetryableEventError(Exception):
+    """再試行しても成功しないイベント（ペイロードの不備など）。すぐに failed にする"""
+
+
+async def is_duplicate_event(session: AsyncSession, source: str, event_id: str) -> bool:
+    """処理済み、または受信箱で処理待ちのイベントなら True を返す"""
+    return (await session.execute(
+        select(or_(
+            exists().where(ProcessedWebhookEvent.source == source, ProcessedWebhookEvent.event_id == event_id),
+            exists().where(
+                WebhookEvent.event_id == event_id, WebhookEvent.source == source, WebhookEvent.status == "pending"
+            ),
+        ))
+    )).scalar_one()
+
+
+async def mark_event_processed(session: AsyncSession, source: str, event_id: str) -> bool:
+    """
+    イベントを処理済みとして台帳に記録する。既に記録されていれば False を返す
+    同じイベントを同時に処理しようとした場合、後の方は先の方のコミットを待ってから False になる
+    """
+    return (await session.execute(
+        pg_insert(ProcessedWebhookEvent)
+        .values(source=source, event_id=event_id, processed_at=datetime.now(timezone.utc))
+        .on_conflict_do_nothing()
+        .returning(ProcessedWebhookEvent.event_id)
+    )).scalar_one_or_none() is not None
+
+
+async def enqueue_event(
+    session: AsyncSession,
+    source: str,
+    event_id: str,
+    event_type: str,
+    payload: dict,
+    created: datetime,
+    ordering_key: Optional[str] = None,
+) -> WebhookEvent:
+    """検証済みのイベントを受信箱に追加する（コミットは呼び出し側で行う）"""
+    now = datetime.now(timezone.utc)
+    event = WebhookEvent(
+        source=source,
+        event_id=event_id,
+        event_type=event_type,
+        ordering_key=ordering_key,
+        event_created=created,
+        payload=payload,
+        next_attempt_at=now,
+        received_at=now,
+    )
+    session.add(event)
+    return event
+
+
+class WebhookWorkerPool:
+    """
+    受信箱のイベントを FOR UPDATE SKIP LOCKED で取り出して処理するワーカー群
+    - イベントの取り出し・処理・完了の記録を1つのトランザクションで行うため、途中で落ちても未処理に戻る
+    - 失敗したイベントは指数バックオフで再試行し、max_attempts 回失敗したら failed にする
+    - 処理済みのイベントIDを台帳に記録し、再送されたイベントは処理せずに duplicate にする
+    - 台帳と処理済みのイベントは retention_days を過ぎたら削除する
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        handlers: Dict[str, EventHandler],
+        concurrency: int = 4,
+        max_attempts: int = 8,
+        base_backoff_seconds: float = 5,
+        max_backoff_seconds: float = 3600,
+        poll_interval: float = 5,
+        retention_days: float = 30,
+        prune_interval: float = 3600,
+    ):
+        self.engine = engine
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** (attempts - 1))
+        # 同時に失敗したイベントの再試行が重ならないよう、ばらつきを持たせる
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _record_failure(self, session: AsyncSession, event_id: int, attempts: int, error: Exception) -> bool:
+        """失敗を記録し、再試行するなら True を返す"""
+        retryable = not isinstance(error, NonRetryableEventError) and attempts < self.max_attempts
+        now = datetime.now(timezone.utc)
+        await session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == event_id)
+            .values(
+                status="pending" if retryable else "failed",
+                attempts=attempts,
+                last_error=f"{type(error).__name__}: {error}"[:1000],
+                next_attempt_at=now + timedelta(seconds=self.backoff(attempts)) if retryable else now,
+            )
+        )
+        return retryable
+
+    async def process_next(self) -> bool:
+        """イベントを1件処理する。処理できるイベントがなければ False を返す"""
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            event = (await session.execute(select(WebhookEvent).from_statement(CLAIM_SQL))).scalars().first()
+            if event is None:
+                return False
+
+            event_id, attempts = event.id, event.attempts + 1
+            handler = self.handlers.get(event.source)
+            error: Optional[Exception] = None
+            duplicate = False
+            try:
+                if handler is None:
+                    raise NonRetryableEventError(f"Unknown webhook source: {event.source}")
+                # 失敗したときは処理による変更（台帳への記録を含む）だけを取り消し、
+                # イベントの行のロックは持ったまま結果を記録する
+                # （ロックを手放すと、失敗を記録する前に他のワーカーが同じイベントを取り出してしまう）
+                async with session.begin_nested():
+                    if await mark_event_processed(session, event.source, event.event_id):
+                        await handler(session, event.payload)
+                    else:
+                        duplicate = True
+            except Exception as e:
+                error = e
+
+            if error is None:
+                status = "duplicate" if duplicate else "done"
+                processed_at = datetime.now(timezone.utc)
+                await session.execute(
+                    update(WebhookEvent)
+                    .where(WebhookEvent.id == event_id)
+                    .values(status=status, attempts=attempts, processed_at=processed_at)
+                )
+                await session.commit()
+                WEBHOOK_PROCESSING_LAG.labels(event.source, status).observe(
+                    (processed_at - event.received_at).total_seconds()
+                )
+                return True
+
+            retryable = await self._record_failure(session, event_id, attempts, error)
+            await session.commit()
+            if retryable:
+                logger.warning(f"Webhookイベントの処理に失敗しました。再試行します (id: {event_id}, attempts: {attempts}): {error}")
+            else:
+                logger.error(f"Webhookイベントの処理を中止しました (id: {event_id}, attempts: {attempts}): {error}")
+                WEBHOOK_PROCESSING_LAG.labels(event.source, "failed").observe(
+                    (datetime.now(timezone.utc) - event.received_at).total_seconds()
+                )
+            return True
+
+    async def prune(self) -> int:
+        """保持期間を過ぎた台帳と処理済みのイベントを削除し、削除した行数を返す"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        async with AsyncSession(self.engine) as session:
+            ledger = await session.execute(
+                delete(ProcessedWebhookEvent).where(ProcessedWebhookEvent.processed_at < cutoff)
+            )
+            # 失敗したイベントは調査や再処理のために残す
+            events = await session.execute(
+                delete(WebhookEvent).where(
+                    WebhookEvent.status.in_(["done", "duplicate"]), WebhookEvent.processed_at < cutoff
+                )
+            )
+            await session.commit()
+        return ledger.rowcount + events.rowcount
+
+    async def _prune_loop(self) -> None:
+        while True:
+            try:
+                pruned = await self.prune()
+                if pruned:
+                    logger.info(f"処理済みのWebhookイベントを削除しました ({pruned} rows)")
+            except Exception as e:
+                logger.error(f"処理済みのWebhookイベントの削除に失敗しました: {e}", exc_info=True)
+            await asyncio.sleep(self.prune_interval)
+
+    async def drain(self) -> int:
+        """処理できるイベントがなくなるまで処理し、処理した件数を返す（リプレイやベンチマーク用）"""
+        counts = await asyncio.gather(*(self._drain_one_worker() for _ in range(self.concurrency)))
+        return sum(counts)
+
+    async def _drain_one_worker(self) -> int:
+        count = 0
+        while await self.process_next():
+            count += 1
+        return count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.process_next():
+                    continue
+            except Exception as e:
+                # DBへの接続断などでワーカーを止めない（イベントは未処理のまま残る）
+                logger.error(f"Webhookワーカーでエラーが発生しました: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def notify(self) -> None:
+        """新しいイベントを保存したことをワーカーに知らせる"""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run(), name=f"webhook-worker-{n}") for n in range(self.concurrency)
+            ]
+            if self._tasks:
+                self._tasks.append(asyncio.create_task(self._prune_loop(), name="webhook-prune"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -1,8 +1,8 @@
 //front/components/SymbolSearchModal.tsx
 "use client";
 
-import { useState, useMemo } from "react";
-import { useQuery } from "@tanstack/react-query";
+import { useState } from "react";
+import { keepPreviousData, useInfiniteQuery } from "@tanstack/react-query";
 import axios from "axios";
 import { Search, X } from "lucide-react";
 import { toast } from "sonner";
@@ -25,6 +25,7 @@ import {
   NORMAL_USER_MAX_CHARTS,
   PREMIUM_USER_MAX_CHARTS,
 } from "@/constants/config";
+import { useDebouncedValue } from "@/hooks/useDebouncedValue";
 
 type Props = {
   isOpen: boolean;
@@ -42,8 +43,23 @@ const TAB_DEFINITIONS = {
 };
 type TabKey = keyof typeof TAB_DEFINITIONS;
 
-const fetchSymbols = async (): Promise<Symbol[]> => {
-  const { data } = await axios.get(`${API_URL}/api/symbols`);
+// 1回の検索で取得する件数（続きは「さらに表示」で offset を進めて取得する）
+const SEARCH_PAGE_SIZE = 200;
+
+type SymbolSearchResponse = {
+  total: number;
+  items: Symbol[];
+};
+
+// 銘柄の絞り込みはサーバー側の検索インデックスで行う
+const searchSymbols = async (
+  query: string,
+  category: TabKey,
+  offset: number
+): Promise<SymbolSearchResponse> => {
+  const { data } = await axios.get(`${API_URL}/api/symbols/search`, {
+    params: { q: query, category, limit: SEARCH_PAGE_SIZE, offset },
+  });
   return data;
 };
 
@@ -58,44 +74,35 @@ export const SymbolSearchModal = ({
   const [searchQuery, setSearchQuery] = useState("");
   const [selectedSymbols, setSelectedSymbols] = useState<Symbol[]>([]);
 
-  const { data: allSymbols, isLoading } = useQuery({
-    queryKey: ["symbols"],
-    queryFn: fetchSymbols,
-  });
-
-  // カテゴリごとに銘柄をグループ化
-  const symbolsByCategory = useMemo(() => {
-    const groupedSymbols: Record<TabKey, Symbol[]> = {
-      japan: [],
-      us: [],
-      index: [],
-      fx: [],
-    };
-
-    if (!allSymbols) {
-      return groupedSymbols;
-    }
+  const debouncedQuery = useDebouncedValue(searchQuery.trim(), 200);
 
-    for (const symbol of allSymbols) {
-      const category = symbol.category as TabKey;
-      if (groupedSymbols[category]) {
-        groupedSymbols[category].push(symbol);
-      }
-    }
-    return groupedSymbols;
-  }, [allSymbols]);
+  const {
+    data: searchResult,
+    isLoading,
+    hasNextPage,
+    fetchNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
+    queryKey: ["symbols", "search", activeTab, debouncedQuery],
+    queryFn: ({ pageParam }) =>
+      searchSymbols(debouncedQuery, activeTab, pageParam),
+    initialPageParam: 0,
+    // 取得済みの件数が total に届くまで、次のページの offset を返す
+    getNextPageParam: (lastPage, allPages) => {
+      const loaded = allPages.reduce((n, page) => n + page.items.length, 0);
+      return lastPage.items.length > 0 && loaded < lastPage.total
+        ? loaded
+        : undefined;
+    },
+    enabled: isOpen,
+    staleTime: 1000 * 60 * 5,
+    // 入力中は前回の検索結果を表示したままにする
+    placeholderData: keepPreviousData,
+  });
 
-  const filteredSymbols = useMemo(() => {
-    const data = symbolsByCategory[activeTab] || [];
-    if (!searchQuery) {
-      return data;
-    }
-    return data.filter(
-      (symbol: Symbol) =>
-        symbol.label.toLowerCase().includes(searchQuery.toLowerCase()) ||
-        symbol.value.toLowerCase().includes(searchQuery.toLowerCase())
-    );
-  }, [activeTab, searchQuery, symbolsByCategory]);
+  const filteredSymbols =
+    searchResult?.pages.flatMap((page) => page.items) ?? [];
+  const totalSymbols = searchResult?.pages[0]?.total ?? 0;
 
   const handleSelectSymbol = (symbol: Symbol) => {
     // 既にダッシュボードに追加されているシンボルは選択不可にする
@@ -254,6 +261,21 @@ export const SymbolSearchModal = ({
                       );
                     })
                   )}
+                  {!isLoading && totalSymbols > filteredSymbols.length && (
+                    <div className="flex items-center justify-between gap-4 p-2 text-sm text-muted-foreground">
+                      <span>
+                        {`${totalSymbols}件中 ${filteredSymbols.length}件を表示しています`}
+                      </span>
+                      <Button
+                        variant="outline"
+                        size="sm"
+                        onClick={() => fetchNextPage()}
+                        disabled={!hasNextPage || isFetchingNextPage}
+                      >
+                        {isFetchingNextPage ? "読み込み中..." : "さらに表示"}
+                      </Button>
+                    </div>
+                  )}
                 </ScrollArea>
               </TabsContent>
             </Tabs>
@@ -0,0 +1,15 @@
+// front/hooks/useDebouncedValue.ts
+
+import { useEffect, useState } from "react";
+
+// 値の変更が delay ミリ秒落ち着いてから反映する（入力ごとのAPI呼び出しを抑える）
+export const useDebouncedValue = <T>(value: T, delay: number): T => {
+  const [debouncedValue, setDebouncedValue] = useState(value);
+
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedValue(value), delay);
+    return () => clearTimeout(timer);
+  }, [value, delay]);
+
+  return debouncedValue;
+};
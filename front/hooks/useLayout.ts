@@ -15,6 +15,48 @@ import { API_URL } from "@/constants/config";
 // APIから取得/APIへ送信するデータの型
 type LayoutData = Layouts;
 
+type LayoutItemKey = { i: string; breakpoint: string };
+type LayoutItemChange = LayoutItemKey &
+  Pick<LayoutItem, "x" | "y" | "w" | "h" | "symbol" | "label">;
+type LayoutPatch = { upserts: LayoutItemChange[]; removed: LayoutItemKey[] };
+
+const isSameItem = (a: LayoutItem, b: LayoutItem) =>
+  a.x === b.x &&
+  a.y === b.y &&
+  a.w === b.w &&
+  a.h === b.h &&
+  a.symbol === b.symbol &&
+  a.label === b.label;
+
+// 前回保存したレイアウトとの差分（追加・変更・削除されたアイテム）を求める
+const diffLayouts = (saved: Layouts, next: Layouts): LayoutPatch => {
+  const upserts: LayoutItemChange[] = [];
+  const removed: LayoutItemKey[] = [];
+  const breakpoints = new Set([...Object.keys(saved), ...Object.keys(next)]);
+
+  for (const breakpoint of breakpoints) {
+    const savedItems = new Map(
+      (saved[breakpoint] ?? []).map((item) => [item.i, item])
+    );
+    const nextIds = new Set<string>();
+
+    for (const item of next[breakpoint] ?? []) {
+      nextIds.add(item.i);
+      const savedItem = savedItems.get(item.i);
+      if (!savedItem || !isSameItem(savedItem, item)) {
+        const { i, x, y, w, h, symbol, label } = item;
+        upserts.push({ i, breakpoint, x, y, w, h, symbol, label });
+      }
+    }
+    for (const i of savedItems.keys()) {
+      if (!nextIds.has(i)) {
+        removed.push({ i, breakpoint });
+      }
+    }
+  }
+  return { upserts, removed };
+};
+
 export const useLayout = (defaultChartSizes: DefaultChartSizes) => {
   const queryClient = useQueryClient();
   const [layouts, setLayouts] = useState<Layouts>({});
@@ -34,10 +76,15 @@ export const useLayout = (defaultChartSizes: DefaultChartSizes) => {
     return data && Object.keys(data).length > 0 ? data : {};
   };
 
+  // 前回保存した状態との差分だけを送信する
   const saveLayoutApi = async (layouts: LayoutData): Promise<void> => {
+    const savedLayouts = queryClient.getQueryData<LayoutData>(["layouts"]) ?? {};
+    const patch = diffLayouts(savedLayouts, layouts);
+    if (patch.upserts.length === 0 && patch.removed.length === 0) return;
+
     const token = await getToken();
     if (!token) return;
-    await axios.post(`${API_URL}/api/layout`, layouts, {
+    await axios.patch(`${API_URL}/api/layout`, patch, {
       headers: { Authorization: `Bearer ${token}` },
     });
   };